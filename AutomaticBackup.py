@@ -1,316 +1,639 @@
-import tkinter as tk
-
-from configupdater import ConfigUpdater
-
-from BackupScripts.BackupThread import BackupThread
-from BackupScripts.Utils import *
-from BackupScripts.WindowIcon import WindowsIcon
-from Gui.ProfileWindow import ProfileWindow
-from Gui.Tk_AutoBackupGUI import AutomaticBackupGui
-
-# The Default Config for the Controller class if 'config.ini' file does not existing.
-DEFAULT_CONFIG = """
-[LOCAL]
-# Version #:
-version = 1.0
-# Shows notifications: ['True', 'False']
-do_notifications = True
-# Shows notification levels DEFAULT='all': ['all', 'error/alert', 'error']
-notify_level = all
-# Not used at the moment. DEFAULT=4
-max_threads = 4
-# Shows the GUI interface at start: ['True', 'False']
-silent_start = False
-# If true, logs everything to the 'log.csv' file: ['True', 'False']
-debug = False
-# Minimum copies set for backup rotate DEFAULT=1: integer
-min_copies = 1
-# Maximum copies set for backup rotate DEFAULT=8: integer
-max_copies = 8
-# Minimum interval (seconds) set for backup rotate DEFAULT=20: integer
-min_interval = 20
-# Maximum interval (seconds) set for backup rotate DEFAULT=10000: integer
-max_interval = 10000
-# Minimum warning time (seconds) the program will notify you prior to a backup commencing DEFAULT=10: integer
-min_warning_time = 10
-[AUTOSTART]
-# Starts a backup for a specified profile: ['True', 'False']
-enabled = False
-# The profile name created in the 'profiles.json' file to be backed up when auto start is 'True': string
-profile = """""
-
-
-class Controller:
-    """
-    Controller class that connects BackupThread, WindowsIcon, AutomaticBackupGui and ProfileWindow all together.
-    It also controls the auto-start feature of the program so Task Scheduler can be used to start 'Daily Backups'.
-    All parameters can be configured within the 'config.ini' file and some through the GUI.
-    This way the GUI class may be swapped out with other GUI frameworks like PyQT with minimal changes to this class.
-
-    If you want to use another GUI framework, AutomaticBackupGui and ProfileWindow will have to be rewritten or not used
-    at all.
-
-    BackupThread, WindowsIcon and parts of the Controller class is really all that's needed to start and create backups.
-    If no GUI is wanted, modifying the 5 lines of code specified with a comment above them is required.
-
-    All Profile configs are saved in the 'profiles.json' file and can be written into there and reloaded into the
-    WindowsIcon class.
-
-    Profile data setup is as specified:
-    {
-    "Profile-Name-To-Be-Set": {
-        "Folders": [
-            "Folder-0-path-to-be-backed-up",
-            "Folder-1-path-to-be-backed-up",
-            ...
-        ],
-        "Destination": "Path-to-Destination",
-        "Interval": 20,
-        "Copies": 2,
-        "Method": "Rotate",
-        "WarningTime": 10,
-        "Compression": true
-            }
-    }
-    """
-    _version = 1.0
-
-    def __init__(self, root=None):
-        self.recent_backup = ""
-        self.thread_running = False
-        self.notifications = False
-        self.notify_level = "all"
-        self.max_threads = 4
-        self.silent_start = False
-        self.auto_start = False
-        self.debug = False
-        self.min_copies = 1
-        self.max_copies = 8
-        self.min_interval = 20
-        self.max_interval = 10000
-        self.min_warning_time = 10
-        self.auto_start_profile = ""
-
-        self.config = ConfigUpdater()
-        try:
-            self.config.read(CONFIG_FILE)
-        except FileNotFoundError:
-            self.config.read_string(DEFAULT_CONFIG)
-            with open(CONFIG_FILE, 'w') as configfile:
-                self.config.write(configfile)
-
-        self.setup()
-
-        self.root = root
-        self.windows_icon = WindowsIcon(self, self.notifications, self.notify_level)
-        self.thread = BackupThread(self, self.windows_icon)
-
-        # ******* Comment this line and set 'gui' to None if no GUI is wanted. *******
-        self.gui = AutomaticBackupGui(self.root, self, self.windows_icon, self.silent_start)
-        # self.gui = None
-
-        # ******* Comment these lines and set 'profile_window' to None if no GUI is wanted. *******
-        self.profile_window = ProfileWindow(self.root, self)
-        self.profile_window.hide()
-        # self.profile_window = None
-        # ******* Comment this line if no GUI is wanted. *******
-        self.gui.show_gui()
-
-        if self.auto_start:
-            self.thread.backup_event.wait(1)
-            self.windows_icon.notify_user("ALERT:",
-                                          f"Autostart has been activated for profile: {self.auto_start_profile}",
-                                          override=True)
-            self.thread.backup_event.wait(2)
-            profiles = self.load_saved_profiles(initial_start=True)
-            config = profiles[self.auto_start_profile]
-            self.start_backup(config, self.auto_start_profile)
-
-    def setup(self):
-        try:
-            self.notifications = eval(self.config["LOCAL"].get("do_notifications").value)
-            self.notify_level = self.config["LOCAL"].get("notify_level").value
-            self.max_threads = int(self.config["LOCAL"].get("max_threads").value)
-            self.silent_start = eval(self.config["LOCAL"].get("silent_start").value)
-            self.debug = eval(self.config["LOCAL"].get("debug").value)
-            self.min_copies = int(self.config["LOCAL"].get("min_copies").value)
-            self.max_copies = int(self.config["LOCAL"].get("max_copies").value)
-            self.min_interval = int(self.config["LOCAL"].get("min_interval").value)
-            self.max_interval = int(self.config["LOCAL"].get("max_interval").value)
-            self.min_warning_time = int(self.config["LOCAL"].get("min_warning_time").value)
-
-            self.auto_start = eval(self.config["AUTOSTART"].get("enabled").value)
-            self.auto_start_profile = self.config["AUTOSTART"].get("profile").value
-        except Exception as e:
-            log(f"ERROR: {e}")
-            sys.exit(f"Config could not be loaded: {e}")
-
-    def update_gui_config(self, terminate=False):
-        self.config["AUTOSTART"]["enabled"].value = str(self.auto_start)
-        self.config["AUTOSTART"]["profile"].value = self.auto_start_profile
-        self.config["LOCAL"]["do_notifications"].value = str(self.notifications)
-        self.config["LOCAL"]["silent_start"].value = str(self.silent_start)
-        try:
-            self.config.update_file(validate=True)
-            if not terminate:
-                self.windows_icon.notify_user("INFO:", "Config has been updated.")
-        except Exception as e:
-            log(f"ERROR: {e}")
-            self.windows_icon.notify_user("ERROR:", "Config could not be updated.")
-
-    def enable_autostart(self, profile_name):
-        self.auto_start = True
-        self.auto_start_profile = profile_name
-        self.update_gui_config()
-
-    def disable_autostart(self):
-        self.auto_start = False
-        self.auto_start_profile = ""
-        self.update_gui_config()
-
-    def toggle_silent_start(self, state):
-        self.silent_start = state
-
-    def toggle_notifications(self, state):
-        self.notifications = state
-
-    def start_backup(self, config, profile_name):
-        self.thread.start(config, profile_name)
-
-    def stop_backup(self):
-        self.thread.stop_backup()
-
-    def create_profile_window(self, config=None, profile_name=None):
-        # If profile_window is not created with any GUI framework. Open 'profiles.json' file instead.
-        if self.profile_window is None:
-            open_config()
-            return
-        if config is not None and profile_name is not None:
-            self.profile_window.edit_profile(config, profile_name)
-            self.profile_window.show()
-            return
-        self.profile_window.show(clear=True)
-
-    def get_time_left(self):
-        return self.thread.get_time_left()
-
-    def verify_profiles(self, profile_data):
-        """Verifies all profile parameters according to spec."""
-        if not profile_data:
-            return False
-        try:
-            num_copies = int(profile_data["Copies"])
-            profile_data["Copies"] = num_copies
-            if num_copies < self.min_copies:
-                profile_data["Copies"] = self.min_copies
-            if num_copies > self.max_copies:
-                profile_data["Copies"] = self.max_copies
-        except ValueError:
-            profile_data["Copies"] = self.min_copies
-
-        try:
-            interval = int(profile_data["Interval"])
-            profile_data["Interval"] = interval
-            if interval < self.min_interval:
-                profile_data["Interval"] = self.min_interval
-            elif interval >= self.max_interval:
-                profile_data["Interval"] = self.max_interval
-        except ValueError:
-            profile_data["Interval"] = self.min_interval
-
-        try:
-            warning_time = int(profile_data["WarningTime"])
-            profile_data["WarningTime"] = warning_time
-            if profile_data["WarningTime"] >= profile_data["Interval"]:
-                profile_data["WarningTime"] = self.min_warning_time
-        except ValueError:
-            profile_data["WarningTime"] = self.min_warning_time
-
-        if profile_data["Method"] not in self.thread.get_backup_methods():
-            self.windows_icon.notify_user("ERROR:", "Backup Method does not exist.")
-            return False
-
-        if not profile_data["Destination"]:
-            self.windows_icon.notify_user("ERROR:", "Destination folder is not set.")
-            return False
-
-        if not profile_data["Folders"]:
-            self.windows_icon.notify_user("ERROR:", "No folders are set to backup.")
-            return False
-
-        try:
-            for i in profile_data["Folders"]:
-                if not os.path.exists(i):
-                    self.windows_icon.notify_user("ERROR:",
-                                                  "Folder paths do not exist, recommend deleting them from the config.")
-                    return False
-        except IndexError:
-            self.windows_icon.notify_user("ERROR:", "Source folder(s) is not set.")
-            return False
-
-        if not os.path.exists(profile_data["Destination"]):
-            self.windows_icon.notify_user("ERROR:",
-                                          "Destination path do not exist, recommend deleting them from the config.")
-            return False
-
-        if check_folders(profile_data["Folders"], profile_data["Destination"]):
-            self.windows_icon.notify_user("ERROR:", "Destination Path cannot be in folder as Source.")
-            return False
-
-        if len(profile_data["Folders"]) != len(set(profile_data["Folders"])):
-            self.windows_icon.notify_user("ERROR:",
-                                          "Duplicate folder paths have been set. Please modify profile accordingly.")
-            return False
-
-        return True
-
-    def update_profiles(self, profiles):
-        dump_json(PROFILE_PATH, profiles)
-        self.windows_icon.notify_user("INFO:", "Profile has been saved.")
-        self.load_saved_profiles()
-
-    def save_profile(self, config, profile_name):
-        if not profile_name:
-            self.windows_icon.notify_user("ERROR:", "No Profile Name set.")
-            return
-        if self.verify_profiles(config):
-            try:
-                new_profile = {profile_name: config}
-                if os.path.exists(PROFILE_PATH):
-                    old_profiles = read_config(PROFILE_PATH)
-                    new_profile = update_json(new_profile, old_profiles)
-                else:
-                    new_profile = new_profile
-                dump_json(PROFILE_PATH, new_profile)
-                self.windows_icon.notify_user("INFO:", "Profile has been saved.")
-                self.gui.load_saved_profiles()
-            except Exception as e:
-                self.windows_icon.notify_user("ERROR:", f"Profile could not be saved.")
-                self.windows_icon.notify_user("ERROR:", f"Unexpected error: {e}")
-
-    def load_saved_profiles(self, initial_start=False):
-        return self.windows_icon.load_saved_profiles(initial_start)
-
-    def terminate(self):
-        self.thread.stop_backup(no_message=True)
-        self.windows_icon.icon.stop()
-        if self.gui is not None:
-            self.update_gui_config(terminate=True)
-        # Not sure what's going on, but main thread doesn't close when root.destroy() is called. So this,
-        # is forcing everything to close after everything is saved.
-        os._exit(0)
-
-    def restart_gui(self):
-        if self.gui is None:
-            self.windows_icon.notify_user("ALERT:", "No GUI Framework exists.")
-            return
-        self.gui.show_gui()
-
-
-if __name__ == '__main__':
-    # ******* Comment this line and set 'tk_root' to None if no GUI is wanted. *******
-    tk_root = tk.Tk()
-    # tk_root = None
-    c = Controller(tk_root)
-    # ******* Comment this line if no GUI is wanted. *******
-    tk_root.mainloop()
+import multiprocessing
+import threading
+import tkinter as tk
+
+from configupdater import ConfigUpdater
+
+from BackupScripts.Catalog import BackupCatalog, restore_file
+from BackupScripts.Diff import diff_slots
+from BackupScripts.Encryption import Encryptor, encryption_available, get_key_path
+from BackupScripts.PageCache import CACHE_MODES
+from BackupScripts.Planner import plan_backup
+from BackupScripts.Storage import is_remote
+from BackupScripts.Utils import *
+from BackupScripts.Volumes import verify_slot
+from BackupScripts.WindowIcon import WindowsIcon
+from BackupScripts.Worker import BackupWorker
+from Gui.CatalogWindow import CatalogWindow
+from Gui.DiffWindow import DiffWindow
+from Gui.ProfileWindow import ProfileWindow
+from Gui.Tk_AutoBackupGUI import AutomaticBackupGui
+
+# The Default Config for the Controller class if 'config.ini' file does not existing.
+DEFAULT_CONFIG = """
+[LOCAL]
+# Version #:
+version = 1.0
+# Shows notifications: ['True', 'False']
+do_notifications = True
+# Shows notification levels DEFAULT='all': ['all', 'error/alert', 'error']
+notify_level = all
+# Seconds to wait for more notifications so a burst is shown as one summary DEFAULT=2: integer
+notify_coalesce_seconds = 2
+# Threads used to scan folders before a backup. DEFAULT=4
+max_threads = 4
+# Shows the GUI interface at start: ['True', 'False']
+silent_start = False
+# If true, logs everything to the 'log.csv' file: ['True', 'False']
+debug = False
+# Profiles backup cycles and writes reports into the 'profiling' folder, also toggled from the tray: ['True', 'False']
+profiling = False
+# Only every Nth backup cycle is profiled while profiling is on DEFAULT=1: integer
+profiling_sample_every = 1
+# Also compares memory allocations between profiled cycles (slower): ['True', 'False']
+profiling_memory = True
+# Number of functions and allocations listed in each report DEFAULT=25: integer
+profiling_top = 25
+# Defers backup cycles and slows backups down while the host is busy (Linux/macOS only): ['True', 'False']
+load_aware = True
+# Host is busy above this 1 minute load average per CPU DEFAULT=1.5: float
+load_max_per_cpu = 1.5
+# Host is busy while its busiest disk is doing I/O more than this percent of the time DEFAULT=90: integer
+load_max_disk_busy = 90
+# Host is busy while tasks are stalled on memory or I/O more than this percent of the time DEFAULT=20: integer
+load_max_pressure = 20
+# Longest a backup cycle is deferred (seconds), it starts anyway after that DEFAULT=1800: integer (0 to never defer)
+load_max_deferral = 1800
+# Slowest a running backup is throttled to (megabytes per second) while the host is busy DEFAULT=5: integer
+load_min_rate_mb = 5
+# How backups use the page cache. 'drop' drops the files backed up from it once they're read or written, so the
+# working set of everything else stays cached, 'direct' also reads them with O_DIRECT (Linux only), 'keep' leaves it to
+# the OS DEFAULT=drop: ['keep', 'drop', 'direct']
+cache_mode = drop
+# Learns the fastest workers, chunk size and compression level for each destination, kept in 'tuning.json':
+# ['True', 'False']
+auto_tune = True
+# Most of the CPUs (percent) backups are tuned to use DEFAULT=50: integer
+tuning_cpu_budget = 50
+# Megabytes written to a new destination, in each of a few chunk sizes, to calibrate it DEFAULT=16: integer
+tuning_calibration_mb = 16
+# Keeps a journal of the folders backed up in the 'journals' folder, scans only list the folders that changed since
+# the last one. Changes are watched for between backups (needs the 'watchdog' package) or found from the times of the
+# folders, files changed in place without the watcher are only seen by the next full scan: ['True', 'False']
+change_journal = False
+# Hours between full scans of the folders, catching anything the journal missed DEFAULT=24: integer (0 for never)
+journal_full_scan_hours = 24
+# Minimum copies set for backup rotate DEFAULT=1: integer
+min_copies = 1
+# Maximum copies set for backup rotate DEFAULT=8: integer
+max_copies = 8
+# Minimum interval (seconds) set for backup rotate DEFAULT=20: integer
+min_interval = 20
+# Maximum interval (seconds) set for backup rotate DEFAULT=10000: integer
+max_interval = 10000
+# Minimum warning time (seconds) the program will notify you prior to a backup commencing DEFAULT=10: integer
+min_warning_time = 10
+# Maximum files per second deleted from old backups in the background DEFAULT=500: integer (0 for no limit)
+reaper_files_per_second = 500
+# Maximum megabytes per second deleted from old backups in the background DEFAULT=100: integer (0 for no limit)
+reaper_mb_per_second = 100
+# Url of an S3 compatible server for 's3://bucket/prefix' destinations, empty for Amazon S3: string
+s3_endpoint_url =
+# Connections kept open to the S3 server, uploads run in parallel on them DEFAULT=10: integer
+s3_max_connections = 10
+# Size (megabytes) of each part of a multipart upload, minimum of 5 DEFAULT=8: integer
+s3_part_size_mb = 8
+# Attempts made for each S3 request before it fails DEFAULT=5: integer
+s3_max_retries = 5
+[AUTOSTART]
+# Starts a backup for a specified profile: ['True', 'False']
+enabled = False
+# The profile name created in the 'profiles.json' file to be backed up when auto start is 'True': string
+profile = """""
+
+
+class Controller:
+    """
+    Controller class that connects BackupThread, WindowsIcon, AutomaticBackupGui and ProfileWindow all together.
+    It also controls the auto-start feature of the program so Task Scheduler can be used to start 'Daily Backups'.
+    All parameters can be configured within the 'config.ini' file and some through the GUI.
+    This way the GUI class may be swapped out with other GUI frameworks like PyQT with minimal changes to this class.
+
+    If you want to use another GUI framework, AutomaticBackupGui and ProfileWindow will have to be rewritten or not used
+    at all.
+
+    BackupThread, WindowsIcon and parts of the Controller class is really all that's needed to start and create backups.
+    If no GUI is wanted, modifying the 5 lines of code specified with a comment above them is required.
+
+    All Profile configs are saved in the 'profiles.json' file and can be written into there and reloaded into the
+    WindowsIcon class.
+
+    Profile data setup is as specified:
+    {
+    "Profile-Name-To-Be-Set": {
+        "Folders": [
+            "Folder-0-path-to-be-backed-up",
+            "Folder-1-path-to-be-backed-up",
+            ...
+        ],
+        "Destination": "Path-to-Destination" or ["Path-to-Destination-0", "Path-to-Destination-1", ...],
+        "Interval": 20,
+        "Copies": 2,
+        "Method": "Rotate",
+        "WarningTime": 10,
+        "Compression": true,
+        "Encryption": false,
+        "VolumeSize": 0,
+        "SplitFolders": false,
+        "PackThreshold": 0
+            }
+    }
+    'VolumeSize' (MB) and 'SplitFolders' split a compressed backup into volumes, 0 and false for a single zip.
+    'PackThreshold' (KB) packs the files smaller than it into pack files in a copied backup, 0 to copy every file.
+    """
+    _version = 1.0
+
+    def __init__(self, root=None):
+        self.recent_backup = ""
+        self.thread_running = False
+        self.notifications = False
+        self.notify_level = "all"
+        self.notify_coalesce_seconds = 2
+        self.max_threads = 4
+        self.silent_start = False
+        self.auto_start = False
+        self.debug = False
+        self.profiling = False
+        self.profiling_sample_every = 1
+        self.profiling_memory = True
+        self.profiling_top = 25
+        self.min_copies = 1
+        self.max_copies = 8
+        self.min_interval = 20
+        self.max_interval = 10000
+        self.min_warning_time = 10
+        self.reaper_files_per_second = 500
+        self.reaper_bytes_per_second = 100 * 1024 * 1024
+        self.s3_settings = {}
+        self.load_settings = {}
+        self.cache_mode = "drop"
+        self.tuning_settings = {}
+        self.journal_settings = {}
+        self.auto_start_profile = ""
+
+        self.config = ConfigUpdater()
+        try:
+            self.config.read(CONFIG_FILE)
+        except FileNotFoundError:
+            self.config.read_string(DEFAULT_CONFIG)
+            with open(CONFIG_FILE, 'w') as configfile:
+                self.config.write(configfile)
+
+        self.setup()
+
+        self.catalog = BackupCatalog(CATALOG_DB)
+
+        self.root = root
+        # Tk widgets may only be built and changed from the thread running 'mainloop', see 'on_gui_thread'.
+        self.gui_thread = threading.get_ident()
+        self.windows_icon = WindowsIcon(self, self.notifications, self.notify_level)
+        # Backups run in a worker process, 'self.thread' passes commands to it and its progress back.
+        self.thread = BackupWorker(self, self.windows_icon, self.get_worker_settings())
+        # Picks up any old backups that were still waiting to be deleted, or were half written, when the program last
+        # closed.
+        self.thread.recover([destination for profile in self.load_saved_profiles(initial_start=True).values()
+                             for destination in get_destinations(profile)
+                             if not is_remote(destination) and os.path.isdir(destination)])
+
+        # ******* Set a window's type to None if no GUI is wanted for it. *******
+        # Windows are only built the first time they're shown, see 'get_window'.
+        self.window_types = {"gui": AutomaticBackupGui, "profile_window": ProfileWindow,
+                             "catalog_window": CatalogWindow, "diff_window": DiffWindow}
+        self.gui = None
+        self.profile_window = None
+        self.catalog_window = None
+        self.diff_window = None
+        if self.silent_start or self.window_types["gui"] is None:
+            # Nothing is built until the GUI is first opened from the tray.
+            if self.root is not None:
+                self.root.withdraw()
+            self.windows_icon.notify_user("INFO:", "Auto Backup is running in background.", override=True)
+        else:
+            self.get_window("gui").show_gui()
+
+        if self.auto_start:
+            self.thread.backup_event.wait(1)
+            self.windows_icon.notify_user("ALERT:",
+                                          f"Autostart has been activated for profile: {self.auto_start_profile}",
+                                          override=True)
+            self.thread.backup_event.wait(2)
+            profiles = self.load_saved_profiles(initial_start=True)
+            config = profiles[self.auto_start_profile]
+            self.start_backup(config, self.auto_start_profile)
+
+    def setup(self):
+        try:
+            self.notifications = eval(self.config["LOCAL"].get("do_notifications").value)
+            self.notify_level = self.config["LOCAL"].get("notify_level").value
+            self.notify_coalesce_seconds = int(self.get_option("LOCAL", "notify_coalesce_seconds", 2))
+            self.max_threads = int(self.config["LOCAL"].get("max_threads").value)
+            self.silent_start = eval(self.config["LOCAL"].get("silent_start").value)
+            self.debug = eval(self.config["LOCAL"].get("debug").value)
+            self.profiling = eval(self.get_option("LOCAL", "profiling", "False"))
+            self.profiling_sample_every = int(self.get_option("LOCAL", "profiling_sample_every", 1))
+            self.profiling_memory = eval(self.get_option("LOCAL", "profiling_memory", "True"))
+            self.profiling_top = int(self.get_option("LOCAL", "profiling_top", 25))
+            self.min_copies = int(self.config["LOCAL"].get("min_copies").value)
+            self.max_copies = int(self.config["LOCAL"].get("max_copies").value)
+            self.min_interval = int(self.config["LOCAL"].get("min_interval").value)
+            self.max_interval = int(self.config["LOCAL"].get("max_interval").value)
+            self.min_warning_time = int(self.config["LOCAL"].get("min_warning_time").value)
+            self.reaper_files_per_second = int(self.get_option("LOCAL", "reaper_files_per_second", 500))
+            self.reaper_bytes_per_second = int(self.get_option("LOCAL", "reaper_mb_per_second", 100)) * 1024 * 1024
+            self.s3_settings = {
+                "endpoint_url": self.get_option("LOCAL", "s3_endpoint_url", ""),
+                "max_connections": int(self.get_option("LOCAL", "s3_max_connections", 10)),
+                "part_size": int(self.get_option("LOCAL", "s3_part_size_mb", 8)) * 1024 * 1024,
+                "max_retries": int(self.get_option("LOCAL", "s3_max_retries", 5))
+            }
+
+            self.load_settings = {
+                "enabled": eval(self.get_option("LOCAL", "load_aware", "True")),
+                "max_load": float(self.get_option("LOCAL", "load_max_per_cpu", 1.5)),
+                "max_disk_busy": int(self.get_option("LOCAL", "load_max_disk_busy", 90)),
+                "max_pressure": int(self.get_option("LOCAL", "load_max_pressure", 20)),
+                "max_deferral": int(self.get_option("LOCAL", "load_max_deferral", 1800)),
+                "min_rate": int(self.get_option("LOCAL", "load_min_rate_mb", 5)) * 1024 * 1024
+            }
+            self.cache_mode = self.get_option("LOCAL", "cache_mode", "drop")
+            if self.cache_mode not in CACHE_MODES:
+                raise ValueError(f"cache_mode has to be one of {', '.join(CACHE_MODES)}")
+            self.tuning_settings = {
+                "enabled": eval(self.get_option("LOCAL", "auto_tune", "True")),
+                "cpu_budget": int(self.get_option("LOCAL", "tuning_cpu_budget", 50)),
+                "calibration_mb": int(self.get_option("LOCAL", "tuning_calibration_mb", 16))
+            }
+            self.journal_settings = {
+                "enabled": eval(self.get_option("LOCAL", "change_journal", "False")),
+                "full_scan_hours": int(self.get_option("LOCAL", "journal_full_scan_hours", 24))
+            }
+
+            self.auto_start = eval(self.config["AUTOSTART"].get("enabled").value)
+            self.auto_start_profile = self.config["AUTOSTART"].get("profile").value
+        except Exception as e:
+            log(f"ERROR: {e}")
+            sys.exit(f"Config could not be loaded: {e}")
+
+    def get_worker_settings(self):
+        """The config options the backup worker process needs, see 'run_worker'."""
+        return {
+            "max_threads": self.max_threads,
+            "min_warning_time": self.min_warning_time,
+            "reaper_files_per_second": self.reaper_files_per_second,
+            "reaper_bytes_per_second": self.reaper_bytes_per_second,
+            "s3_settings": self.s3_settings,
+            "profiling": {"enabled": self.profiling, "sample_every": self.profiling_sample_every,
+                          "trace_memory": self.profiling_memory, "top": self.profiling_top},
+            "load": self.load_settings,
+            "cache_mode": self.cache_mode,
+            "tuning": self.tuning_settings,
+            "journal": self.journal_settings
+        }
+
+    def get_option(self, section, key, default):
+        """Returns the value of an option, or 'default' if it's missing from a 'config.ini' made by an older version."""
+        option = self.config[section].get(key)
+        if option is None:
+            return default
+        return option.value
+
+    def update_gui_config(self, terminate=False):
+        self.config["AUTOSTART"]["enabled"].value = str(self.auto_start)
+        self.config["AUTOSTART"]["profile"].value = self.auto_start_profile
+        self.config["LOCAL"]["do_notifications"].value = str(self.notifications)
+        self.config["LOCAL"]["silent_start"].value = str(self.silent_start)
+        try:
+            self.config.update_file(validate=True)
+            if not terminate:
+                self.windows_icon.notify_user("INFO:", "Config has been updated.")
+        except Exception as e:
+            log(f"ERROR: {e}")
+            self.windows_icon.notify_user("ERROR:", "Config could not be updated.")
+
+    def enable_autostart(self, profile_name):
+        self.auto_start = True
+        self.auto_start_profile = profile_name
+        self.update_gui_config()
+
+    def disable_autostart(self):
+        self.auto_start = False
+        self.auto_start_profile = ""
+        self.update_gui_config()
+
+    def toggle_silent_start(self, state):
+        self.silent_start = state
+
+    def toggle_notifications(self, state):
+        self.notifications = state
+
+    def toggle_profiling(self, state):
+        """Turns profiling of backup cycles on/off, the running backup picks it up on its next cycle."""
+        self.profiling = state
+        self.thread.set_profiling(state)
+
+    def start_backup(self, config, profile_name):
+        self.thread.start(config, profile_name)
+
+    def stop_backup(self):
+        self.thread.stop_backup()
+
+    def plan_backup(self, config, profile_name):
+        """Estimates what one backup of the profile will cost without writing anything.
+        Can take a while on big folders, so call it off the GUI thread.
+        :returns: BackupPlan or None if the profile isn't valid"""
+        if not self.verify_profiles(config):
+            return None
+        return plan_backup(config, profile_name, self.max_threads, self.thread.get_storages(config))
+
+    def get_encryptor(self, profile_name):
+        """Returns an Encryptor to read the backups of a profile with, None if the profile never had a key."""
+        if not os.path.exists(get_key_path(profile_name)) or not encryption_available():
+            return None
+        with open(get_key_path(profile_name), 'rb') as file:
+            return Encryptor(file.read(), self.max_threads)
+
+    def restore_files(self, entries, dst_folder):
+        """Restores files found in the catalog into 'dst_folder'. Can take a while, so call it off the GUI thread."""
+        restored = 0
+        for entry in entries:
+            encryptor = self.get_encryptor(entry["profile"])
+            try:
+                restore_file(entry, self.thread.get_storage(entry["destination"]), dst_folder, encryptor)
+                restored += 1
+            except Exception as e:
+                self.windows_icon.notify_user("ERROR:", f"{entry['path']} could not be restored from "
+                                                        f"{entry['slot']}: {e}")
+                log(f"ERROR: Restore of {entry['path']} from {entry['destination']} failed: {e}")
+            finally:
+                if encryptor is not None:
+                    encryptor.shutdown()
+        self.windows_icon.notify_user("INFO:", f"{restored} of {len(entries)} file(s) restored to: {dst_folder}")
+
+    def on_gui_thread(self, command, *args):
+        """True when called from the thread running Tk (or without a GUI). Otherwise, like from the tray icon's menu,
+        schedules 'command' with 'args' on Tk's thread with 'root.after' and returns False."""
+        if self.root is None or threading.get_ident() == self.gui_thread:
+            return True
+        self.root.after(0, command, *args)
+        return False
+
+    def get_window(self, name):
+        """Returns the window 'name' of 'window_types' (also set as the attribute of that name), building it the first
+        time it's asked for. None if no GUI is wanted for it. Only call it on Tk's thread, see 'on_gui_thread'."""
+        window = getattr(self, name)
+        if window is None and self.window_types[name] is not None:
+            if name == "gui":
+                window = self.window_types[name](self.root, self, self.windows_icon, self.silent_start)
+            else:
+                window = self.window_types[name](self.root, self)
+            setattr(self, name, window)
+        return window
+
+    def create_catalog_window(self):
+        if not self.on_gui_thread(self.create_catalog_window):
+            return
+        window = self.get_window("catalog_window")
+        if window is None:
+            self.windows_icon.notify_user("ALERT:", "No GUI Framework exists.")
+            return
+        window.show()
+
+    def create_diff_window(self, config, profile_name):
+        if not self.on_gui_thread(self.create_diff_window, config, profile_name):
+            return
+        window = self.get_window("diff_window")
+        if window is None:
+            self.windows_icon.notify_user("ALERT:", "No GUI Framework exists.")
+            return
+        window.show(config, profile_name)
+
+    def list_backup_slots(self, config, profile_name):
+        """The backups of a profile on each of its destinations, to pick two to compare. Call it off the GUI thread.
+        :returns: dict: {destination: [slot, ...]} the slots of each folder newest first, destinations without
+        backups are left out"""
+        names = [profile_name] if config["Compression"] else config["Folders"]
+        slots = {}
+        for destination, storage in self.thread.get_storages(config).items():
+            if not storage.is_available():
+                continue
+            found = []
+            for name in names:
+                copies = storage.get_copies(name)
+                found += sorted(copies, key=copies.get, reverse=True)
+            if found:
+                slots[destination] = found
+        return slots
+
+    def diff_backups(self, destination, old_slot, new_slot):
+        """What changed between two backups of the same folder or profile, see 'Diff.diff_slots'. Read from the
+        catalog when it has both, otherwise from the zips' central directories or the copied files' metadata."""
+        return diff_slots(self.thread.get_storage(destination), old_slot, new_slot, self.catalog)
+
+    def verify_backup(self, config, profile_name):
+        """Checks the newest compressed backup of the profile on every destination, split backups one volume at a
+        time. Can take a while, so call it off the GUI thread.
+        :returns: dict: {destination: [problems found]}, None if the profile isn't valid or isn't compressed"""
+        if not self.verify_profiles(config):
+            return None
+        if not config["Compression"]:
+            self.windows_icon.notify_user("ALERT:", "Only compressed backups can be verified.")
+            return None
+        encryptor = self.get_encryptor(profile_name)
+        results = {}
+        for destination, storage in self.thread.get_storages(config).items():
+            if not storage.is_available() or not storage.find_copies(profile_name):
+                continue
+            copies = storage.get_copies(profile_name)
+            newest = max(copies, key=copies.get)
+            results[destination] = verify_slot(storage, newest, encryptor)
+        if encryptor is not None:
+            encryptor.shutdown()
+        for destination, problems in results.items():
+            if problems:
+                self.windows_icon.notify_user("ERROR:", f"Backup on {destination} is damaged:\n" + "\n".join(problems))
+                log(f"ERROR: Verify of {destination} failed: {'; '.join(problems)}")
+            else:
+                self.windows_icon.notify_user("INFO:", f"Backup on {destination} verified.")
+        return results
+
+    def create_profile_window(self, config=None, profile_name=None):
+        if not self.on_gui_thread(self.create_profile_window, config, profile_name):
+            return
+        # If profile_window is not created with any GUI framework. Open 'profiles.json' file instead.
+        window = self.get_window("profile_window")
+        if window is None:
+            open_config()
+            return
+        if config is not None and profile_name is not None:
+            window.edit_profile(config, profile_name)
+            window.show()
+            return
+        window.show(clear=True)
+
+    def get_time_left(self):
+        return self.thread.get_time_left()
+
+    def get_progress(self):
+        """Returns the latest progress snapshot of the running backup, safe to call from any thread."""
+        return self.thread.progress.latest()
+
+    def drain_progress(self):
+        """Returns the newest progress snapshot published since the last call, or None. Meant to be polled by the GUI
+        from its own thread."""
+        return self.thread.progress.drain()
+
+    def verify_profiles(self, profile_data):
+        """Verifies all profile parameters according to spec."""
+        if not profile_data:
+            return False
+        try:
+            num_copies = int(profile_data["Copies"])
+            profile_data["Copies"] = num_copies
+            if num_copies < self.min_copies:
+                profile_data["Copies"] = self.min_copies
+            if num_copies > self.max_copies:
+                profile_data["Copies"] = self.max_copies
+        except ValueError:
+            profile_data["Copies"] = self.min_copies
+
+        try:
+            interval = int(profile_data["Interval"])
+            profile_data["Interval"] = interval
+            if interval < self.min_interval:
+                profile_data["Interval"] = self.min_interval
+            elif interval >= self.max_interval:
+                profile_data["Interval"] = self.max_interval
+        except ValueError:
+            profile_data["Interval"] = self.min_interval
+
+        try:
+            warning_time = int(profile_data["WarningTime"])
+            profile_data["WarningTime"] = warning_time
+            if profile_data["WarningTime"] >= profile_data["Interval"]:
+                profile_data["WarningTime"] = self.min_warning_time
+        except ValueError:
+            profile_data["WarningTime"] = self.min_warning_time
+
+        try:
+            profile_data["VolumeSize"] = max(int(profile_data.get("VolumeSize", 0) or 0), 0)
+        except ValueError:
+            profile_data["VolumeSize"] = 0
+
+        try:
+            profile_data["PackThreshold"] = max(int(profile_data.get("PackThreshold", 0) or 0), 0)
+        except ValueError:
+            profile_data["PackThreshold"] = 0
+
+        if profile_data["Method"] not in self.thread.get_backup_methods():
+            self.windows_icon.notify_user("ERROR:", "Backup Method does not exist.")
+            return False
+
+        destinations = get_destinations(profile_data)
+        if not destinations:
+            self.windows_icon.notify_user("ERROR:", "Destination folder is not set.")
+            return False
+
+        if not profile_data["Folders"]:
+            self.windows_icon.notify_user("ERROR:", "No folders are set to backup.")
+            return False
+
+        try:
+            for i in profile_data["Folders"]:
+                if not os.path.exists(i):
+                    self.windows_icon.notify_user("ERROR:",
+                                                  "Folder paths do not exist, recommend deleting them from the config.")
+                    return False
+        except IndexError:
+            self.windows_icon.notify_user("ERROR:", "Source folder(s) is not set.")
+            return False
+
+        # One missing destination (unplugged disk) doesn't stop the others from being backed up to.
+        missing = [i for i in destinations if not is_remote(i) and not os.path.exists(i)]
+        if len(missing) == len(destinations):
+            self.windows_icon.notify_user("ERROR:",
+                                          "Destination path do not exist, recommend deleting them from the config.")
+            return False
+        if missing:
+            self.windows_icon.notify_user("ALERT:", f"Destination path(s) can not be reached and will be skipped: "
+                                                    f"{', '.join(missing)}")
+
+        for destination in destinations:
+            if not is_remote(destination) and check_folders(profile_data["Folders"], destination):
+                self.windows_icon.notify_user("ERROR:", "Destination Path cannot be in folder as Source.")
+                return False
+
+        if len(destinations) != len(set(destinations)):
+            self.windows_icon.notify_user("ERROR:", "Duplicate destination paths have been set. "
+                                                    "Please modify profile accordingly.")
+            return False
+
+        if len(profile_data["Folders"]) != len(set(profile_data["Folders"])):
+            self.windows_icon.notify_user("ERROR:",
+                                          "Duplicate folder paths have been set. Please modify profile accordingly.")
+            return False
+
+        if profile_data.get("Encryption", False) and not encryption_available():
+            self.windows_icon.notify_user("ERROR:", "Encryption needs the 'cryptography' package to be installed.")
+            return False
+
+        return True
+
+    def update_profiles(self, profiles):
+        dump_json(PROFILE_PATH, profiles)
+        self.windows_icon.notify_user("INFO:", "Profile has been saved.")
+        self.load_saved_profiles()
+
+    def save_profile(self, config, profile_name):
+        if not profile_name:
+            self.windows_icon.notify_user("ERROR:", "No Profile Name set.")
+            return
+        if self.verify_profiles(config):
+            try:
+                new_profile = {profile_name: config}
+                if os.path.exists(PROFILE_PATH):
+                    old_profiles = read_config(PROFILE_PATH)
+                    new_profile = update_json(new_profile, old_profiles)
+                else:
+                    new_profile = new_profile
+                dump_json(PROFILE_PATH, new_profile)
+                self.windows_icon.notify_user("INFO:", "Profile has been saved.")
+                if self.gui is not None:
+                    self.gui.load_saved_profiles()
+            except Exception as e:
+                self.windows_icon.notify_user("ERROR:", f"Profile could not be saved.")
+                self.windows_icon.notify_user("ERROR:", f"Unexpected error: {e}")
+
+    def load_saved_profiles(self, initial_start=False):
+        return self.windows_icon.load_saved_profiles(initial_start)
+
+    def terminate(self):
+        # Stops the backup and waits for the worker process to exit before everything is forced closed below, the
+        # slot it was writing is discarded. One left behind by a worker that had to be killed is cleaned up on the next
+        # start.
+        self.thread.shutdown()
+        self.windows_icon.icon.stop()
+        if self.window_types["gui"] is not None:
+            self.update_gui_config(terminate=True)
+        # Not sure what's going on, but main thread doesn't close when root.destroy() is called. So this,
+        # is forcing everything to close after everything is saved.
+        os._exit(0)
+
+    def restart_gui(self):
+        if not self.on_gui_thread(self.restart_gui):
+            return
+        gui = self.get_window("gui")
+        if gui is None:
+            self.windows_icon.notify_user("ALERT:", "No GUI Framework exists.")
+            return
+        gui.show_gui()
+
+
+if __name__ == '__main__':
+    # Lets the backup worker process start from a frozen (pyinstaller) executable.
+    multiprocessing.freeze_support()
+    # ******* Comment this line and set 'tk_root' to None if no GUI is wanted. *******
+    tk_root = tk.Tk()
+    # tk_root = None
+    c = Controller(tk_root)
+    # ******* Comment this line if no GUI is wanted. *******
+    tk_root.mainloop()
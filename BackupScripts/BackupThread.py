@@ -1,207 +1,479 @@
-import os.path
-import shutil
-import threading
-import time
-
-from .Utils import *
-
-
-# TODO: Add multi-threading.
-#  Create a separate program to be ran with only icon, maybe a gui for setting up folders?
-#  Add Zip compression for backups
-class BackupThread:
-    """Backup Thread class that's responsible for handling the backups of folders/files."""
-    # These are the backup methods available to be called for backing up folders/files.
-    _backup_methods = ["Rotate", "Daily"]
-
-    def __init__(self, controller, icon):
-        self.controller = controller
-        self.backup_event = threading.Event()
-
-        self.config_data = {}
-        self.method = ""
-        self.windows_icon = icon
-        self.warning_time = self.controller.min_warning_time
-
-        self.backup_process = None
-        self.threads = []
-        self.cur_profile = ""
-        self.log_dest_folders = []
-        self.compression = False
-        self.exit_on_complete = False
-
-        self.last_update_time = 0
-
-    def start(self, config, profile_name):
-        """Start method for starting a thread of a backup sequence."""
-        # Check if there is a backup already active.
-        if self.backup_process and self.backup_process.is_alive():
-            self.windows_icon.notify_user("ERROR:", "Cannot start backup. There is an active process.")
-            return
-        self.cur_profile = profile_name
-        self.config_data = config
-
-        # Verify the profile config is correct prior to starting backup sequence.
-        if self.controller.verify_profiles(self.config_data):
-            self.method = self.config_data["Method"]
-            self.warning_time = self.config_data["WarningTime"]
-            self.compression = self.config_data["Compression"]
-            self.windows_icon.config_data = self.config_data
-            # Add here for new methods of backups.
-            if self.method == "Rotate":
-                self.backup_process = threading.Thread(target=self.rotate_backup, daemon=True)
-            elif self.method == "Daily":
-                self.exit_on_complete = True
-                self.backup_process = threading.Thread(target=self.daily_backup, daemon=True)
-            self.backup_process.start()
-            self.controller.thread_running = True
-
-    def get_backup_methods(self):
-        """Returns a list of all the backup_methods supported. (Specified at beginning of class)"""
-        return self._backup_methods
-
-    def get_time_left(self):
-        """Returns the amount of time left before the next backup used in the rotate_backup method."""
-        time_passed = int(time.time() - self.last_update_time)
-        return self.config_data["Interval"] - time_passed
-
-    def get_last_folder_digit(self, folder_path):
-        """Gets the last digit on the oldest folder found in the destination path, Deletes the oldest folder if the
-        number of copies is greater than the set number of copies.
-        :returns: int: last_folder_digit """
-        copies_made = find_copies(self.config_data["Destination"], folder_path)
-        if copies_made == 0:
-            last_folder_digit = 0
-        else:
-            oldest_folder = find_oldest_folder(self.config_data["Destination"], folder_path)
-            tmp_oldest_folder = os.path.splitext(oldest_folder)
-            last_folder_digit = int(tmp_oldest_folder[0][len(tmp_oldest_folder[0]) - 1:])
-            if copies_made <= self.config_data["Copies"]:
-                last_folder_digit = copies_made
-
-        if copies_made == self.config_data["Copies"]:
-            oldest_folder = find_oldest_folder(self.config_data["Destination"], folder_path)
-            tmp_oldest_folder = os.path.splitext(oldest_folder)
-            last_folder_digit = int(tmp_oldest_folder[0][len(tmp_oldest_folder[0]) - 1:])
-            if tmp_oldest_folder[1] == ".zip":
-                os.remove(oldest_folder)
-            else:
-                shutil.rmtree(oldest_folder)
-        return last_folder_digit
-
-    def rotate_backup(self):
-        """
-        Creates amount of backups specified by profile and will keep that number of backups in destination location.
-        Cycles through the backups replacing the oldest folder/file.
-        :return:
-        """
-        try:
-            recent_string = ""
-            while not self.backup_event.is_set():
-                self.last_update_time = int(time.time())
-                self.log_dest_folders = []
-                full_destination_folder = ""
-                # loop through all folders in list
-                for folder_to_backup in self.config_data["Folders"]:
-                    if self.compression:
-                        self.log_dest_folders.append(folder_to_backup)
-                        if len(self.log_dest_folders) == len(self.config_data["Folders"]):
-                            last_folder_digit = self.get_last_folder_digit(self.cur_profile)
-                            dest_folder_zip = os.path.join(self.config_data["Destination"], self.cur_profile)
-                            destination_folder = f"{dest_folder_zip}_{last_folder_digit}"
-                            full_destination_folder = os.path.join(self.config_data["Destination"], destination_folder)
-                            compress_folder(full_destination_folder, self.log_dest_folders)
-                    else:
-                        last_folder_digit = self.get_last_folder_digit(folder_to_backup)
-                        destination_folder = f"{os.path.basename(folder_to_backup)}_{last_folder_digit}"
-                        full_destination_folder = os.path.join(self.config_data["Destination"], destination_folder)
-                        self.log_dest_folders.append(full_destination_folder)
-                        shutil.copytree(folder_to_backup, full_destination_folder, dirs_exist_ok=True)
-
-                    if len(self.log_dest_folders) == 1:
-                        recent_string = f"Recent Backup created for profile: {self.cur_profile}\n"
-                        if full_destination_folder:
-                            recent_string += f"Folder: {full_destination_folder}\n"
-                    else:
-                        recent_string += f"Folder: {full_destination_folder}\n"
-                    self.controller.recent_backup = recent_string
-                if self.config_data["Interval"] > 0:
-                    self.windows_icon.notify_user("ALERT:", f"Backup: {full_destination_folder}")
-
-                    self.backup_event.wait(self.config_data["Interval"] - self.warning_time)
-                    if not self.backup_event.is_set():
-                        self.windows_icon.notify_user("ALERT:",
-                                                      f"A backup is about to begin in {self.warning_time} seconds.")
-                    self.backup_event.wait(self.warning_time)
-
-        except Exception as e:
-            self.windows_icon.notify_user("ERROR:", f"Unexpected error: {e}")
-            log(f"ERROR: {e}")
-        finally:
-            self.backup_event.clear()
-
-    def daily_backup(self):
-        """
-        Creates a backup once. This method is to be used with the task scheduler in windows and the 'auto-start'
-        feature within the program.
-        :return:
-        """
-        try:
-            recent_string = ""
-            while not self.backup_event.is_set():
-                self.last_update_time = int(time.time())
-                self.log_dest_folders = []
-                full_destination_folder = ""
-                # loop through all folders in list
-                for folder_to_backup in self.config_data["Folders"]:
-                    if self.compression:
-                        self.log_dest_folders.append(folder_to_backup)
-                        if len(self.log_dest_folders) == len(self.config_data["Folders"]):
-                            last_folder_digit = self.get_last_folder_digit(self.cur_profile)
-                            dest_folder_zip = os.path.join(self.config_data["Destination"], self.cur_profile)
-                            destination_folder = f"{dest_folder_zip}_{last_folder_digit}"
-                            full_destination_folder = os.path.join(self.config_data["Destination"], destination_folder)
-                            compress_folder(full_destination_folder, self.log_dest_folders)
-                    else:
-                        last_folder_digit = self.get_last_folder_digit(folder_to_backup)
-                        destination_folder = f"{os.path.basename(folder_to_backup)}_{last_folder_digit}"
-                        full_destination_folder = os.path.join(self.config_data["Destination"], destination_folder)
-                        self.log_dest_folders.append(full_destination_folder)
-                        shutil.copytree(folder_to_backup, full_destination_folder, dirs_exist_ok=True)
-
-                    if len(self.log_dest_folders) == 1:
-                        recent_string = f"Recent Backup created for profile: {self.cur_profile}\n"
-                        if full_destination_folder:
-                            recent_string += f"Folder: {full_destination_folder}\n"
-                    else:
-                        recent_string += f"Folder: {full_destination_folder}\n"
-                    self.controller.recent_backup = recent_string
-                self.windows_icon.notify_user("ALERT:", f"Backup: {full_destination_folder}")
-                self.backup_event.wait(2)
-                self.stop_backup()
-                if self.exit_on_complete:
-                    self.controller.terminate()
-
-        except Exception as e:
-            self.windows_icon.notify_user("ERROR:", f"Unexpected error: {e}")
-            log(f"ERROR: {e}")
-        finally:
-            self.backup_event.clear()
-
-    def stop_backup(self, no_message=False):
-        if self.backup_process and self.backup_process.is_alive():
-            # Don't think this could happen, but I put it in just in case.
-            if len(self.log_dest_folders) != len(self.config_data["Folders"]):
-                self.windows_icon.notify_user("ERROR:", "Process terminated before all folders could be backed up.")
-            try:
-                log(self.controller.recent_backup)
-            except Exception as e:
-                # This happens when the csv file is opened in Microsoft Excel, not notepad or notepad++
-                self.windows_icon.notify_user("ERROR:", f"Can not write to log file. {e}", override=True)
-            self.windows_icon.notify_user("ALERT:", "Process terminated.")
-            self.windows_icon.icon.remove_notification()
-            self.backup_event.set()
-            self.controller.thread_running = False
-        else:
-            if not no_message:
-                self.windows_icon.notify_user("ALERT:", "No active process to terminate")
+import os.path
+import threading
+import time
+
+from .Catalog import SlotRecord
+from .Encryption import Encryptor, get_key_path, load_key
+from .FanOut import copy_tree
+from .HostLoad import LoadGovernor
+from .Journal import ChangeJournal
+from .Packs import Packer
+from .PageCache import set_cache_mode
+from .Planner import plan_backup, record_stats
+from .Progress import BackupCancelled, BackupProgress
+from .Reaper import TrashReaper
+from .Scanner import ScanTotals, set_journal
+from .Storage import LocalStorage, open_storage
+from .Tuning import ThroughputTuner
+from .Utils import *
+from .Volumes import compress_volumes, split_volumes
+
+
+class Clock:
+    """The time BackupThread runs its schedule by, the soak benchmark passes a fake one to run days of cycles in
+    minutes."""
+
+    @staticmethod
+    def time():
+        return time.time()
+
+    @staticmethod
+    def monotonic():
+        return time.monotonic()
+
+    @staticmethod
+    def wait(event, timeout):
+        """Waits up to 'timeout' seconds for 'event' to be set.
+        :returns: bool: True if it was set"""
+        return event.wait(timeout)
+
+
+# These are the backup methods available to be called for backing up folders/files.
+_BACKUP_METHODS = ["Rotate", "Daily"]
+
+
+def get_backup_methods():
+    """Returns a list of all the backup_methods supported. (Specified at beginning of module)"""
+    return _BACKUP_METHODS
+
+
+def get_storages(config, get_storage, icon):
+    """Returns the storage backends of every destination of a profile as {destination: backend}, each opened with
+    'get_storage'. Destinations whose backend can't be opened are left out, the user is told through 'icon'."""
+    storages = {}
+    for destination in get_destinations(config):
+        try:
+            storages[destination] = get_storage(destination)
+        except Exception as e:
+            icon.notify_user("ERROR:", f"Destination can not be opened: {destination}\n{e}")
+    return storages
+
+
+# TODO: Add multi-threading.
+#  Create a separate program to be ran with only icon, maybe a gui for setting up folders?
+#  Add Zip compression for backups
+class BackupThread:
+    """Backup Thread class that's responsible for handling the backups of folders/files."""
+
+    def __init__(self, controller, icon, clock=None):
+        self.controller = controller
+        self.clock = clock or Clock()
+        self.backup_event = threading.Event()
+
+        self.config_data = {}
+        self.method = ""
+        self.windows_icon = icon
+        self.warning_time = self.controller.min_warning_time
+
+        self.backup_process = None
+        self.threads = []
+        self.cur_profile = ""
+        self.log_dest_folders = []
+        self.compression = False
+        self.exit_on_complete = False
+
+        self.last_update_time = 0
+        self.progress = BackupProgress()
+        # Stopping a backup ends the cycle it's in at the next chunk read, not once it's done.
+        self.progress.cancel_event = self.backup_event
+        # Defers cycles and slows backups down while the host is busy.
+        self.governor = LoadGovernor(self.clock, self.backup_event, **self.controller.load_settings)
+        self.progress.throttle = self.governor.throttle
+        # Keeps backups from flushing everything else out of the page cache.
+        set_cache_mode(self.controller.cache_mode)
+        # Workers, chunk size and compression level learned for each destination.
+        self.tuner = ThroughputTuner(max_workers=self.controller.max_threads, **self.controller.tuning_settings)
+        # Change journals of the profile's folders, {folder: ChangeJournal}, scans are read from them.
+        self.journal_settings = self.controller.journal_settings
+        self.journals = {}
+
+        # Deletes pruned rotation slots in the background so a new backup doesn't wait on it.
+        self.reaper = TrashReaper(self.controller.reaper_files_per_second, self.controller.reaper_bytes_per_second)
+        self.reaper.start()
+        self.storages = {}
+        # Slot names of the last backup written to each destination.
+        self.written_slots = {}
+        # Destinations the backup being written only fits on once their trash is deleted, see 'BackupPlan'.
+        self.reclaim_destinations = set()
+        # Wall clock and CPU seconds the cycle spent writing its slots, what the tuner scores a backup by.
+        self.write_seconds = 0
+        self.write_cpu_seconds = 0
+
+    def start(self, config, profile_name):
+        """Start method for starting a thread of a backup sequence."""
+        # Check if there is a backup already active.
+        if self.backup_process and self.backup_process.is_alive():
+            self.windows_icon.notify_user("ERROR:", "Cannot start backup. There is an active process.")
+            return
+        self.cur_profile = profile_name
+        self.config_data = config
+
+        # Verify the profile config is correct prior to starting backup sequence.
+        if self.controller.verify_profiles(self.config_data):
+            self.method = self.config_data["Method"]
+            self.warning_time = self.config_data["WarningTime"]
+            self.compression = self.config_data["Compression"]
+            self.windows_icon.config_data = self.config_data
+            # Add here for new methods of backups.
+            if self.method == "Rotate":
+                self.backup_process = threading.Thread(target=self.rotate_backup, daemon=True)
+            elif self.method == "Daily":
+                self.exit_on_complete = True
+                self.backup_process = threading.Thread(target=self.daily_backup, daemon=True)
+            self.backup_process.start()
+            self.controller.thread_running = True
+
+    @staticmethod
+    def get_backup_methods():
+        return get_backup_methods()
+
+    def get_time_left(self):
+        """Returns the amount of time left before the next backup used in the rotate_backup method."""
+        time_passed = int(self.clock.time() - self.last_update_time)
+        return self.config_data["Interval"] - time_passed
+
+    def get_storage(self, destination):
+        """Returns the storage backend of a 'Destination'. Backends are kept for the whole run so their connections
+        are reused, a local destination has its half written slots from a crash cleaned up the first time."""
+        if destination not in self.storages:
+            storage = open_storage(destination, self.controller.s3_settings, self.reaper)
+            if isinstance(storage, LocalStorage) and storage.is_available():
+                self.reaper.add_destination(destination)
+                storage.recover()
+            self.storages[destination] = storage
+        return self.storages[destination]
+
+    def get_storages(self, config):
+        return get_storages(config, self.get_storage, self.windows_icon)
+
+    def get_last_folder_digit(self, folder_path, storage):
+        """Gets the digit of the next slot of 'folder_path' in the destination. Once there are as many copies as the
+        profile keeps (or more, after 'Copies' was lowered) the oldest are deleted (in the background) down to one less
+        than 'Copies' and the next slot takes the digit of the oldest, otherwise the lowest digit not in use.
+        :returns: int: last_folder_digit """
+        copies = storage.get_copies(folder_path)
+        oldest_first = sorted(copies, key=copies.get)
+        pruned = oldest_first[:max(len(copies) - self.config_data["Copies"] + 1, 0)]
+        for oldest_folder in pruned:
+            storage.delete(oldest_folder)
+            self.controller.catalog.remove_slot(storage.name, oldest_folder)
+        digits = [get_slot_digit(i) for i in oldest_first]
+        if pruned and digits[0] is not None:
+            return digits[0]
+        used = set(digits[len(pruned):])
+        return min(i for i in range(10) if i not in used)
+
+    def uses_volumes(self):
+        """A compressed profile is split into volumes ('<profile>_<n>/vol_<n>.zip' and a catalog) instead of one zip
+        if it sets a 'VolumeSize' in MB or 'SplitFolders' to give every folder its own volumes."""
+        return self.config_data.get("VolumeSize", 0) > 0 or self.config_data.get("SplitFolders", False)
+
+    def get_packer(self, encryptor, record):
+        """A copied profile packs files under 'PackThreshold' KB into pack files, see 'Packs.py'. 0 to copy every file
+        as is."""
+        threshold = self.config_data.get("PackThreshold", 0)
+        if not threshold:
+            return None
+        return Packer(threshold * 1024, self.progress, encryptor, record)
+
+    def get_encryptor(self, workers):
+        """Returns an Encryptor for the profile, encrypting on 'workers' threads, if it has 'Encryption' turned on,
+        otherwise None. The key is made the first time a profile is encrypted, losing it means the backups can't be
+        restored."""
+        if not self.config_data.get("Encryption", False):
+            return None
+        key, created = load_key(self.cur_profile)
+        if created:
+            self.windows_icon.notify_user("ALERT:", f"New encryption key saved, keep a copy of it somewhere safe: "
+                                                    f"{get_key_path(self.cur_profile)}")
+        return Encryptor(key, workers)
+
+    def open_journals(self, folders):
+        """Opens a change journal for every folder of the profile, with its watcher started, and closes the ones of
+        folders no longer in it. Only with 'change_journal' turned on."""
+        if not self.journal_settings.get("enabled"):
+            return
+        folders = [i for i in folders if os.path.isdir(i)]
+        for folder in list(self.journals):
+            if folder not in folders:
+                set_journal(folder, None)
+                self.journals.pop(folder).close()
+        for folder in folders:
+            if folder in self.journals:
+                continue
+            try:
+                journal = ChangeJournal(folder, self.journal_settings.get("full_scan_hours", 24))
+            except Exception as e:
+                log(f"ERROR: Change journal of {folder} could not be opened: {e}")
+                continue
+            journal.start_watching()
+            set_journal(folder, journal)
+            self.journals[folder] = journal
+
+    def close_journals(self):
+        for folder in list(self.journals):
+            set_journal(folder, None)
+            self.journals.pop(folder).close()
+
+    def discard_staged(self, destination, slot):
+        """Drops what was written of a slot that failed, so it isn't left in the staging folder."""
+        try:
+            self.get_storage(destination).discard(slot)
+        except Exception as e:
+            log(f"ERROR: Failed slot {slot} could not be removed from {destination}: {e}")
+
+    def backup_slot(self, source_path, extension, destinations, write, kind):
+        """
+        Writes the next rotation slot of 'source_path' ('<name>_<n>' + 'extension') to every destination and commits
+        it once written. 'write' is called with the FanOut targets and a SlotRecord to fill, it returns the
+        destinations that failed. Destinations that fail are removed from 'destinations'. Every committed slot is
+        added to the catalog as a 'kind' slot ('folder', 'zip' or 'volumes').
+        :returns: list: the paths of the slots that were written successfully
+        """
+        record = SlotRecord()
+        failed = {}
+        slots = {}
+        targets = []
+        for destination in destinations:
+            try:
+                storage = self.get_storage(destination)
+                slot = f"{get_folder_name(source_path)}_{self.get_last_folder_digit(source_path, storage)}{extension}"
+                if destination in self.reclaim_destinations:
+                    # Only fits once the slot just pruned and the rest of the trash are gone.
+                    storage.purge_trash()
+                targets.append((destination, storage, storage.stage(slot)))
+                slots[destination] = slot
+            except Exception as e:
+                failed[destination] = e
+        if targets:
+            start_time = self.clock.monotonic()
+            cpu_start = time.process_time()
+            try:
+                failed.update(write(targets, record))
+            except Exception:
+                # Stopped (BackupCancelled) or a source that couldn't be read, nothing of the slot is kept.
+                for destination, slot in slots.items():
+                    self.discard_staged(destination, slot)
+                raise
+            self.write_seconds += self.clock.monotonic() - start_time
+            self.write_cpu_seconds += time.process_time() - cpu_start
+        for destination, slot in slots.items():
+            if destination in failed:
+                self.discard_staged(destination, slot)
+                continue
+            try:
+                self.get_storage(destination).commit(slot)
+            except Exception as e:
+                failed[destination] = e
+                self.discard_staged(destination, slot)
+                continue
+            try:
+                self.controller.catalog.record_slot(self.cur_profile, destination, slot, kind, record)
+            except Exception as e:
+                # The backup itself is fine, only searching it is affected.
+                log(f"ERROR: Catalog could not be updated for {destination}: {e}")
+        self.written_slots = slots
+        for destination, error in failed.items():
+            destinations.remove(destination)
+            self.windows_icon.notify_user("ERROR:", f"Destination failed and was skipped: {destination}\n{error}")
+            log(f"ERROR: Destination {destination} failed: {error}")
+        return [self.get_storage(i).get_url(slots[i]) for i in destinations]
+
+    def backup_folders(self):
+        """
+        Backs up every folder in the profile once, either copied into their own '<folder>_<n>' or all compressed into
+        one '<profile>_<n>.zip', in every destination of the profile. Each source file is read once and written to all
+        destinations at the same time. Progress is reported through 'self.progress' as it goes.
+        Destinations that can't be reached, would fill up or fail while writing are skipped without stopping the others.
+        :return: str: the last destination folders/files written, None if the backup was refused for all destinations
+        """
+        self.last_update_time = int(self.clock.time())
+        self.log_dest_folders = []
+        full_destination_folder = ""
+        recent_string = ""
+        start_time = self.clock.monotonic()
+        self.write_seconds = 0
+        self.write_cpu_seconds = 0
+
+        self.progress.begin(self.cur_profile)
+        self.governor.start_cycle(self.cur_profile)
+        self.open_journals(self.config_data["Folders"])
+        # Sized from what the last backup counted, the folders are only walked by the backup itself.
+        plan = plan_backup(self.config_data, self.cur_profile, self.controller.max_threads,
+                           self.get_storages(self.config_data), scan=False)
+        totals = ScanTotals()
+        for destination in get_destinations(self.config_data):
+            if destination not in plan.destinations:
+                self.windows_icon.notify_user("ERROR:", f"Destination can not be reached, skipping: {destination}")
+            elif destination not in plan.fitting_destinations:
+                self.windows_icon.notify_user("ERROR:", f"Not enough free space, skipping: {destination}")
+        destinations = plan.fitting_destinations
+        self.reclaim_destinations = {i for i in destinations if plan.needs_reclaim(i)}
+        if not destinations:
+            self.progress.finish()
+            self.windows_icon.notify_user("ERROR:", f"Backup refused, no destination can hold it.\n{plan.summary()}")
+            return None
+        settings = self.tuner.get_settings({i: self.get_storage(i) for i in destinations}, self.config_data["Folders"],
+                                           self.compression)
+        workers = settings["workers"]
+        encryptor = self.get_encryptor(workers)
+        self.progress.set_totals(plan.files, plan.bytes, "Compressing" if self.compression else "Copying")
+        try:
+            # loop through all folders in list
+            for folder_to_backup in self.config_data["Folders"]:
+                if not destinations:
+                    break
+                self.progress.check_cancelled()
+                if self.compression:
+                    self.log_dest_folders.append(folder_to_backup)
+                    if len(self.log_dest_folders) == len(self.config_data["Folders"]):
+                        if self.uses_volumes():
+                            volume_size = self.config_data.get("VolumeSize", 0) * 1024 * 1024
+                            volumes = split_volumes(self.log_dest_folders, volume_size,
+                                                    self.config_data.get("SplitFolders", False), totals)
+                            slot_paths = self.backup_slot(self.cur_profile, "", destinations,
+                                                          lambda targets, record: compress_volumes(
+                                                              targets, volumes, self.progress, encryptor, workers,
+                                                              record, settings["level"]),
+                                                          "volumes")
+                        else:
+                            slot_paths = self.backup_slot(self.cur_profile, ".zip", destinations,
+                                                          lambda targets, record: compress_folder(
+                                                              targets, self.log_dest_folders, self.progress, encryptor,
+                                                              record, settings["level"], workers, totals),
+                                                          "zip")
+                        full_destination_folder = ", ".join(slot_paths)
+                else:
+                    slot_paths = self.backup_slot(folder_to_backup, "", destinations,
+                                                  lambda targets, record: copy_tree(
+                                                      folder_to_backup, targets, self.progress, settings["chunk_size"],
+                                                      encryptor, record, self.get_packer(encryptor, record), workers,
+                                                      totals),
+                                                  "folder")
+                    full_destination_folder = ", ".join(slot_paths)
+                    self.log_dest_folders.append(full_destination_folder)
+
+                if len(self.log_dest_folders) == 1:
+                    recent_string = f"Recent Backup created for profile: {self.cur_profile}\n"
+                    if full_destination_folder:
+                        recent_string += f"Folder: {full_destination_folder}\n"
+                else:
+                    recent_string += f"Folder: {full_destination_folder}\n"
+                self.controller.recent_backup = recent_string
+        except BackupCancelled:
+            log(f"INFO: Backup of {self.cur_profile} stopped, the slot being written was discarded.")
+            return None
+        finally:
+            self.progress.finish()
+            if encryptor is not None:
+                encryptor.shutdown()
+        if not destinations:
+            self.windows_icon.notify_user("ERROR:", "Backup failed on every destination.")
+            return full_destination_folder
+        bytes_written = None
+        if self.compression:
+            bytes_written = self.get_storage(destinations[0]).get_size(self.written_slots[destinations[0]])
+        seconds = self.clock.monotonic() - start_time
+        files, bytes_read, physical_bytes = totals.get()
+        # Scored on the writing alone, not planning or calibrating. A cycle the governor slowed down is left out, it
+        # would count the host's load against the settings.
+        if not self.governor.throttled:
+            self.tuner.record(settings, bytes_read, self.write_seconds, self.write_cpu_seconds)
+        record_stats(self.cur_profile, bytes_read, seconds, bytes_written, physical_bytes, settings, files,
+                     self.config_data["Folders"])
+        return full_destination_folder
+
+    def rotate_backup(self):
+        """
+        Creates amount of backups specified by profile and will keep that number of backups in destination location.
+        Cycles through the backups replacing the oldest folder/file.
+        :return:
+        """
+        try:
+            while not self.backup_event.is_set():
+                self.governor.wait_for_idle(self.cur_profile, self.progress)
+                if self.backup_event.is_set():
+                    break
+                with self.controller.profiler.cycle(self.cur_profile):
+                    full_destination_folder = self.backup_folders()
+                if full_destination_folder is None:
+                    self.controller.thread_running = False
+                    break
+                if self.config_data["Interval"] > 0:
+                    self.windows_icon.notify_user("ALERT:", f"Backup: {full_destination_folder}", kind="backup")
+
+                    # Counted from when this cycle started, so the time a backup takes doesn't push every later one
+                    # back and the schedule matches 'get_time_left'.
+                    next_cycle = self.last_update_time + self.config_data["Interval"]
+                    self.clock.wait(self.backup_event, max(next_cycle - self.warning_time - self.clock.time(), 0))
+                    if not self.backup_event.is_set():
+                        self.windows_icon.notify_user("ALERT:",
+                                                      f"A backup is about to begin in {self.warning_time} seconds.")
+                    self.clock.wait(self.backup_event, max(next_cycle - self.clock.time(), 0))
+
+        except Exception as e:
+            self.windows_icon.notify_user("ERROR:", f"Unexpected error: {e}")
+            log(f"ERROR: {e}")
+        finally:
+            self.close_journals()
+            self.backup_event.clear()
+
+    def daily_backup(self):
+        """
+        Creates a backup once. This method is to be used with the task scheduler in windows and the 'auto-start'
+        feature within the program.
+        :return:
+        """
+        try:
+            while not self.backup_event.is_set():
+                self.governor.wait_for_idle(self.cur_profile, self.progress)
+                if self.backup_event.is_set():
+                    break
+                with self.controller.profiler.cycle(self.cur_profile):
+                    full_destination_folder = self.backup_folders()
+                if full_destination_folder is None:
+                    self.controller.thread_running = False
+                    self.clock.wait(self.backup_event, 2)
+                    if self.exit_on_complete:
+                        self.controller.terminate()
+                    break
+                self.windows_icon.notify_user("ALERT:", f"Backup: {full_destination_folder}", kind="backup")
+                self.clock.wait(self.backup_event, 2)
+                self.stop_backup()
+                if self.exit_on_complete:
+                    self.controller.terminate()
+
+        except Exception as e:
+            self.windows_icon.notify_user("ERROR:", f"Unexpected error: {e}")
+            log(f"ERROR: {e}")
+        finally:
+            self.close_journals()
+            self.backup_event.clear()
+
+    def stop_backup(self, no_message=False):
+        if self.backup_process and self.backup_process.is_alive():
+            # Don't think this could happen, but I put it in just in case.
+            if len(self.log_dest_folders) != len(self.config_data["Folders"]):
+                self.windows_icon.notify_user("ERROR:", "Process terminated before all folders could be backed up.")
+            try:
+                log(self.controller.recent_backup)
+            except Exception as e:
+                # This happens when the csv file is opened in Microsoft Excel, not notepad or notepad++
+                self.windows_icon.notify_user("ERROR:", f"Can not write to log file. {e}", override=True)
+            self.windows_icon.notify_user("ALERT:", "Process terminated.")
+            self.windows_icon.remove_notification()
+            self.backup_event.set()
+            self.controller.thread_running = False
+        else:
+            if not no_message:
+                self.windows_icon.notify_user("ALERT:", "No active process to terminate")
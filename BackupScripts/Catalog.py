@@ -0,0 +1,183 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+
+from .Utils import *
+from .Volumes import fetch, open_zip, restore_volume
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    id INTEGER PRIMARY KEY,
+    profile TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (destination, slot)
+);
+CREATE TABLE IF NOT EXISTS files (
+    slot_id INTEGER NOT NULL REFERENCES slots (id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash TEXT NOT NULL,
+    volume TEXT
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_slot ON files (slot_id, path);
+"""
+
+# Columns of every file returned by a search, as dicts with these keys.
+_FILE_COLUMNS = ["profile", "destination", "slot", "kind", "created", "path", "size", "mtime", "hash", "volume"]
+
+
+class SlotRecord:
+    """Collects the files written into one slot while it's being backed up, for 'BackupCatalog.record_slot'.
+    'add' is safe to call from several threads, volumes are compressed at the same time."""
+
+    def __init__(self, volume=None, files=None, lock=None):
+        self.volume = volume
+        self.files = files if files is not None else []
+        self.lock = lock or threading.Lock()
+
+    @staticmethod
+    def new_hash():
+        """The hash kept for every file, only used to tell whether two versions of a file differ."""
+        return hashlib.blake2b(digest_size=16)
+
+    def for_volume(self, volume):
+        """Returns a record that adds into this one with every file marked as being in 'volume'."""
+        return SlotRecord(volume, self.files, self.lock)
+
+    def add(self, path, size, mtime, digest):
+        with self.lock:
+            self.files.append((path.replace(os.sep, "/"), size, mtime, digest, self.volume))
+
+
+class BackupCatalog:
+    """
+    SQLite index of every file in every retained slot: path (relative to the slot, or the name in the zip), size,
+    modification time, hash and the slot (and volume) it's in. A slot's rows are replaced when the slot is written
+    again and dropped when it's pruned, so it always matches what's in the destinations.
+    Shared by the backup thread writing and the GUI searching, one connection behind a lock.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+    def record_slot(self, profile_name, destination, slot, kind, record):
+        """Replaces the files of 'slot' in 'destination' with the ones in the SlotRecord 'record'.
+        'kind' is 'folder', 'zip' or 'volumes'."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM slots WHERE destination = ? AND slot = ?", (destination, slot))
+            cursor = self.connection.execute(
+                "INSERT INTO slots (profile, destination, slot, kind, created) VALUES (?, ?, ?, ?, ?)",
+                (profile_name, destination, slot, kind, time.time()))
+            slot_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO files (slot_id, path, name, size, mtime, hash, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((slot_id, path, path.rsplit("/", 1)[-1], size, mtime, digest, volume)
+                 for path, size, mtime, digest, volume in record.files))
+
+    def remove_slot(self, destination, slot):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM slots WHERE destination = ? AND slot = ?", (destination, slot))
+
+    def query(self, where, parameters, limit=None):
+        sql = ("SELECT slots.profile, slots.destination, slots.slot, slots.kind, slots.created, files.path, "
+               "files.size, files.mtime, files.hash, files.volume "
+               f"FROM files JOIN slots ON slots.id = files.slot_id WHERE {where} "
+               "ORDER BY files.path, files.mtime DESC, slots.created DESC")
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self.lock:
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [dict(zip(_FILE_COLUMNS, row)) for row in rows]
+
+    def find_versions(self, path, profile_name=None):
+        """Every retained version of a file, newest first. 'path' is the path of the file within its backed up folder
+        (e.g. 'docs/report.txt'), anything from the end of the path works as long as it ends with the file name."""
+        path = path.replace("\\", "/").strip("/")
+        where = "files.name = ? AND (files.path = ? OR files.path LIKE ? ESCAPE '\\')"
+        parameters = [path.rsplit("/", 1)[-1], path, "%/" + escape_like(path)]
+        if profile_name:
+            where += " AND slots.profile = ?"
+            parameters.append(profile_name)
+        return self.query(where, parameters)
+
+    def find_by_name(self, pattern, profile_name=None, limit=1000):
+        """Files whose name matches 'pattern', '*' and '?' as wildcards, not case sensitive."""
+        like = escape_like(pattern).replace("*", "%").replace("?", "_")
+        where = "files.name LIKE ? ESCAPE '\\'"
+        parameters = [like]
+        if profile_name:
+            where += " AND slots.profile = ?"
+            parameters.append(profile_name)
+        return self.query(where, parameters, limit)
+
+    def get_slots(self, profile_name=None):
+        """Returns the slots in the catalog as a list of dicts, newest first."""
+        sql = "SELECT id, profile, destination, slot, kind, created FROM slots"
+        parameters = []
+        if profile_name:
+            sql += " WHERE profile = ?"
+            parameters.append(profile_name)
+        with self.lock:
+            rows = self.connection.execute(sql + " ORDER BY created DESC", parameters).fetchall()
+        return [dict(zip(["id", "profile", "destination", "slot", "kind", "created"], row)) for row in rows]
+
+    def get_slot_id(self, destination, slot):
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM slots WHERE destination = ? AND slot = ?",
+                                          (destination, slot)).fetchone()
+        return row[0] if row else None
+
+    def get_files(self, slot_id):
+        """Every file in a slot (by id) as {path: (size, modification time, hash)}, the manifest 'Diff.py' compares."""
+        with self.lock:
+            rows = self.connection.execute("SELECT path, size, mtime, hash FROM files WHERE slot_id = ?",
+                                           (slot_id,)).fetchall()
+        return {path: (size, mtime, digest) for path, size, mtime, digest in rows}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def restore_file(entry, storage, dst_folder, encryptor=None):
+    """
+    Restores one file found in the catalog ('entry' as returned by a search) from 'storage' into 'dst_folder',
+    keeping its path. Zips on a local drive are read in place, from a remote backend only what's needed is
+    downloaded: the file itself, its volume or pack, or the zip it's in.
+    :returns: str: the path of the restored file
+    """
+    slot = entry["slot"]
+    if entry["kind"] == "volumes":
+        restore_volume(storage, slot, entry["volume"], dst_folder, [entry["path"]], encryptor)
+    elif entry["kind"] == "zip" or entry["volume"]:
+        # The whole zip slot, or the pack a small file of a folder slot was packed into.
+        key = slot if entry["kind"] == "zip" else f"{slot}/{entry['volume']}"
+        with open_zip(storage, key, encryptor) as zipf:
+            zipf.extract(entry["path"], dst_folder)
+    else:
+        dst_path = os.path.join(dst_folder, *entry["path"].split("/"))
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        fetch(storage, f"{slot}/{entry['path']}", dst_path, encryptor)
+    restored = os.path.join(dst_folder, *entry["path"].split("/"))
+    os.utime(restored, (entry["mtime"], entry["mtime"]))
+    return restored
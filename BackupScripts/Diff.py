@@ -0,0 +1,187 @@
+"""
+Lists what changed between two rotation slots of the same folder or profile without reading either backup.
+Run from the root of the repository: python -m BackupScripts.Diff <destination> <old slot> <new slot>
+"""
+import datetime
+import hashlib
+import os
+import sys
+import tempfile
+import zipfile
+
+from .Catalog import BackupCatalog
+from .Encryption import MAGIC
+from .Packs import PACK_FOLDER
+from .Progress import format_bytes
+from .Scanner import scan_files
+from .Storage import LocalStorage, open_storage
+from .Utils import *
+from .Volumes import CATALOG_FILE
+
+
+class SlotManifest:
+    """
+    Every file in a slot as {path: (size, modification time, hash)}, paths with '/' as they're named in the catalog.
+    The hash is None where it isn't known up front, 'get_hash(path)' works it out when it's needed (reading the file),
+    or is None if it can't be.
+    """
+
+    def __init__(self, files, get_hash=None):
+        self.files = files
+        self.get_hash = get_hash
+
+    def hash(self, path):
+        digest = self.files[path][2]
+        if digest is None and self.get_hash is not None:
+            digest = self.get_hash(path)
+        return digest
+
+
+def read_zip_manifest(path, files):
+    """Adds the files of the zip 'path' to 'files' from its central directory, with the CRC as their hash."""
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) == MAGIC:
+            raise ValueError("encrypted backups can only be compared through the catalog")
+    with zipfile.ZipFile(path) as zipf:
+        for info in zipf.infolist():
+            if not info.is_dir():
+                files[info.filename] = (info.file_size, info.date_time, f"{info.CRC:08x}")
+
+
+def read_folder_manifest(root):
+    """A copied slot on a local destination, from its metadata alone. The zips of a split backup (volumes) and the
+    packs of small files are read from their central directories, everything else is hashed only if asked."""
+    files = {}
+    volumes = os.path.exists(os.path.join(root, CATALOG_FILE))
+    for entry in scan_files(root):
+        path = entry.relative_path
+        if volumes or path.startswith(f"{PACK_FOLDER}/"):
+            if path.endswith(".zip"):
+                read_zip_manifest(entry.path, files)
+            continue
+        files[path] = (entry.stat.st_size, entry.stat.st_mtime, None)
+
+    def get_hash(relative_path):
+        digest = hashlib.blake2b(digest_size=16)
+        try:
+            with open(os.path.join(root, *relative_path.split("/")), 'rb') as file:
+                data = file.read(1024 * 1024)
+                if data.startswith(MAGIC):
+                    # Every encryption of a file comes out different, only the catalog can tell if it changed.
+                    return None
+                while data:
+                    digest.update(data)
+                    data = file.read(1024 * 1024)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+    return SlotManifest(files, get_hash)
+
+
+def get_manifest(storage, slot):
+    """Reads the manifest of 'slot' straight from the destination, for slots that aren't in the catalog."""
+    if slot.endswith(".zip"):
+        files = {}
+        if isinstance(storage, LocalStorage):
+            read_zip_manifest(storage.get_path(slot), files)
+        else:
+            # Only the central directory is needed, but zipfile needs the whole zip to find it.
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, slot)
+                storage.get(slot, path)
+                read_zip_manifest(path, files)
+        return SlotManifest(files)
+    if not isinstance(storage, LocalStorage):
+        raise ValueError("copied backups on a remote destination can only be compared through the catalog")
+    return read_folder_manifest(storage.get_path(slot))
+
+
+def get_manifests(storage, old_slot, new_slot, catalog=None):
+    """The manifests of both slots, from the catalog if it has them both so nothing has to be read.
+    :returns: tuple: (old manifest, new manifest, "catalog" or "destination")"""
+    if catalog is not None:
+        old_id = catalog.get_slot_id(storage.name, old_slot)
+        new_id = catalog.get_slot_id(storage.name, new_slot)
+        if old_id is not None and new_id is not None:
+            return SlotManifest(catalog.get_files(old_id)), SlotManifest(catalog.get_files(new_id)), "catalog"
+    return get_manifest(storage, old_slot), get_manifest(storage, new_slot), "destination"
+
+
+def compare_manifests(old, new):
+    """
+    Compares two manifests by size, then by the hashes both manifests already have, then by modification time. A file
+    is only hashed when its size is the same but its time isn't, a file that can't be hashed then counts as modified.
+    :returns: dict: {"added": [(path, size)], "removed": [(path, size)], "modified": [(path, old size, new size)],
+                     "unchanged": int, "hashed": int}
+    """
+    diff = {"added": [], "removed": [], "modified": [], "unchanged": 0, "hashed": 0}
+    for path in sorted(new.files):
+        size, mtime, digest = new.files[path]
+        if path not in old.files:
+            diff["added"].append((path, size))
+            continue
+        old_size, old_mtime, old_digest = old.files[path]
+        if size != old_size:
+            diff["modified"].append((path, old_size, size))
+        elif digest is not None and old_digest is not None:
+            # Hashes that came with the manifests cost nothing to compare, zips only keep times to 2 seconds.
+            if digest != old_digest:
+                diff["modified"].append((path, old_size, size))
+            else:
+                diff["unchanged"] += 1
+        elif mtime == old_mtime:
+            diff["unchanged"] += 1
+        else:
+            diff["hashed"] += 1
+            old_digest = old.hash(path)
+            if old_digest is None or old_digest != new.hash(path):
+                diff["modified"].append((path, old_size, size))
+            else:
+                diff["unchanged"] += 1
+    diff["removed"] = [(path, old.files[path][0]) for path in sorted(old.files) if path not in new.files]
+    return diff
+
+
+def diff_slots(storage, old_slot, new_slot, catalog=None):
+    """What changed from 'old_slot' to 'new_slot' of the same folder or profile in 'storage'.
+    :returns: dict: see 'compare_manifests', with "source": where the manifests came from"""
+    old, new, source = get_manifests(storage, old_slot, new_slot, catalog)
+    diff = compare_manifests(old, new)
+    diff["source"] = source
+    return diff
+
+
+def get_size_delta(diff):
+    return (sum(size for path, size in diff["added"]) - sum(size for path, size in diff["removed"])
+            + sum(new - old for path, old, new in diff["modified"]))
+
+
+def format_delta(size):
+    return f"{'+' if size >= 0 else '-'}{format_bytes(abs(size))}"
+
+
+def format_diff(diff, limit=50):
+    """Returns a human readable summary of a diff, listing at most 'limit' files of each kind of change."""
+    text = (f"{len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['modified'])} modified, "
+            f"{diff['unchanged']} unchanged ({format_delta(get_size_delta(diff))}). "
+            f"{diff['hashed']} file(s) needed their hashes compared.\n")
+    lines = [f"+ {path} ({format_bytes(size)})" for path, size in diff["added"][:limit]]
+    lines += [f"- {path} ({format_bytes(size)})" for path, size in diff["removed"][:limit]]
+    lines += [f"~ {path} ({format_delta(new - old)})" for path, old, new in diff["modified"][:limit]]
+    return text + "\n".join(lines)
+
+
+def main():
+    if len(sys.argv) != 4:
+        sys.exit("Usage: python -m BackupScripts.Diff <destination> <old slot> <new slot>")
+    destination, old_slot, new_slot = sys.argv[1:]
+    catalog = BackupCatalog(CATALOG_DB) if os.path.exists(CATALOG_DB) else None
+    start = datetime.datetime.now()
+    diff = diff_slots(open_storage(destination), old_slot, new_slot, catalog)
+    print(format_diff(diff, limit=sys.maxsize))
+    print(f"Compared from the {diff['source']} in {(datetime.datetime.now() - start).total_seconds():.2f} seconds.")
+
+
+if __name__ == '__main__':
+    main()
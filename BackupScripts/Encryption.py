@@ -0,0 +1,177 @@
+import collections
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from .Utils import *
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # Only needed for profiles with encryption turned on
+    AESGCM = None
+
+# Header: magic, plaintext chunk size, random salt the file's key is derived with. It's also authenticated with every
+# chunk.
+MAGIC = b"ABKENC02"
+HEADER = struct.Struct(">8sI32s")
+TAG_SIZE = 16
+KEY_SIZE = 32
+SALT_SIZE = 32
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def encryption_available():
+    return AESGCM is not None
+
+
+def get_key_path(profile_name):
+    return os.path.join(KEY_FOLDER, f"{profile_name}.key")
+
+
+def load_key(profile_name):
+    """Returns the key of a profile, a new random key is made and saved the first time.
+    :returns: tuple: (key, bool: True if the key was just created)"""
+    key_path = get_key_path(profile_name)
+    if os.path.exists(key_path):
+        with open(key_path, 'rb') as file:
+            return file.read(), False
+    os.makedirs(KEY_FOLDER, exist_ok=True)
+    key = os.urandom(KEY_SIZE)
+    with open(key_path, 'wb') as file:
+        file.write(key)
+    return key, True
+
+
+def get_nonce(index, final):
+    # Every file has a key of its own, so the nonce only has to be unique within the file: the chunk counter and a
+    # flag on the last chunk so a truncated file fails.
+    return struct.pack(">7xIB", index, 1 if final else 0)
+
+
+class Encryptor:
+    """
+    Encrypts backups at rest with AES-256-GCM in independent chunks.
+    Every file is encrypted with its own key, derived from the profile's key with HKDF-SHA256 and a random salt kept
+    in the file's header, so nonces never repeat under one key however many files a profile backs up.
+    Every chunk is authenticated on its own with its index and whether it's the last one, so chunks can't be
+    reordered, dropped or cut off without decrypting failing. Because the chunks don't depend on each other they're
+    encrypted in parallel on a pool of 'workers' threads (the cipher runs without holding the GIL).
+    """
+
+    def __init__(self, key, workers=4, chunk_size=DEFAULT_CHUNK_SIZE):
+        if AESGCM is None:
+            raise RuntimeError("The 'cryptography' package has to be installed to encrypt backups.")
+        self.key = key
+        self.workers = max(workers, 1)
+        self.chunk_size = chunk_size
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def wrap(self, fileobj):
+        """Returns a writable file object that encrypts everything written into 'fileobj'."""
+        return EncryptingWriter(self, fileobj)
+
+    def get_cipher(self, salt):
+        """The cipher of the file with 'salt' in its header."""
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=salt, info=b"AutoBackup file key")
+        return AESGCM(hkdf.derive(self.key))
+
+    @staticmethod
+    def encrypt_chunk(cipher, data, index, final, header):
+        return cipher.encrypt(get_nonce(index, final), data, header)
+
+    @staticmethod
+    def decrypt_chunk(cipher, data, index, final, header):
+        return cipher.decrypt(get_nonce(index, final), data, header)
+
+    def decrypt(self, src, dst):
+        """Decrypts the file object 'src' into 'dst', in parallel the same way it was encrypted."""
+        header = src.read(HEADER.size)
+        if len(header) != HEADER.size or not header.startswith(MAGIC):
+            raise ValueError("Not an encrypted backup file.")
+        magic, chunk_size, salt = HEADER.unpack(header)
+        cipher = self.get_cipher(salt)
+        in_flight = collections.deque()
+        index = 0
+        data = src.read(chunk_size + TAG_SIZE)
+        while True:
+            # A chunk is the last one if nothing follows it, the final flag in its nonce has to agree.
+            next_data = src.read(chunk_size + TAG_SIZE)
+            final = not next_data
+            in_flight.append(self.pool.submit(self.decrypt_chunk, cipher, data, index, final, header))
+            while len(in_flight) > self.workers * 2:
+                dst.write(in_flight.popleft().result())
+            if final:
+                break
+            data = next_data
+            index += 1
+        while in_flight:
+            dst.write(in_flight.popleft().result())
+
+    def decrypt_file(self, src_path, dst_path):
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            self.decrypt(src, dst)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+class EncryptingWriter:
+    """
+    Writable file object that encrypts into another file object as it's written, in chunks on the Encryptor's pool.
+    At most two chunks per worker are held in memory at a time. Not seekable, zipfile writes data descriptors instead.
+    'finish' writes the last chunk without closing the file underneath, 'close' does both.
+    """
+
+    def __init__(self, encryptor, fileobj):
+        self.encryptor = encryptor
+        self.fileobj = fileobj
+        salt = os.urandom(SALT_SIZE)
+        self.cipher = encryptor.get_cipher(salt)
+        self.header = HEADER.pack(MAGIC, encryptor.chunk_size, salt)
+        self.buffer = bytearray()
+        self.index = 0
+        self.position = 0
+        self.in_flight = collections.deque()
+        self.finished = False
+        self.fileobj.write(self.header)
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        chunk_size = self.encryptor.chunk_size
+        # One byte is always kept back so the last chunk written is known to be the final one.
+        while len(self.buffer) > chunk_size:
+            self.submit(bytes(self.buffer[:chunk_size]), False)
+            del self.buffer[:chunk_size]
+        return len(data)
+
+    def submit(self, data, final):
+        self.in_flight.append(self.encryptor.pool.submit(self.encryptor.encrypt_chunk, self.cipher, data,
+                                                         self.index, final, self.header))
+        self.index += 1
+        while len(self.in_flight) > self.encryptor.workers * 2:
+            self.fileobj.write(self.in_flight.popleft().result())
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.submit(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        while self.in_flight:
+            self.fileobj.write(self.in_flight.popleft().result())
+
+    def close(self):
+        self.finish()
+        self.fileobj.close()
@@ -0,0 +1,279 @@
+import io
+import os
+import queue
+import threading
+
+from .PageCache import open_source
+from .Scanner import scan
+from .Sparse import is_sparse, iter_regions, iter_zeros, update_sparse_hash
+
+
+class _Target:
+    """One destination of a FanOut. Runs the file operations on its own thread, or inline when it's the only one."""
+    # Chunks queued per destination before the reader has to wait for the slowest destination to catch up.
+    _queue_size = 8
+
+    def __init__(self, index, name, storage, root, inline):
+        self.index = index
+        self.name = name
+        self.storage = storage
+        self.root = root
+        self.inline = inline
+        self.error = None
+        self.file = None
+        self.key = ""
+        self.thread = None
+        if not inline:
+            self.queue = queue.Queue(maxsize=self._queue_size)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def get_key(self, relative_path):
+        if not relative_path:
+            return self.root
+        return f"{self.root}/{relative_path}"
+
+    def submit(self, op):
+        if op[0] == "open" and isinstance(op[1], list):
+            op = ("open", op[1][self.index])
+        if self.error is not None:
+            return
+        if self.inline:
+            self.execute(op)
+        else:
+            self.queue.put(op)
+
+    def run(self):
+        while True:
+            op = self.queue.get()
+            if op[0] == "close":
+                self.execute(op)
+                return
+            # Once a destination fails everything sent to it is dropped, so the reader never waits on a dead disk.
+            if self.error is None:
+                self.execute(op)
+
+    def execute(self, op):
+        try:
+            name = op[0]
+            if name == "write":
+                self.file.write(op[1])
+            elif name == "open":
+                self.key = self.get_key(op[1])
+                self.file = self.storage.open_write(self.key)
+            elif name == "close_file":
+                self.file.close()
+                self.file = None
+                if op[1]:
+                    self.storage.copy_stat(op[1], self.key)
+            elif name == "seek":
+                self.file.seek(op[1])
+            elif name == "truncate":
+                self.file.truncate(op[1])
+            elif name == "flush":
+                self.file.flush()
+            elif name == "makedirs":
+                self.storage.makedirs(self.get_key(op[1]))
+            elif name == "copystat":
+                self.storage.copy_stat(op[1], self.get_key(op[2]))
+            elif name == "close":
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                # Surfaces errors of uploads still running in the background.
+                self.storage.flush()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            if self.file is not None:
+                try:
+                    # Half written objects are dropped where the backend can, local files are left in staging.
+                    if hasattr(self.file, "abort"):
+                        self.file.abort()
+                    else:
+                        self.file.close()
+                except Exception:
+                    pass
+                self.file = None
+
+    def close(self):
+        if self.inline:
+            self.execute(("close",))
+        else:
+            self.queue.put(("close",))
+            self.thread.join()
+
+
+class FanOut:
+    """
+    Writes the same data into several destinations at once, so each source file only has to be read once no matter
+    how many destinations a profile has. Every destination writes on its own thread through a small queue, the reader
+    runs at the speed of the slowest destination that is still working.
+    'targets' is a list of (name, storage backend, root key), paths given to the methods are relative to the root key.
+    A destination that fails is dropped from then on and reported in 'failed' without stopping the others.
+    Acts as a writable file object for one file at a time between 'open' and 'close_file', so it can be handed to
+    'zipfile.ZipFile' as well.
+    """
+
+    def __init__(self, targets):
+        inline = len(targets) == 1
+        self.targets = [_Target(index, name, storage, root, inline)
+                        for index, (name, storage, root) in enumerate(targets)]
+        self.position = 0
+        self.size = 0
+
+    @property
+    def failed(self):
+        """Returns the destinations that failed so far as a dict of {name: exception}."""
+        return {i.name: i.error for i in self.targets if i.error is not None}
+
+    @property
+    def alive(self):
+        return any(i.error is None for i in self.targets)
+
+    def send(self, op):
+        for target in self.targets:
+            target.submit(op)
+
+    def makedirs(self, relative_path=""):
+        self.send(("makedirs", relative_path))
+
+    def copystat(self, src, relative_path):
+        self.send(("copystat", src, relative_path))
+
+    def open(self, relative_path):
+        """Opens a new file on all destinations, 'relative_path' can be a list with a different name for each one."""
+        self.position = 0
+        self.size = 0
+        self.send(("open", relative_path))
+
+    def close_file(self, stat_src=None):
+        """Closes the current file on all destinations, copying the stats of 'stat_src' onto it if given."""
+        self.send(("close_file", stat_src))
+
+    def close(self):
+        """Waits for every destination to finish writing.
+        :returns: dict: {name: exception} of the destinations that failed"""
+        for target in self.targets:
+            target.close()
+        return self.failed
+
+    # File object methods used by 'zipfile.ZipFile'
+    def write(self, data):
+        # Bytes are immutable, so every destination can be given the same object without a copy.
+        data = bytes(data)
+        self.send(("write", data))
+        self.position += len(data)
+        self.size = max(self.size, self.position)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # Raising here makes zipfile write data descriptors instead of seeking back to fix the headers.
+        if not self.seekable():
+            raise io.UnsupportedOperation("seek")
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = offset
+        self.send(("seek", offset))
+        return offset
+
+    def seekable(self):
+        return all(i.storage.seekable for i in self.targets)
+
+    def truncate(self, size):
+        """Sets the size of the current file, extending it past the last write leaves a hole at the end."""
+        self.size = size
+        self.send(("truncate", size))
+        return size
+
+    def flush(self):
+        self.send(("flush",))
+
+
+def copy_tree(src, targets, progress=None, chunk_size=1024 * 1024, encryptor=None, record=None, packer=None,
+              workers=4, totals=None):
+    """
+    Copies the folder 'src' into every target of a FanOut reading each file only once, like 'shutil.copytree' with
+    'dirs_exist_ok=True' for several destinations. Symlinks are followed and their contents copied, same as copytree.
+    The folder is walked with 'scan', its sub folders listed in parallel (on 'workers' threads) while the files found
+    are being copied.
+    With an 'encryptor' every file is encrypted once before being written to the destinations, names are kept.
+    Every file copied is added to the catalog's SlotRecord 'record' if given, hashed from the same read.
+    Files a 'packer' (see 'Packs.py') takes are packed together instead of being copied one by one.
+    Files are read as the cache mode of 'PageCache.py' says, in 'chunk_size' reads. Every file found is counted into
+    the ScanTotals 'totals' if given.
+    :returns: dict: {name: exception} of the destinations that failed
+    """
+    fan_out = FanOut(targets)
+    fan_out.makedirs()
+    try:
+        folders = [""]
+        for entry in scan(src, workers, follow_links=True):
+            if not fan_out.alive:
+                break
+            relative_path = entry.relative_path
+            if entry.is_dir:
+                fan_out.makedirs(relative_path)
+                folders.append(relative_path)
+                continue
+            file_path = entry.path
+            stat = entry.stat
+            if totals is not None:
+                totals.add(stat)
+            if packer is not None and packer.add(fan_out, file_path, relative_path, stat):
+                continue
+            if progress is not None:
+                progress.start_file(file_path)
+            fan_out.open(relative_path)
+            output = encryptor.wrap(fan_out) if encryptor is not None else fan_out
+            digest = record.new_hash() if record is not None else None
+            with open_source(file_path) as fsrc:
+                if is_sparse(stat):
+                    # Holes are kept as holes where the destinations can seek, written out as zeros otherwise.
+                    keep_holes = encryptor is None and fan_out.seekable()
+                    for offset, length, data in iter_regions(fsrc, stat.st_size, chunk_size):
+                        if data is not None:
+                            if keep_holes and fan_out.tell() != offset:
+                                fan_out.seek(offset)
+                            output.write(data)
+                            if digest is not None:
+                                update_sparse_hash(digest, offset, data)
+                        elif not keep_holes:
+                            for zeros in iter_zeros(length, chunk_size):
+                                output.write(zeros)
+                        if progress is not None:
+                            progress.add_bytes(length, paced=data is not None)
+                    if keep_holes:
+                        fan_out.truncate(stat.st_size)
+                else:
+                    while True:
+                        data = fsrc.read(chunk_size)
+                        if not data:
+                            break
+                        output.write(data)
+                        if digest is not None:
+                            digest.update(data)
+                        if progress is not None:
+                            progress.add_bytes(len(data))
+            if encryptor is not None:
+                output.finish()
+            fan_out.close_file(file_path)
+            if record is not None:
+                record.add(relative_path, stat.st_size, stat.st_mtime, digest.hexdigest())
+            if progress is not None:
+                progress.finish_file()
+        if packer is not None and fan_out.alive:
+            packer.finish(fan_out)
+        # Folder stats are copied last, writing the files into them would change their modification time otherwise.
+        for relative_path in reversed(folders):
+            fan_out.copystat(os.path.join(src, *relative_path.split("/")), relative_path)
+    except BaseException:
+        # A stopped backup or a source that can't be read, the destinations' threads are ended before it's raised.
+        fan_out.close()
+        raise
+    return fan_out.close()
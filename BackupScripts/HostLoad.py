@@ -0,0 +1,204 @@
+import os
+import threading
+
+from .Progress import format_bytes
+from .Utils import *
+
+
+def read_load():
+    """The 1 minute load average per CPU, None where the OS doesn't have one (Windows)."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+def read_disk_ticks():
+    """Milliseconds every whole disk has spent doing I/O since boot as {disk: ms}, from '/proc/diskstats'.
+    Partitions, loop and ram devices are left out. Empty where there's no '/proc/diskstats'."""
+    ticks = {}
+    try:
+        with open("/proc/diskstats") as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) < 13:
+                    continue
+                name = fields[2]
+                if name.startswith(("loop", "ram", "zram")) or not os.path.exists(f"/sys/block/{name}"):
+                    continue
+                ticks[name] = int(fields[12])
+    except (OSError, ValueError):
+        return {}
+    return ticks
+
+
+def read_pressure(resource):
+    """Percent of the last 10 seconds some tasks were stalled waiting on 'resource' ('memory', 'io' or 'cpu'), from
+    '/proc/pressure'. None where the kernel has no pressure stall information."""
+    try:
+        with open(f"/proc/pressure/{resource}") as file:
+            for line in file:
+                if line.startswith("some"):
+                    return float(line.split()[1].split("=")[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class LoadGovernor:
+    """
+    Keeps backups out of the way of whatever else the host is busy with. 'wait_for_idle' holds a backup cycle back
+    while the host is busy, for at most 'max_deferral' seconds, and 'throttle' slows a running backup down while it's
+    busy and lets it speed back up once it's idle again.
+    The host is busy if the 1 minute load average per CPU is above 'max_load', the busiest disk is doing I/O more than
+    'max_disk_busy' percent of the time, or tasks are stalled on memory or I/O more than 'max_pressure' percent of the
+    time. What can't be measured on this OS (all of it on Windows) never counts as busy.
+    Every deferral and change of speed is logged with the reason, so a backup that ran late can be traced back.
+    Time is read from and waited on with 'clock' (the BackupThread's), every wait ends early once 'stop_event' is set.
+    """
+    # Seconds between samples of the host load.
+    _sample_interval = 5
+
+    def __init__(self, clock, stop_event, enabled=True, max_load=1.5, max_disk_busy=90, max_pressure=20,
+                 max_deferral=1800, min_rate=5 * 1024 * 1024):
+        self.clock = clock
+        self.stop_event = stop_event
+        self.enabled = enabled
+        self.max_load = max_load
+        self.max_disk_busy = max_disk_busy
+        self.max_pressure = max_pressure
+        self.max_deferral = max_deferral
+        self.min_rate = min_rate
+
+        self.lock = threading.Lock()
+        self.profile_name = ""
+        self.last_ticks = {}
+        self.last_ticks_time = 0
+        # Bytes per second the running backup is slowed to, None at full speed.
+        self.rate = None
+        # Speed of the backup before it was first slowed down.
+        self.full_rate = None
+        self.next_sample = 0
+        self.sample_start = 0
+        self.sample_bytes = 0
+        # Rate limiting window
+        self.window_start = 0
+        self.window_bytes = 0
+        # True once the running cycle was slowed down, its speed says nothing about the destination then.
+        self.throttled = False
+
+    def sample(self):
+        """Returns the current load of the host, values that can't be measured are None. Disk use is measured since the
+        last sample, so the first one has none.
+        :returns: dict: {"load": float, "disk_busy": float, "memory_pressure": float, "io_pressure": float}"""
+        ticks = read_disk_ticks()
+        now = self.clock.monotonic()
+        disk_busy = None
+        elapsed = (now - self.last_ticks_time) * 1000
+        busy = [(ticks[i] - self.last_ticks[i]) / elapsed * 100 for i in ticks if i in self.last_ticks and elapsed > 0]
+        if busy:
+            disk_busy = min(max(busy), 100)
+        self.last_ticks = ticks
+        self.last_ticks_time = now
+        return {"load": read_load(), "disk_busy": disk_busy, "memory_pressure": read_pressure("memory"),
+                "io_pressure": read_pressure("io")}
+
+    def get_reasons(self, sample):
+        """Returns why the host counts as busy in 'sample', an empty list if it's not."""
+        reasons = []
+        if sample["load"] is not None and sample["load"] > self.max_load:
+            reasons.append(f"load {sample['load']:.2f} per CPU > {self.max_load}")
+        if sample["disk_busy"] is not None and sample["disk_busy"] > self.max_disk_busy:
+            reasons.append(f"disk busy {sample['disk_busy']:.0f}% > {self.max_disk_busy}%")
+        for resource in ["memory", "io"]:
+            pressure = sample[f"{resource}_pressure"]
+            if pressure is not None and pressure > self.max_pressure:
+                reasons.append(f"{resource} pressure {pressure:.1f}% > {self.max_pressure}%")
+        return reasons
+
+    def wait_for_idle(self, profile_name, progress=None):
+        """
+        Holds a backup cycle of 'profile_name' back while the host is busy, checking again every '_sample_interval'
+        seconds until it's idle, 'max_deferral' seconds have passed or 'stop_event' is set. 'progress' shows the cycle
+        as 'Deferred' meanwhile.
+        :returns: float: seconds the cycle was deferred
+        """
+        if not self.enabled or self.max_deferral <= 0:
+            return 0
+        start = self.clock.monotonic()
+        if start - self.last_ticks_time > self._sample_interval * 2:
+            # Disk use needs an earlier sample to be measured against.
+            self.sample()
+            self.clock.wait(self.stop_event, 1)
+        reasons = self.get_reasons(self.sample())
+        if not reasons:
+            return 0
+        log(f"ALERT: Backup of profile {profile_name} deferred, host is busy: {', '.join(reasons)}")
+        if progress is not None:
+            progress.begin(profile_name, "Deferred")
+        while reasons and not self.stop_event.is_set():
+            waited = self.clock.monotonic() - start
+            if waited >= self.max_deferral:
+                log(f"ALERT: Backup of profile {profile_name} deferred for the maximum of {self.max_deferral} seconds, "
+                    f"starting while host is busy: {', '.join(reasons)}")
+                break
+            self.clock.wait(self.stop_event, min(self._sample_interval, self.max_deferral - waited))
+            reasons = self.get_reasons(self.sample())
+        deferred = self.clock.monotonic() - start
+        log(f"ALERT: Backup of profile {profile_name} starting after being deferred for {deferred:.0f} seconds.")
+        return deferred
+
+    def start_cycle(self, profile_name):
+        """Every backup cycle starts at full speed."""
+        with self.lock:
+            self.profile_name = profile_name
+            self.rate = None
+            self.full_rate = None
+            self.throttled = False
+            now = self.clock.monotonic()
+            self.next_sample = now + self._sample_interval
+            self.sample_start = now
+            self.sample_bytes = 0
+
+    def throttle(self, size):
+        """
+        Called with the size of every chunk the backup reads, waits long enough to keep it under the current rate or
+        until 'stop_event' is set.
+        Every '_sample_interval' seconds the host load is sampled, the rate is halved (down to 'min_rate') while it's
+        busy and doubled while it's idle until the backup is back at full speed.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            now = self.clock.monotonic()
+            self.sample_bytes += size
+            if now >= self.next_sample:
+                self.adjust(self.get_reasons(self.sample()), self.sample_bytes / max(now - self.sample_start, 1e-3))
+                self.next_sample = now + self._sample_interval
+                self.sample_start = now
+                self.sample_bytes = 0
+            if self.rate is None:
+                return
+            self.throttled = True
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_bytes = 0
+            self.window_bytes += size
+            delay = self.window_bytes / self.rate - (now - self.window_start)
+        if delay > 0:
+            self.clock.wait(self.stop_event, delay)
+
+    def adjust(self, reasons, measured_rate):
+        if reasons:
+            if self.rate is None:
+                self.full_rate = measured_rate
+            rate = max((self.rate or measured_rate) / 2, self.min_rate)
+            if rate != self.rate:
+                log(f"ALERT: Backup of profile {self.profile_name} slowed to {format_bytes(rate)}/s, host is busy: "
+                    f"{', '.join(reasons)}")
+            self.rate = rate
+        elif self.rate is not None:
+            self.rate *= 2
+            if self.rate >= self.full_rate:
+                self.rate = None
+                log(f"ALERT: Backup of profile {self.profile_name} back to full speed, host is idle.")
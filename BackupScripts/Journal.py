@@ -0,0 +1,407 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .Scanner import ScanEntry, scan_file_system
+from .Utils import *
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # Without it changes are only found from the modification times of folders
+    FileSystemEventHandler = object
+    Observer = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    is_link INTEGER NOT NULL,
+    mode INTEGER,
+    size INTEGER,
+    mtime REAL,
+    blocks INTEGER,
+    PRIMARY KEY (folder, name)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+# Events of the watcher that don't change anything.
+_IGNORED_EVENTS = {"opened", "closed_no_write"}
+# Rows written to the journal at once during a full scan.
+_BATCH_SIZE = 10000
+# Files a scan stats again in one job of its pool.
+_STAT_CHUNK = 250
+
+
+def get_journal_path(root):
+    """The journal of the folder 'root' in the 'JOURNAL_FOLDER', named after the folder."""
+    digest = hashlib.sha1(os.path.normpath(os.path.abspath(root)).encode()).hexdigest()[:12]
+    return os.path.join(JOURNAL_FOLDER, f"{os.path.basename(os.path.normpath(root))}_{digest}.db")
+
+
+def make_stat(mode, size, mtime, blocks):
+    """A stat result with what the journal keeps of a file, everything a backup reads from one."""
+    seconds = int(mtime)
+    return os.stat_result((mode, 0, 0, 1, 0, 0, size, seconds, seconds, seconds),
+                          {"st_atime": mtime, "st_mtime": mtime, "st_ctime": mtime, "st_blocks": blocks})
+
+
+def stat_files(paths):
+    """Stats each of the 'paths', None for the ones that are gone."""
+    stats = []
+    for path in paths:
+        try:
+            stats.append(os.stat(path))
+        except OSError:
+            stats.append(None)
+    return stats
+
+
+def get_parent(relative_path):
+    return relative_path.rpartition("/")[0]
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Marks the folders changed under a journal's folder as dirty, called on the watcher's thread."""
+
+    def __init__(self, journal):
+        super().__init__()
+        self.journal = journal
+
+    def on_any_event(self, event):
+        if event.event_type in _IGNORED_EVENTS:
+            return
+        paths = [event.src_path, getattr(event, "dest_path", "")]
+        for path in paths:
+            if path:
+                self.journal.mark_dirty(os.fsdecode(path), event.is_directory)
+
+
+class ChangeJournal:
+    """
+    Persistent listing of one folder backed up, so a scan only lists the sub folders that changed since the last one
+    instead of listing every folder. Kept in an SQLite file in the 'JOURNAL_FOLDER': every file's stat (mode, size,
+    modification time, blocks) and the modification time of every sub folder.
+    Folders are dirty when the watcher saw something change in them ('start_watching', needs the 'watchdog' package),
+    it runs between backups and only the dirty folders are listed again. Without the watcher, or when it wasn't
+    running since the last scan (after a restart), every sub folder is stat'ed instead and the ones with a new
+    modification time are dirty: that catches files added, removed and renamed. Files changed in place don't change
+    their folder, so the next 'scan' after that stats every file again to read them as they are now. While the
+    watcher covers the folder its events catch those too and the files' stats are read from the journal. Every
+    'full_scan_hours' the whole folder is scanned again like without a journal, that also catches anything the
+    watcher missed.
+    Scans are read from the journal once it's registered with 'Scanner.set_journal'.
+    """
+
+    def __init__(self, root, full_scan_hours=24, path=None):
+        self.root = root
+        self.full_scan_seconds = full_scan_hours * 3600
+        self.lock = threading.Lock()
+        path = path or get_journal_path(root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.commit()
+
+        self.observer = None
+        self.events_lock = threading.Lock()
+        # Relative paths of the folders the watcher saw change since the last scan.
+        self.events = set()
+        # True once the watcher ran through a whole scan, its events alone tell what changed since.
+        self.covered = False
+        # True while files may have changed in place without the watcher seeing it, until a scan stats them again.
+        self.stale = True
+
+    def get_path(self, relative_path):
+        return os.path.join(self.root, *relative_path.split("/")) if relative_path else self.root
+
+    def start_watching(self):
+        """Starts watching the folder for changes, returns False if the 'watchdog' package is missing or the folder
+        can't be watched (too many folders for the OS's limit of watches)."""
+        if Observer is None:
+            return False
+        if self.observer is not None and self.observer.is_alive():
+            return True
+        try:
+            self.observer = Observer()
+            self.observer.schedule(_EventHandler(self), self.root, recursive=True)
+            self.observer.start()
+            return True
+        except Exception as e:
+            log(f"ERROR: {self.root} can not be watched, its changes are found from folder times instead: {e}")
+            self.observer = None
+            return False
+
+    def stop_watching(self):
+        if self.observer is not None:
+            try:
+                self.observer.stop()
+                self.observer.join(5)
+            except Exception as e:
+                log(f"ERROR: Watcher of {self.root} could not be stopped: {e}")
+            self.observer = None
+        self.covered = False
+
+    def is_watching(self):
+        return self.observer is not None and self.observer.is_alive()
+
+    def mark_dirty(self, path, is_directory):
+        """Marks the folder holding 'path', and 'path' itself if it's a folder, as dirty."""
+        relative_path = os.path.relpath(path, self.root)
+        if relative_path.startswith(os.pardir):
+            return
+        relative_path = "" if relative_path == os.curdir else relative_path.replace(os.sep, "/")
+        with self.events_lock:
+            if relative_path:
+                self.events.add(get_parent(relative_path))
+            if is_directory:
+                self.events.add(relative_path)
+
+    def close(self):
+        self.stop_watching()
+        with self.lock:
+            self.connection.close()
+
+    def get_state(self, key):
+        row = self.connection.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def needs_full_scan(self):
+        last_scan = self.get_state("full_scan")
+        if last_scan is None or not self.connection.execute("SELECT 1 FROM folders WHERE path = ''").fetchone():
+            return True
+        return 0 < self.full_scan_seconds <= time.time() - last_scan
+
+    def refresh(self, workers=4):
+        """Brings the journal up to date with the folder, with a full scan when one is due.
+        :returns: int: folders listed again, None after a full scan"""
+        # A folder that's gone or can't be read fails its scan the same as without a journal, rather than being read
+        # from the rows of the last one.
+        with os.scandir(self.root):
+            pass
+        with self.lock:
+            watching = self.is_watching()
+            with self.events_lock:
+                events, self.events = self.events, set()
+            if self.needs_full_scan():
+                self.full_scan(workers)
+                self.stale = False
+                rescanned = None
+            else:
+                if not (watching and self.covered):
+                    events |= self.get_changed_folders(workers)
+                    self.stale = True
+                rescanned = self.rescan_folders(events)
+            self.covered = watching
+            return rescanned
+
+    def full_scan(self, workers=4):
+        """Lists and stats everything in the folder again, in parallel like a scan without a journal."""
+        started = time.time()
+        files = 0
+        with self.connection:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM folders")
+            folders = []
+            rows = []
+            try:
+                folders.append(("", self.get_folder_mtime(self.root, started)))
+            except OSError:
+                # The folder is gone, it's scanned fully again once it's back.
+                return
+            for entry in scan_file_system(self.root, workers):
+                folder, _, name = entry.relative_path.rpartition("/")
+                if entry.is_dir:
+                    is_link = os.path.islink(entry.path)
+                    rows.append((folder, name, 1, int(is_link), None, None, None, None))
+                    if not is_link:
+                        try:
+                            folders.append((entry.relative_path, self.get_folder_mtime(entry.path, started)))
+                        except OSError:
+                            pass
+                else:
+                    files += 1
+                    rows.append(self.get_file_row(folder, name, entry.stat))
+                if len(rows) >= _BATCH_SIZE:
+                    self.insert(rows, folders)
+                    rows, folders = [], []
+            self.insert(rows, folders)
+            self.connection.execute("INSERT OR REPLACE INTO state VALUES ('full_scan', ?)", (started,))
+        log(f"INFO: Full scan of {self.root}: {files} files in {time.time() - started:.1f} seconds")
+
+    @staticmethod
+    def get_folder_mtime(path, started):
+        """Modification time of a folder as it's listed by a full scan. Folders listed while they changed are kept
+        with a time that never matches, so the next scan lists them again."""
+        mtime = os.stat(path).st_mtime_ns
+        return mtime if mtime < started * 1e9 else 0
+
+    @staticmethod
+    def get_file_row(folder, name, stat):
+        return folder, name, 0, 0, stat.st_mode, stat.st_size, stat.st_mtime, getattr(stat, "st_blocks", None)
+
+    def insert(self, rows, folders):
+        self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.connection.executemany("INSERT OR REPLACE INTO folders VALUES (?, ?)", folders)
+
+    def get_changed_folders(self, workers=4):
+        """Stats every sub folder the journal knows, on 'workers' threads.
+        :returns: set: relative paths of the folders that are gone or have a new modification time"""
+        folders = self.connection.execute("SELECT path, mtime FROM folders").fetchall()
+
+        def is_changed(folder):
+            try:
+                return os.stat(self.get_path(folder[0])).st_mtime_ns != folder[1]
+            except OSError:
+                return True
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            return {folder[0] for folder, changed in zip(folders, pool.map(is_changed, folders))
+                    if changed}
+
+    def rescan_folders(self, dirty):
+        """Lists the 'dirty' folders again, parents before their sub folders, and any new sub folder found in them.
+        :returns: int: folders listed"""
+        known = {row[0] for row in self.connection.execute("SELECT path FROM folders")}
+        done = set()
+        with self.connection:
+            for folder in sorted(dirty):
+                # A folder in one that isn't known yet is listed along with it, if it's still there.
+                if folder in done or (folder and get_parent(folder) not in known):
+                    continue
+                stack = [folder]
+                while stack:
+                    current = stack.pop()
+                    done.add(current)
+                    new_folders = [i for i in self.rescan_folder(current) if i not in known]
+                    known.update(new_folders)
+                    stack.extend(new_folders)
+        return len(done)
+
+    def rescan_folder(self, folder):
+        """Lists one folder again and replaces its entries, sub folders no longer in it are dropped with everything
+        in them.
+        :returns: list: relative paths of its sub folders"""
+        path = self.get_path(folder)
+        try:
+            # Taken before listing, a change while it's listed leaves the folder dirty for the next scan.
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                entries = list(entries)
+        except OSError:
+            self.drop_folder(folder)
+            return []
+        rows = []
+        sub_folders = []
+        for entry in entries:
+            relative_path = f"{folder}/{entry.name}" if folder else entry.name
+            try:
+                if entry.is_dir():
+                    is_link = entry.is_symlink()
+                    rows.append((folder, entry.name, 1, int(is_link), None, None, None, None))
+                    if not is_link:
+                        sub_folders.append(relative_path)
+                else:
+                    rows.append(self.get_file_row(folder, entry.name, entry.stat()))
+            except OSError:
+                continue
+        old_folders = {f"{folder}/{row[0]}" if folder else row[0] for row in self.connection.execute(
+            "SELECT name FROM entries WHERE folder = ? AND is_dir = 1 AND is_link = 0", (folder,))}
+        for gone in old_folders.difference(sub_folders):
+            self.drop_folder(gone)
+        self.connection.execute("DELETE FROM entries WHERE folder = ?", (folder,))
+        self.insert(rows, [(folder, mtime)])
+        return sub_folders
+
+    def drop_folder(self, folder):
+        """Drops a folder and everything under it from the journal, its entry in its parent stays until the parent is
+        listed again."""
+        if not folder:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM folders")
+            return
+        # Everything under 'folder/', '0' is the character after '/'.
+        low, high = folder + "/", folder + "0"
+        self.connection.execute("DELETE FROM entries WHERE folder = ? OR (folder >= ? AND folder < ?)",
+                                (folder, low, high))
+        self.connection.execute("DELETE FROM folders WHERE path = ? OR (path >= ? AND path < ?)", (folder, low, high))
+
+    def scan(self, workers=4, follow_links=False):
+        """Same as 'Scanner.scan' of the folder, from the journal once it's brought up to date. While it's 'stale' every
+        file is stat'ed again (on 'workers' threads), so a file that changed without its folder changing (a sparse
+        file that grew, a file written in place) is read as it is now: rows that no longer match are updated, files
+        that are gone are left out. Links to folders are scanned from the file system when they're followed, they
+        aren't watched."""
+        self.refresh(workers)
+        restat = self.stale
+        with self.lock:
+            cursor = self.connection.execute("SELECT folder, name, is_dir, is_link, mode, size, mtime, blocks "
+                                             "FROM entries ORDER BY folder, name")
+        folder_prefix = (None, None)
+        changed = []
+        pool = ThreadPoolExecutor(max_workers=max(workers, 1)) if restat else None
+        try:
+            while True:
+                with self.lock:
+                    rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                paths = []
+                for folder, name, *_ in rows:
+                    if folder != folder_prefix[0]:
+                        # Rows come a folder at a time, its path ending in a separator is joined with each name.
+                        folder_prefix = (folder, os.path.join(self.get_path(folder), ""))
+                    paths.append(folder_prefix[1] + name)
+                if restat:
+                    files = [path for path, row in zip(paths, rows) if not row[2]]
+                    # A few hundred stats a job, one each costs more in handing it to a thread than in the stat.
+                    stats = itertools.chain.from_iterable(pool.map(stat_files, [
+                        files[i:i + _STAT_CHUNK] for i in range(0, len(files), _STAT_CHUNK)]))
+                for path, row in zip(paths, rows):
+                    folder, name, is_dir, is_link = row[:4]
+                    relative_path = f"{folder}/{name}" if folder else name
+                    if is_dir:
+                        yield ScanEntry(path, relative_path, True, None)
+                        if is_link and follow_links:
+                            for entry in scan_file_system(path, workers, True):
+                                yield entry._replace(relative_path=f"{relative_path}/{entry.relative_path}")
+                    elif not restat:
+                        yield ScanEntry(path, relative_path, False, make_stat(*row[4:]))
+                    else:
+                        stat = next(stats)
+                        if stat is None:
+                            continue
+                        new_row = self.get_file_row(folder, name, stat)
+                        if new_row != row:
+                            changed.append(new_row)
+                        yield ScanEntry(path, relative_path, False, stat)
+        finally:
+            cursor.close()
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        if restat:
+            with self.lock, self.connection:
+                self.insert(changed, [])
+                self.stale = False
+
+    def get_totals(self, workers=4):
+        """Same as 'Planner.scan_tree' of the folder, counted by the journal once it's brought up to date.
+        :returns: tuple: (files, bytes, physical bytes)"""
+        self.refresh(workers)
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(MIN(COALESCE(blocks * 512, size), size)), 0) "
+                "FROM entries WHERE is_dir = 0").fetchone()
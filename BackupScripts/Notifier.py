@@ -0,0 +1,146 @@
+import queue
+import threading
+import time
+
+from .Utils import *
+
+# Queued by 'NotificationDispatcher.flush' with the event to set once everything before it was sent.
+_FLUSH = object()
+
+
+class NotificationDispatcher:
+    """
+    Sends notifications from its own thread so whoever calls 'notify' never waits on the notification backend.
+    Events arriving close together are merged into one summary (e.g. '3 backups completed, 1 error') and every level
+    has a minimum gap between two notifications. Events held back by the gap are merged into the next notification
+    instead of being dropped. Events with 'override' skip all of it and are sent as soon as they're queued.
+    """
+    # Which headers are shown for each 'notify_level' in the 'config.ini'.
+    _levels = {"all": frozenset({"INFO:", "ALERT:", "ERROR:"}),
+               "error/alert": frozenset({"ERROR:", "ALERT:"}),
+               "error": frozenset({"ERROR:"})
+               }
+    # Most severe first, a summary is sent with the most severe header it contains.
+    _severity = ["ERROR:", "ALERT:", "INFO:"]
+    # Minimum seconds between two notifications of the same level.
+    _min_gap = {"ERROR:": 2, "ALERT:": 5, "INFO:": 10}
+
+    def __init__(self, send, notify_level="all", enabled=True, debug=False, coalesce_window=2):
+        """'send' is called as send(message, header) from the dispatcher thread."""
+        self.send = send
+        self.allowed = self._levels.get(notify_level, self._levels["all"])
+        self.enabled = enabled
+        self.debug = debug
+        self.coalesce_window = coalesce_window
+
+        self.events = queue.Queue()
+        self.pending = []
+        self.last_sent = {}
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def notify(self, header, message, override=False, kind=None):
+        """Queues an event. 'kind' groups events in a summary, 'backup' is counted as a completed backup."""
+        self.events.put((header, message, override, kind))
+
+    def flush(self, timeout=5):
+        """Sends everything queued or held back right away, ignoring the window and the gaps, and waits up to
+        'timeout' seconds for it to be sent. Used before a notification is removed, so the last ones aren't shown
+        after it."""
+        if threading.current_thread() is self.thread:
+            return
+        flushed = threading.Event()
+        self.events.put((_FLUSH, flushed))
+        flushed.wait(timeout)
+
+    def run(self):
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = self.next_send_time() - time.monotonic()
+            try:
+                event = self.events.get(timeout=max(timeout, 0) if timeout is not None else None)
+            except queue.Empty:
+                event = None
+            burst = []
+            flushed = None
+            # Gather everything else that arrives within the window into the same notification. Overrides are sent as
+            # they come and a flush ends the window early.
+            deadline = time.monotonic() + self.coalesce_window
+            while event is not None:
+                if event[0] is _FLUSH:
+                    flushed = event[1]
+                    break
+                if event[2]:
+                    self.send_events([event])
+                else:
+                    burst.append(event)
+                remaining = deadline - time.monotonic()
+                if not burst or remaining <= 0:
+                    break
+                try:
+                    event = self.events.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            self.send_events(burst, force=flushed is not None)
+            if flushed is not None:
+                flushed.set()
+
+    def send_events(self, burst, force=False):
+        try:
+            self.dispatch(burst, force)
+        except Exception as e:
+            log(f"ERROR: Notification could not be sent. {e}")
+
+    def dispatch(self, burst, force=False):
+        """Sends the overrides in 'burst' and the rest merged with what's held back, once its level's gap has passed
+        (right away if 'force')."""
+        for header, message, override, kind in burst:
+            if self.debug:
+                log(f"{header} {message}")
+            if override:
+                # The user asked for these directly, they skip the summary and the rate limit.
+                self.send(message, header)
+            elif self.enabled and header in self.allowed:
+                self.pending.append((header, message, kind))
+        if not self.pending:
+            return
+        header = self.get_header(self.pending)
+        if not force and time.monotonic() < self.last_sent.get(header, 0) + self._min_gap.get(header, 0):
+            return
+        if len(self.pending) == 1:
+            self.send(self.pending[0][1], header)
+        else:
+            self.send(self.summarize(self.pending), header)
+        self.last_sent[header] = time.monotonic()
+        self.pending = []
+
+    def next_send_time(self):
+        header = self.get_header(self.pending)
+        return self.last_sent.get(header, 0) + self._min_gap.get(header, 0)
+
+    def get_header(self, events):
+        headers = {i[0] for i in events}
+        for header in self._severity:
+            if header in headers:
+                return header
+        return events[0][0]
+
+    @staticmethod
+    def summarize(events):
+        counts = {"backup": 0, "ERROR:": 0, "ALERT:": 0, "INFO:": 0}
+        for header, message, kind in events:
+            if kind == "backup":
+                counts["backup"] += 1
+            else:
+                counts[header] = counts.get(header, 0) + 1
+        names = [("backup", "backup completed", "backups completed"), ("ERROR:", "error", "errors"),
+                 ("ALERT:", "alert", "alerts"), ("INFO:", "message", "messages")]
+        parts = []
+        for key, single, plural in names:
+            if counts[key]:
+                parts.append(f"{counts[key]} {single if counts[key] == 1 else plural}")
+        summary = ", ".join(parts)
+        # Show the most recent message under the summary so the latest state is always visible.
+        return f"{summary}\nLatest: {events[-1][1]}"
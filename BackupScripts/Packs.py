@@ -0,0 +1,78 @@
+import json
+import zipfile
+
+from .Utils import *
+
+# Folder within a copied slot holding the pack files and their index.
+PACK_FOLDER = ".packs"
+PACK_INDEX = f"{PACK_FOLDER}/index.json"
+
+
+class Packer:
+    """
+    Packs the small files of a copied (not compressed) backup into a few big pack files instead of copying each one,
+    so a slot of millions of tiny files is a few hundred objects to write, rotate and delete. 'copy_tree' hands every
+    file to 'add', files under 'threshold' bytes are taken and written out '_pack_size' bytes at a time as stored
+    (uncompressed) zips, '.packs/pack_<n>.zip' in the slot. Bigger files are left for 'copy_tree' to copy as is.
+    '.packs/index.json' lists which pack every packed file is in: {"threshold": int, "files": {path: pack}}, and the
+    catalog records the pack as the file's volume, so files are still found and restored one by one. Any zip tool can
+    open a pack. With an 'encryptor' every pack and the index are encrypted like any other file.
+    """
+    # Bytes and files put into one pack before it's written out.
+    _pack_size = 64 * 1024 * 1024
+    _pack_files = 50000
+
+    def __init__(self, threshold, progress=None, encryptor=None, record=None):
+        self.threshold = threshold
+        self.progress = progress
+        self.encryptor = encryptor
+        self.record = record
+        # (file path, path in the slot, stat) of the files waiting for the next pack.
+        self.pending = []
+        self.pending_bytes = 0
+        self.packs = 0
+        self.index = {}
+
+    def add(self, fan_out, path, relative_path, stat):
+        """Takes the file if it's small enough to be packed, writing out a pack to 'fan_out' once there's enough.
+        :returns: bool: True if the file was taken, False if it should be copied as is"""
+        if stat.st_size >= self.threshold or is_sparse(stat):
+            return False
+        self.pending.append((path, relative_path, stat))
+        self.pending_bytes += stat.st_size
+        if self.pending_bytes >= self._pack_size or len(self.pending) >= self._pack_files:
+            self.write_pack(fan_out)
+        return True
+
+    def write_pack(self, fan_out):
+        if not self.pending:
+            return
+        if self.packs == 0:
+            fan_out.makedirs(PACK_FOLDER)
+        self.packs += 1
+        name = f"{PACK_FOLDER}/pack_{self.packs:05d}.zip"
+        fan_out.open(name)
+        output = self.encryptor.wrap(fan_out) if self.encryptor is not None else fan_out
+        record = self.record.for_volume(name) if self.record is not None else None
+        # Stored, the files are usually too small to gain much from compression and can be read straight out of it.
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as zipf:
+            zip_files(self.pending, zipf, self.progress, record)
+        if self.encryptor is not None:
+            output.finish()
+        fan_out.close_file()
+        for path, relative_path, stat in self.pending:
+            self.index[relative_path] = name
+        self.pending = []
+        self.pending_bytes = 0
+
+    def finish(self, fan_out):
+        """Writes out the last pack and the index, called once every file has been added."""
+        self.write_pack(fan_out)
+        if not self.packs:
+            return
+        fan_out.open(PACK_INDEX)
+        output = self.encryptor.wrap(fan_out) if self.encryptor is not None else fan_out
+        output.write(json.dumps({"threshold": self.threshold, "files": self.index}).encode())
+        if self.encryptor is not None:
+            output.finish()
+        fan_out.close_file()
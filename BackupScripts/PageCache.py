@@ -0,0 +1,178 @@
+import errno
+import io
+import mmap
+import os
+
+# How backups use the page cache, set once per process with 'set_cache_mode':
+# 'keep' reads and writes files normally, the OS caches whatever it likes.
+# 'drop' reads sources sequentially and drops them (and the files written) from the page cache as soon as they're
+#        done with, so a backup doesn't evict the working set of everything else running on the host.
+# 'direct' reads sources with O_DIRECT, around the page cache altogether, and drops the files written like 'drop'.
+CACHE_MODES = ("keep", "drop", "direct")
+FADVISE_SUPPORTED = hasattr(os, "posix_fadvise")
+DIRECT_SUPPORTED = hasattr(os, "O_DIRECT") and hasattr(os, "preadv")
+# O_DIRECT reads have to start and end on a block boundary, into memory aligned the same way.
+ALIGNMENT = 4096
+# Bytes written to a file between asking the OS to drop it, see 'DestinationFile'.
+DROP_EVERY = 8 * 1024 * 1024
+
+_mode = "drop"
+
+
+def set_cache_mode(mode):
+    global _mode
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode: {mode}")
+    _mode = mode
+
+
+def get_cache_mode():
+    return _mode
+
+
+def advise(fd, offset, length, advice):
+    """'os.posix_fadvise' with 'advice' the name of a POSIX_FADV_ constant ("DONTNEED"), where the OS has it. Advice is
+    only a hint, it's never worth failing a backup over."""
+    if FADVISE_SUPPORTED:
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, f"POSIX_FADV_{advice}"))
+        except OSError:
+            pass
+
+
+class SourceFile:
+    """
+    A source file opened for reading by a backup, used like a file opened with 'rb'. With the 'drop' mode the OS is
+    told the file is read once from start to end, and every chunk is dropped from the page cache once it's been read.
+    With 'direct' the file is read with O_DIRECT in reads aligned to 'ALIGNMENT', into a page aligned buffer, and
+    never goes through the page cache, on file systems that don't support O_DIRECT (tmpfs) it's read like 'drop'.
+    Files that were cached before are dropped all the same, use 'keep' when the sources are other programs' hot files.
+    """
+
+    def __init__(self, path, mode=None):
+        mode = mode or _mode
+        self.path = path
+        self.drop = mode != "keep"
+        self.direct = False
+        self.fd = None
+        if mode == "direct" and DIRECT_SUPPORTED:
+            try:
+                self.fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+                self.direct = True
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+        if self.fd is None:
+            self.fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self.position = 0
+        self.buffer = None
+        if self.drop and not self.direct:
+            advise(self.fd, 0, 0, "SEQUENTIAL")
+            advise(self.fd, 0, 0, "NOREUSE")
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                data = self.read(1024 * 1024)
+                if not data:
+                    return b"".join(chunks)
+                chunks.append(data)
+        if self.direct:
+            try:
+                data = self.read_direct(size)
+            except OSError as e:
+                if e.errno != errno.EINVAL:
+                    raise
+                # The file system took the flag but not the read, the rest of the file is read normally.
+                self.reopen()
+                return self.read(size)
+        else:
+            data = os.read(self.fd, size)
+            if self.drop and data:
+                advise(self.fd, self.position, len(data), "DONTNEED")
+        self.position += len(data)
+        return data
+
+    def read_direct(self, size):
+        start = self.position - self.position % ALIGNMENT
+        end = -(-(self.position + size) // ALIGNMENT) * ALIGNMENT
+        if self.buffer is None or len(self.buffer) < end - start:
+            # Anonymous maps are page aligned.
+            self.buffer = mmap.mmap(-1, end - start)
+        with memoryview(self.buffer) as view:
+            read = os.preadv(self.fd, [view[:end - start]], start)
+            skip = self.position - start
+            return bytes(view[skip:min(read, skip + size)]) if read > skip else b""
+
+    def reopen(self):
+        os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDONLY)
+        self.direct = False
+        os.lseek(self.fd, self.position, os.SEEK_SET)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.position = os.lseek(self.fd, offset, whence)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is None:
+            return
+        if self.drop and not self.direct:
+            # Read ahead may have cached past the last chunk dropped.
+            advise(self.fd, 0, 0, "DONTNEED")
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class DestinationFile(io.FileIO):
+    """
+    A file written by a backup, dropped from the page cache as it's written. Dirty pages can't be dropped until
+    they're written out, so every 'DROP_EVERY' bytes the OS is asked to drop the file: that starts writing out what's
+    new and drops what was written out since the last time. The last stretch of a file is left for the OS to write out
+    and evict on its own.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, 'wb')
+        self.written = 0
+        self.last_drop = 0
+
+    def write(self, data):
+        written = super().write(data)
+        self.written += written
+        if self.written - self.last_drop >= DROP_EVERY:
+            advise(self.fileno(), 0, 0, "DONTNEED")
+            self.last_drop = self.written
+        return written
+
+    def close(self):
+        if not self.closed:
+            advise(self.fileno(), 0, 0, "DONTNEED")
+        super().close()
+
+
+def open_source(path):
+    """Opens a file to be backed up for reading, as the cache mode says."""
+    if _mode == "keep":
+        return open(path, 'rb')
+    return SourceFile(path)
+
+
+def open_destination(path):
+    """Opens a file on a local destination for writing, as the cache mode says."""
+    if _mode == "keep" or not FADVISE_SUPPORTED:
+        return open(path, 'wb')
+    return io.BufferedWriter(DestinationFile(path), 1024 * 1024)
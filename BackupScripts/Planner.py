@@ -0,0 +1,209 @@
+import os
+import time
+
+from .Progress import format_bytes
+from .Scanner import ScanTotals, get_journal
+from .Sparse import get_physical_size
+from .Tuning import format_tuning
+from .Utils import *
+
+# Assumed size of a zip compared to its source when a profile has never been compressed before.
+DEFAULT_COMPRESSION_RATIO = 0.6
+
+
+class BackupPlan:
+    """The estimated cost of running one backup cycle of a profile, made by 'plan_backup' without writing anything."""
+
+    def __init__(self, profile_name):
+        self.profile_name = profile_name
+        self.files = 0
+        self.bytes = 0
+        # Bytes the files take up on disk, less than 'bytes' when there are sparse files (holes aren't stored).
+        self.physical_bytes = 0
+        self.bytes_to_write = 0
+        self.compressed_bytes = None
+        self.estimated_seconds = None
+        # Settings the last backup ran with, see 'Tuning.py'.
+        self.tuning = None
+        # Every destination of the profile as {path: {"free_bytes": int, "bytes_pruned": int, "trash_bytes": int}}
+        self.destinations = {}
+
+    def get_free_after(self, destination):
+        """Free space left on a destination after the backup. Pruned slots aren't counted as freed, they're only moved
+        to the trash and deleted slowly while the backup is written. None if the destination has no limit."""
+        space = self.destinations[destination]
+        if space["free_bytes"] is None:
+            return None
+        return space["free_bytes"] - self.bytes_to_write
+
+    def needs_reclaim(self, destination):
+        """True if the backup only fits on a destination once the slots it prunes and its trash are deleted, they
+        then have to be deleted before it's written, see 'TrashReaper.purge'."""
+        free_after = self.get_free_after(destination)
+        return free_after is not None and free_after < 0 <= free_after + self.get_reclaimable(destination)
+
+    def get_reclaimable(self, destination):
+        space = self.destinations[destination]
+        return space["bytes_pruned"] + space["trash_bytes"]
+
+    @property
+    def fitting_destinations(self):
+        return [i for i in self.destinations if self.get_free_after(i) is None or self.get_free_after(i) >= 0
+                or self.needs_reclaim(i)]
+
+    @property
+    def fits(self):
+        return len(self.fitting_destinations) == len(self.destinations)
+
+    def summary(self):
+        text = (f"Profile: {self.profile_name}\n"
+                f"Files to copy: {self.files} ({format_bytes(self.bytes)})\n")
+        if self.physical_bytes < self.bytes:
+            text += f"Taking up on disk: {format_bytes(self.physical_bytes)} (sparse files)\n"
+        if self.compressed_bytes is not None:
+            text += f"Estimated zip size: {format_bytes(self.compressed_bytes)}\n"
+        for destination, space in self.destinations.items():
+            free_after = self.get_free_after(destination)
+            text += (f"Destination: {destination}\n"
+                     f"  Old backups pruned: {format_bytes(space['bytes_pruned'])}\n")
+            if self.needs_reclaim(destination):
+                text += (f"  Free space after backup: {format_bytes(free_after + self.get_reclaimable(destination))}, "
+                         f"the old backups are deleted before it's written\n")
+            elif free_after is not None:
+                text += f"  Free space after backup: {format_bytes(free_after)}\n"
+            if destination not in self.fitting_destinations:
+                text += "  Not enough free space on this destination for the backup.\n"
+        if self.tuning is not None and self.tuning.get("destination"):
+            text += f"Tuned for {self.tuning['destination']}: {format_tuning(self.tuning)}\n"
+        if self.estimated_seconds is None:
+            text += "Estimated duration: unknown until the first backup of this profile"
+        else:
+            text += f"Estimated duration: {int(self.estimated_seconds)} seconds"
+        return text
+
+
+def scan_tree(path, workers=4):
+    """Returns the number of files, total bytes and bytes taken up on disk under 'path', from one 'scan' of it
+    or from its change journal.
+    :returns: tuple: (files, bytes, physical bytes)"""
+    journal = get_journal(path)
+    if journal is not None:
+        return journal.get_totals(workers)
+    totals = ScanTotals()
+    for entry in scan_files(path, workers):
+        totals.add(entry.stat)
+    return totals.get()
+
+
+def scan_folders(folders, workers=4):
+    """Scans 'folders', the sub folders of each are scanned in parallel on 'workers' threads.
+    :returns: tuple: (files, bytes, physical bytes)"""
+    total_files = 0
+    total_bytes = 0
+    physical_bytes = 0
+    for folder in folders:
+        if os.path.isfile(folder):
+            stat = os.stat(folder)
+            files, size, physical = 1, stat.st_size, min(get_physical_size(stat), stat.st_size)
+        else:
+            files, size, physical = scan_tree(folder, workers)
+        total_files += files
+        total_bytes += size
+        physical_bytes += physical
+    return total_files, total_bytes, physical_bytes
+
+
+def get_pruned_bytes(config, profile_name, storage):
+    """Returns the size of the slots that'll be pruned from a destination's 'storage' by the next backup of the
+    profile."""
+    if config["Compression"]:
+        names = [profile_name]
+    else:
+        names = config["Folders"]
+    pruned = 0
+    for name in names:
+        # The oldest slots down to one less than 'Copies', like 'BackupThread.get_last_folder_digit'.
+        copies = storage.get_copies(name)
+        for slot in sorted(copies, key=copies.get)[:max(len(copies) - config["Copies"] + 1, 0)]:
+            pruned += storage.get_size(slot)
+    return pruned
+
+
+def get_totals(config, profile_name, workers=4, scan=True):
+    """
+    Returns what the profile's folders hold as (files, bytes, physical bytes). Folders with a change journal are
+    counted by it. With 'scan' False the totals the last backup of the profile counted while it read the folders are
+    used instead, as long as the profile still has the same folders, so a backup walks its folders only once. The
+    folders are scanned otherwise, and always with 'scan'.
+    """
+    stats = get_stats(profile_name)
+    journaled = all(get_journal(i) is not None for i in config["Folders"])
+    if not scan and not journaled and stats.get("folders") == config["Folders"] and "files" in stats:
+        return stats["files"], stats["bytes"], stats.get("physical_bytes", stats["bytes"])
+    return scan_folders(config["Folders"], workers)
+
+
+def plan_backup(config, profile_name, workers, storages, scan=True):
+    """Makes a BackupPlan for one cycle of the profile from its folders (see 'get_totals', 'scan' False for the totals
+    of the last backup) and the stats of previous runs.
+    The 'config' is expected to have been verified by 'Controller.verify_profiles' first. 'storages' are the backends
+    of the profile's destinations as {destination: backend}, destinations that can't be reached are left out."""
+    plan = BackupPlan(profile_name)
+    plan.files, plan.bytes, plan.physical_bytes = get_totals(config, profile_name, workers, scan)
+    stats = get_stats(profile_name)
+    plan.bytes_to_write = plan.bytes
+    if all(i.seekable for i in storages.values()) and not config.get("Encryption", False):
+        # Holes of sparse files are kept in copies to local destinations, they only need the space the source uses.
+        plan.bytes_to_write = plan.physical_bytes
+    if config["Compression"]:
+        ratio = stats.get("compression_ratio", DEFAULT_COMPRESSION_RATIO)
+        plan.compressed_bytes = int(plan.bytes * ratio)
+        plan.bytes_to_write = plan.compressed_bytes
+    if stats.get("throughput"):
+        plan.estimated_seconds = plan.bytes / stats["throughput"]
+    plan.tuning = stats.get("tuning")
+    for destination, storage in storages.items():
+        if not storage.is_available():
+            continue
+        free_bytes = storage.free_space()
+        # The trash is only sized when the backup doesn't fit without it, it can hold a lot of files.
+        tight = free_bytes is not None and free_bytes < plan.bytes_to_write
+        plan.destinations[destination] = {"free_bytes": free_bytes,
+                                          "bytes_pruned": get_pruned_bytes(config, profile_name, storage),
+                                          "trash_bytes": storage.get_trash_size() if tight else 0}
+    return plan
+
+
+def get_stats(profile_name):
+    """Returns the stats saved from the last backup of the profile."""
+    try:
+        return read_config(STATS_FILE).get(profile_name, {})
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def record_stats(profile_name, bytes_read, seconds, bytes_written=None, physical_bytes=None, tuning=None, files=None,
+                 folders=None):
+    """Saves the throughput (and compression ratio) of a finished backup, used to estimate the next one.
+    'bytes_read' is the logical size of the files, 'physical_bytes' what they take up on disk, 'tuning' the settings
+    the backup ran with. 'files' and 'folders' (the profile's) are kept with the sizes for the next plan."""
+    try:
+        stats = read_config(STATS_FILE)
+    except (FileNotFoundError, ValueError):
+        stats = {}
+    profile_stats = stats.get(profile_name, {})
+    if seconds > 0 and bytes_read:
+        profile_stats["throughput"] = bytes_read / seconds
+    if bytes_written is not None and bytes_read:
+        profile_stats["compression_ratio"] = bytes_written / bytes_read
+    profile_stats["bytes"] = bytes_read
+    if physical_bytes is not None:
+        profile_stats["physical_bytes"] = physical_bytes
+    if tuning is not None:
+        profile_stats["tuning"] = tuning
+    if files is not None:
+        profile_stats["files"] = files
+        profile_stats["folders"] = folders
+    profile_stats["last_backup"] = time.time()
+    stats[profile_name] = profile_stats
+    dump_json(STATS_FILE, stats)
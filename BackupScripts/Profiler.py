@@ -0,0 +1,112 @@
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from .Progress import format_bytes
+from .Utils import *
+
+
+class CycleProfiler:
+    """
+    Profiles backup cycles when turned on, for finding out why a backup is slow or why memory grows over days of
+    rotate cycles. Every 'sample_every' cycles one is run under cProfile and, if 'trace_memory', a tracemalloc snapshot
+    is taken after it and compared with the one of the previous sampled cycle.
+    A report per sampled cycle is written into the 'PROFILING_FOLDER': '<time>_<profile>_<cycle>.txt' with the 'top'
+    slowest functions and biggest allocation growth, and a '.prof' of the same name for pstats or snakeviz.
+    cProfile only sees the backup thread, time spent waiting on worker threads shows up in the calls that wait.
+    'enabled' can be changed at any time, it's picked up by the next cycle.
+    """
+
+    def __init__(self, enabled=False, sample_every=1, trace_memory=True, top=25):
+        self.enabled = enabled
+        self.sample_every = max(sample_every, 1)
+        self.trace_memory = trace_memory
+        self.top = top
+
+        self.lock = threading.Lock()
+        self.cycles = 0
+        self.last_snapshot = None
+        self.started_tracing = False
+
+    def set_enabled(self, enabled):
+        with self.lock:
+            self.enabled = enabled
+            if not enabled:
+                self.stop_tracing()
+
+    def stop_tracing(self):
+        # Only stop tracemalloc if it was started here, someone else (-X tracemalloc) might be using it.
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        self.last_snapshot = None
+
+    @contextlib.contextmanager
+    def cycle(self, profile_name):
+        """Wraps one backup cycle, profiles it if profiling is on and this cycle is sampled."""
+        with self.lock:
+            sampled = self.enabled and self.cycles % self.sample_every == 0
+            if self.enabled:
+                self.cycles += 1
+            if sampled and self.trace_memory and not tracemalloc.is_tracing():
+                # Kept running between cycles, so memory that's never freed shows up in the next snapshot's diff.
+                tracemalloc.start(10)
+                self.started_tracing = True
+        if not sampled:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.monotonic()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # Another profiler is already running on this thread.
+            log(f"ERROR: Backup cycle could not be profiled. {e}")
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            try:
+                self.write_report(profile_name, profiler, time.monotonic() - start)
+            except Exception as e:
+                log(f"ERROR: Profiling report could not be written. {e}")
+
+    def write_report(self, profile_name, profiler, seconds):
+        os.makedirs(PROFILING_FOLDER, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{profile_name}_{self.cycles}"
+        report = [f"Profile: {profile_name}", f"Cycle: {self.cycles}", f"Duration: {seconds:.2f} seconds", ""]
+
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(PROFILING_FOLDER, f"{name}.prof"))
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(self.top)
+            report += [f"Top {self.top} functions by cumulative time:", stream.getvalue()]
+
+        with self.lock:
+            if self.trace_memory and tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                ])
+                current, peak = tracemalloc.get_traced_memory()
+                report += [f"Traced memory: {format_bytes(current)} (peak during cycle {format_bytes(peak)})", ""]
+                if self.last_snapshot is None:
+                    report.append(f"Top {self.top} allocations (no earlier cycle to compare with):")
+                    report += [str(i) for i in snapshot.statistics("lineno")[:self.top]]
+                else:
+                    report.append(f"Top {self.top} allocation changes since the last profiled cycle:")
+                    report += [str(i) for i in snapshot.compare_to(self.last_snapshot, "lineno")[:self.top]]
+                self.last_snapshot = snapshot
+
+        with open(os.path.join(PROFILING_FOLDER, f"{name}.txt"), 'w') as file:
+            file.write("\n".join(report) + "\n")
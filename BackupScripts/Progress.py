@@ -0,0 +1,180 @@
+import queue
+import threading
+import time
+
+
+class BackupCancelled(Exception):
+    """Raised in the middle of a backup by 'BackupProgress' once the backup was stopped."""
+
+
+class BackupProgress:
+    """
+    Keeps track of how far along a backup is and publishes snapshots of it for the GUI and the tray icon.
+    The backup thread calls the update methods, snapshots are taken at most every 'sample_interval' seconds and put
+    into 'updates' so other threads never have to touch the backup thread or Tk from the wrong thread.
+    'throttle', if set, is called with the size of every chunk read so it can slow the backup down by sleeping.
+    'cancel_event', if set, stops the backup with BackupCancelled at the next file or chunk once the event is set.
+    A snapshot is a dict:
+    {
+        "profile": str, "state": "Deferred"/"Scanning"/"Copying"/"Compressing"/"Done",
+        "files_done": int, "files_total": int, "bytes_done": int, "bytes_total": int,
+        "current_file": str, "throughput": float (bytes per second), "eta": float (seconds) or None
+    }
+    """
+    # How much weight the newest throughput sample gets over the previous ones.
+    _smoothing = 0.3
+
+    def __init__(self, sample_interval=0.5):
+        self.sample_interval = sample_interval
+        # Only the newest snapshots matter, the oldest is dropped if the GUI falls behind.
+        self.updates = queue.Queue(maxsize=16)
+        self.lock = threading.Lock()
+        self.snapshot = {}
+        # Volumes are compressed on several threads at once, all of them add to the same counters.
+        self.count_lock = threading.Lock()
+        self.throttle = None
+        self.cancel_event = None
+
+        self.profile = ""
+        self.state = ""
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.current_file = ""
+        self.throughput = 0.0
+
+        self.last_sample_time = 0
+        self.last_sample_bytes = 0
+
+    def begin(self, profile, state="Scanning"):
+        self.profile = profile
+        self.state = state
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.current_file = ""
+        self.throughput = 0.0
+        self.last_sample_time = time.monotonic()
+        self.last_sample_bytes = 0
+        self.publish(force=True)
+
+    def set_totals(self, files_total, bytes_total, state="Copying"):
+        self.files_total = files_total
+        self.bytes_total = bytes_total
+        self.state = state
+        self.publish(force=True)
+
+    def check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise BackupCancelled()
+
+    def start_file(self, path):
+        self.check_cancelled()
+        self.current_file = path
+        self.publish()
+
+    def add_bytes(self, size, paced=True):
+        """'paced' False for bytes that were never read, the holes of sparse files."""
+        with self.count_lock:
+            self.bytes_done += size
+        if paced and self.throttle is not None:
+            self.throttle(size)
+        self.check_cancelled()
+        self.publish()
+
+    def finish_file(self):
+        with self.count_lock:
+            self.files_done += 1
+        self.publish()
+
+    def finish(self):
+        self.state = "Done"
+        self.current_file = ""
+        self.publish(force=True)
+
+    def publish(self, force=False):
+        with self.count_lock:
+            now = time.monotonic()
+            elapsed = now - self.last_sample_time
+            if not force and elapsed < self.sample_interval:
+                return
+            if elapsed > 0:
+                rate = (self.bytes_done - self.last_sample_bytes) / elapsed
+                if self.throughput:
+                    self.throughput = self._smoothing * rate + (1 - self._smoothing) * self.throughput
+                else:
+                    self.throughput = rate
+            self.last_sample_time = now
+            self.last_sample_bytes = self.bytes_done
+
+            eta = None
+            if self.throughput > 0 and self.bytes_total:
+                eta = max(self.bytes_total - self.bytes_done, 0) / self.throughput
+            snapshot = {
+                "profile": self.profile,
+                "state": self.state,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "current_file": self.current_file,
+                "throughput": self.throughput,
+                "eta": eta,
+            }
+        self.push(snapshot)
+
+    def push(self, snapshot):
+        """Publishes a snapshot taken somewhere else, the worker process's progress is handed on to the GUI with it."""
+        with self.lock:
+            self.snapshot = snapshot
+            try:
+                self.updates.put_nowait(snapshot)
+            except queue.Full:
+                try:
+                    self.updates.get_nowait()
+                except queue.Empty:
+                    pass
+                self.updates.put_nowait(snapshot)
+
+    def latest(self):
+        """Returns the most recent snapshot without taking it out of the queue."""
+        with self.lock:
+            return dict(self.snapshot)
+
+    def drain(self):
+        """Empties the queue and returns the newest snapshot in it, None if nothing new was published."""
+        snapshot = None
+        while True:
+            try:
+                snapshot = self.updates.get_nowait()
+            except queue.Empty:
+                return snapshot
+
+
+def format_bytes(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_progress(snapshot):
+    """Returns a short human readable summary of a progress snapshot."""
+    if not snapshot:
+        return "No backup is running."
+    if snapshot["state"] == "Scanning":
+        return f"Scanning folders for profile: {snapshot['profile']}"
+    if snapshot["state"] == "Deferred":
+        return f"Backup of profile {snapshot['profile']} is waiting for the host to be less busy."
+    percent = 0
+    if snapshot["bytes_total"]:
+        percent = snapshot["bytes_done"] / snapshot["bytes_total"] * 100
+    text = (f"{snapshot['state']}: {percent:.0f}% - {snapshot['files_done']}/{snapshot['files_total']} files, "
+            f"{format_bytes(snapshot['bytes_done'])}/{format_bytes(snapshot['bytes_total'])}\n"
+            f"Speed: {format_bytes(snapshot['throughput'])}/s")
+    if snapshot["eta"] is not None and snapshot["state"] != "Done":
+        text += f", ETA: {int(snapshot['eta'])} seconds"
+    return text
@@ -0,0 +1,155 @@
+import os
+import shutil
+import threading
+import time
+
+from .Utils import *
+
+
+class TrashReaper:
+    """
+    Background thread that deletes the rotation slots moved into the trash folder of a 'Destination'.
+    Pruning a slot is only a rename so a new backup can start right away, the reaper then deletes the trash file by file
+    at a bounded rate so it doesn't fight the running backup for disk I/O.
+    Trash left over from a previous run (program closed or crashed mid delete) is picked up again as soon as the
+    destination is registered with 'add_destination'.
+    """
+    # Seconds between checks of the trash folders when nothing has been pruned.
+    _idle_wait = 60
+
+    def __init__(self, files_per_second=500, bytes_per_second=100 * 1024 * 1024):
+        self.files_per_second = files_per_second
+        self.bytes_per_second = bytes_per_second
+
+        self.destinations = set()
+        self.lock = threading.Lock()
+        # Held while a trash is being emptied, by the background pass or a purge. The background pass gives way as
+        # soon as a purge is waiting.
+        self.purge_lock = threading.Lock()
+        self.purge_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Rate limiting window
+        self.window_start = 0
+        self.window_files = 0
+        self.window_bytes = 0
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def add_destination(self, destination):
+        """Registers a 'Destination' folder to be watched, any trash already in it will be deleted."""
+        if not destination or not os.path.isdir(destination):
+            return
+        with self.lock:
+            self.destinations.add(os.path.normpath(destination))
+        self.wake_event.set()
+
+    def discard(self, destination, path):
+        """Moves 'path' out of the way into the trash of 'destination' and wakes the reaper to delete it.
+        Falls back to deleting inline if the folder can't be renamed. (File open in another program on Windows)"""
+        try:
+            move_to_trash(destination, path)
+        except OSError as e:
+            log(f"ERROR: Could not move {path} to trash, deleting it instead. {e}")
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return
+        self.add_destination(destination)
+
+    def purge(self, destination):
+        """Deletes the trash of 'destination' right away without the rate limit, a backup needs the space. The
+        background pass waits until it's done."""
+        self.purge_event.set()
+        try:
+            with self.purge_lock:
+                shutil.rmtree(os.path.join(destination, TRASH_FOLDER), ignore_errors=True)
+        finally:
+            self.purge_event.clear()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.wake_event.clear()
+            with self.lock:
+                destinations = list(self.destinations)
+            for destination in destinations:
+                try:
+                    with self.purge_lock:
+                        self.empty_trash(destination)
+                except Exception as e:
+                    log(f"ERROR: Could not empty trash of {destination}. {e}")
+            self.wake_event.wait(self._idle_wait)
+
+    def empty_trash(self, destination):
+        trash_path = os.path.join(destination, TRASH_FOLDER)
+        if not os.path.isdir(trash_path):
+            return
+        for name in os.listdir(trash_path):
+            if self.is_interrupted():
+                return
+            path = os.path.join(trash_path, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                self.delete_tree(path)
+            else:
+                self.delete_file(path)
+        try:
+            os.rmdir(trash_path)
+        except OSError:
+            # Something was pruned while emptying, it's picked up on the next pass.
+            pass
+
+    def is_interrupted(self):
+        return self.stop_event.is_set() or self.purge_event.is_set()
+
+    def delete_tree(self, path):
+        # Bottom up so every folder is empty by the time it's removed.
+        for root, dirs, files in os.walk(path, topdown=False):
+            for file in files:
+                if self.is_interrupted():
+                    return
+                self.delete_file(os.path.join(root, file))
+            for folder in dirs:
+                folder_path = os.path.join(root, folder)
+                if os.path.islink(folder_path):
+                    self.delete_file(folder_path)
+                else:
+                    os.rmdir(folder_path)
+        os.rmdir(path)
+
+    def delete_file(self, path):
+        try:
+            size = os.lstat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.throttle(size)
+
+    def throttle(self, size):
+        """Sleeps long enough to keep deleting under 'files_per_second' and 'bytes_per_second'."""
+        now = time.monotonic()
+        if now - self.window_start >= 1:
+            self.window_start = now
+            self.window_files = 0
+            self.window_bytes = 0
+        self.window_files += 1
+        self.window_bytes += size
+        delay = 0
+        if self.files_per_second > 0:
+            delay = max(delay, self.window_files / self.files_per_second)
+        if self.bytes_per_second > 0:
+            delay = max(delay, self.window_bytes / self.bytes_per_second)
+        delay -= now - self.window_start
+        if delay > 0:
+            self.stop_event.wait(delay)
@@ -0,0 +1,142 @@
+import collections
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .Sparse import get_physical_size
+
+# One file or folder found by 'scan'. 'relative_path' is relative to the scanned folder with '/' on every platform,
+# 'stat' is the file's stat result (None for folders), as 'os.scandir' gave it.
+ScanEntry = collections.namedtuple("ScanEntry", ["path", "relative_path", "is_dir", "stat"])
+
+_DONE = object()
+
+
+class ScanTotals:
+    """Counts the files of a scan as they're found: how many, their bytes and the bytes they take up on disk (less
+    with sparse files). Safe to add to from several threads, volumes are compressed at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.physical_bytes = 0
+
+    def add(self, stat):
+        with self.lock:
+            self.files += 1
+            self.bytes += stat.st_size
+            self.physical_bytes += min(get_physical_size(stat), stat.st_size)
+
+    def get(self):
+        """:returns: tuple: (files, bytes, physical bytes)"""
+        return self.files, self.bytes, self.physical_bytes
+
+# Folders scanned from their change journal instead of the file system, {os.path.normpath(root): ChangeJournal}.
+_journals = {}
+
+
+def set_journal(root, journal):
+    """Scans of the folder 'root' are read from 'journal' (a 'Journal.ChangeJournal') from now on, or from the file
+    system again when it's None."""
+    if journal is None:
+        _journals.pop(os.path.normpath(root), None)
+    else:
+        _journals[os.path.normpath(root)] = journal
+
+
+def get_journal(root):
+    return _journals.get(os.path.normpath(root))
+
+
+def scan(root, workers=4, follow_links=False, queue_size=4096):
+    """Yields a ScanEntry for every file and folder under 'root', a folder always before anything in it. Read from the
+    folder's change journal when it has one, otherwise see 'scan_file_system'."""
+    journal = get_journal(root)
+    if journal is not None:
+        return journal.scan(workers, follow_links)
+    return scan_file_system(root, workers, follow_links, queue_size)
+
+
+def scan_file_system(root, workers=4, follow_links=False, queue_size=4096):
+    """
+    Walks the folder 'root' with 'os.scandir', every sub folder is scanned as its own job on a pool of 'workers'
+    threads so slow (network) file systems are listed in parallel. Yields a ScanEntry for every file and folder, a
+    folder always before anything in it. Each file is stat'ed once and its stat handed on, so nobody has to stat it
+    again. At most 'queue_size' entries are held waiting, the scan pauses when whoever is reading falls behind.
+    Links to files are followed like 'os.walk' does, links to folders only if 'follow_links'. Sub folders that can't be
+    read are skipped, 'root' itself raises OSError like 'shutil.copytree' so a source that's gone or unreadable isn't
+    backed up as an empty folder. Stopping the iteration early (break, return) stops the scan.
+    """
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = [1]
+    pool = ThreadPoolExecutor(max_workers=max(workers, 1))
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan_folder(path, relative_root):
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if stop.is_set():
+                        return
+                    relative_path = f"{relative_root}/{entry.name}" if relative_root else entry.name
+                    try:
+                        if entry.is_dir():
+                            if not put(ScanEntry(entry.path, relative_path, True, None)):
+                                return
+                            if follow_links or not entry.is_symlink():
+                                submit(entry.path, relative_path)
+                        elif not put(ScanEntry(entry.path, relative_path, False, entry.stat())):
+                            return
+                    except OSError:
+                        continue
+        except OSError as e:
+            if not relative_root:
+                put(e)
+        finally:
+            with lock:
+                pending[0] -= 1
+                done = pending[0] == 0
+            if done:
+                put(_DONE)
+
+    def submit(path, relative_root):
+        with lock:
+            pending[0] += 1
+        try:
+            pool.submit(scan_folder, path, relative_root)
+        except RuntimeError:
+            # The pool was shut down, the scan is being stopped.
+            with lock:
+                pending[0] -= 1
+
+    pool.submit(scan_folder, root, "")
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                return
+            if isinstance(item, OSError):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def scan_files(root, workers=4, follow_links=False):
+    """Same as 'scan' without the folders."""
+    for entry in scan(root, workers, follow_links):
+        if not entry.is_dir:
+            yield entry
@@ -0,0 +1,78 @@
+import errno
+import os
+
+# Windows Python has no SEEK_DATA/SEEK_HOLE, sparse files are copied like any other file there.
+SPARSE_SUPPORTED = hasattr(os, "SEEK_DATA") and hasattr(os, "SEEK_HOLE")
+_ZEROS = bytes(1024 * 1024)
+
+
+def get_physical_size(stat):
+    """Bytes a file actually takes up on disk, its logical size where the file system doesn't report blocks."""
+    blocks = getattr(stat, "st_blocks", None)
+    if blocks is None:
+        return stat.st_size
+    return blocks * 512
+
+
+def is_sparse(stat):
+    """True if the file has holes, it takes up less space on disk than its size."""
+    return SPARSE_SUPPORTED and get_physical_size(stat) < stat.st_size
+
+
+def get_data_ranges(fd, size):
+    """Returns the regions of the open file 'fd' holding data as a list of (start, end), everything else is a hole.
+    The whole file is one region if the file system can't tell where the holes are."""
+    ranges = []
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Nothing but a hole left up to the end of the file.
+                break
+            return [(0, size)]
+        if start >= size:
+            break
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        ranges.append((start, end))
+        offset = end
+    return ranges
+
+
+def iter_regions(file, size, chunk_size=1024 * 1024):
+    """
+    Reads the open file 'file' region by region, yielding (offset, length, data) in order. Holes are given as one
+    region with 'data' None and are never read, data regions are read in chunks of at most 'chunk_size'.
+    """
+    offset = 0
+    for start, end in get_data_ranges(file.fileno(), size):
+        if start > offset:
+            yield offset, start - offset, None
+        file.seek(start)
+        while start < end:
+            data = file.read(min(chunk_size, end - start))
+            if not data:
+                # The file got shorter while being read.
+                return
+            yield start, len(data), data
+            start += len(data)
+        offset = end
+    if offset < size:
+        yield offset, size - offset, None
+
+
+def iter_zeros(length, chunk_size=1024 * 1024):
+    """Yields 'length' zero bytes in chunks, to write out a hole where it can't be kept as one (zips, S3)."""
+    chunk_size = min(chunk_size, len(_ZEROS))
+    view = memoryview(_ZEROS)
+    while length > 0:
+        size = min(chunk_size, length)
+        yield view[:size]
+        length -= size
+
+
+def update_sparse_hash(digest, offset, data):
+    """Sparse files are hashed over their data regions and where they are, so the holes never have to be read."""
+    digest.update(offset.to_bytes(8, "little"))
+    digest.update(data)
@@ -0,0 +1,466 @@
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from .PageCache import open_destination
+from .Utils import *
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+except ImportError:  # Only needed for 's3://' destinations
+    boto3 = None
+    BotoConfig = None
+
+# Object written into a folder slot on an object store once every file of it has been uploaded.
+COMMIT_MARKER = ".committed"
+
+
+def is_remote(destination):
+    return destination.startswith("s3://")
+
+
+def open_storage(destination, settings=None, reaper=None):
+    """Returns the storage backend for a 'Destination', an 's3://bucket/prefix' url or a local folder path.
+    'settings' are the 's3_' options of the 'config.ini' as a dict, 'reaper' deletes pruned local slots."""
+    if is_remote(destination):
+        return S3Storage(destination, settings or {})
+    return LocalStorage(destination, reaper)
+
+
+class StorageBackend(ABC):
+    """
+    Interface the backup engine uses to write to and rotate backups in a 'Destination'.
+    Keys are '/' separated paths relative to the destination. A slot is one rotation of a backup, a folder of files
+    ('<folder>_<n>') or a single zip ('<profile>_<n>.zip'). A slot is written under the key returned by 'stage' and only
+    becomes visible to 'list_slots' once 'commit' is called, so a half written backup is never counted as a copy.
+    """
+    name = ""
+    # False if written files can't be seeked, zips are then written with data descriptors instead.
+    seekable = True
+
+    @abstractmethod
+    def is_available(self):
+        pass
+
+    @abstractmethod
+    def get_url(self, key):
+        """Returns where 'key' can be found, shown to the user."""
+
+    @abstractmethod
+    def free_space(self):
+        """Returns the free bytes in the destination, None if it's unlimited."""
+
+    @abstractmethod
+    def open_write(self, key):
+        """Returns a writable binary file object, the file is stored under 'key' when it's closed."""
+
+    def put(self, key, src_path):
+        with open(src_path, 'rb') as src, self.open_write(key) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    @abstractmethod
+    def get(self, key, dst_path):
+        """Downloads/copies the file 'key' to the local 'dst_path'."""
+
+    @abstractmethod
+    def list(self, prefix=""):
+        """Returns every file under 'prefix' as a list of (key, size)."""
+
+    @abstractmethod
+    def delete(self, slot):
+        """Deletes a committed slot and everything in it."""
+
+    def makedirs(self, key):
+        pass
+
+    def copy_stat(self, src_path, key):
+        """Copies the times/permissions of a local file onto 'key' if the backend can keep them."""
+        pass
+
+    def flush(self):
+        """Waits for any writes still in flight and raises the first error of them."""
+        pass
+
+    def stage(self, slot):
+        """Prepares 'slot' to be written and returns the key it is written under."""
+        return slot
+
+    @abstractmethod
+    def commit(self, slot):
+        """Makes the written 'slot' visible as a finished backup."""
+
+    def discard(self, slot):
+        """Drops whatever was written of a staged 'slot' that won't be committed."""
+        pass
+
+    def get_trash_size(self):
+        """Bytes of pruned slots waiting to be deleted, still taking up space in the destination."""
+        return 0
+
+    def purge_trash(self):
+        """Deletes the pruned slots waiting in the trash right away, when a backup needs the space."""
+        pass
+
+    @abstractmethod
+    def list_slots(self):
+        """Returns every committed slot as a dict of {slot name: age}, a smaller age is older."""
+
+    def get_size(self, slot):
+        return sum(size for key, size in self.list(slot))
+
+    def get_copies(self, source_path):
+        """Returns the committed slots of 'source_path' (a folder or the profile name) as {slot name: age}."""
+        source_name = os.path.splitext(get_folder_name(source_path))[0]
+        copies = {}
+        for slot, age in self.list_slots().items():
+            name = os.path.splitext(slot)[0]
+            # Strip last 2 characters off end of name, so it'll match with source_name 'folder_0' to 'folder'
+            if name[:len(name) - 2] == source_name:
+                copies[slot] = age
+        return copies
+
+    def find_copies(self, source_path):
+        """Returns the number of copies of the 'source_path' folder in the destination."""
+        return len(self.get_copies(source_path))
+
+    def find_oldest(self, source_path):
+        """Returns the name of the oldest slot of 'source_path' in the destination."""
+        copies = self.get_copies(source_path)
+        return min(copies, key=copies.get)
+
+
+class LocalStorage(StorageBackend):
+    """A folder on a local or mapped drive. Pruned slots are moved to the trash and deleted by the TrashReaper."""
+
+    def __init__(self, root, reaper=None):
+        self.root = root
+        self.name = root
+        self.reaper = reaper
+
+    def get_path(self, key):
+        if not key:
+            return self.root
+        return os.path.join(self.root, *key.split("/"))
+
+    def is_available(self):
+        return os.path.isdir(self.root)
+
+    def get_url(self, key):
+        return self.get_path(key)
+
+    def free_space(self):
+        return shutil.disk_usage(self.root).free
+
+    def open_write(self, key):
+        return open_destination(self.get_path(key))
+
+    def get(self, key, dst_path):
+        shutil.copy2(self.get_path(key), dst_path)
+
+    def list(self, prefix=""):
+        path = self.get_path(prefix)
+        if os.path.isfile(path):
+            return [(prefix, os.path.getsize(path))]
+        prefix = prefix.strip("/")
+        return [(f"{prefix}/{i.relative_path}" if prefix else i.relative_path, i.stat.st_size)
+                for i in scan_files(path)]
+
+    def delete(self, slot):
+        path = self.get_path(slot)
+        if self.reaper is not None:
+            self.reaper.discard(self.root, path)
+        elif os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def makedirs(self, key):
+        os.makedirs(self.get_path(key), exist_ok=True)
+
+    def copy_stat(self, src_path, key):
+        shutil.copystat(src_path, self.get_path(key))
+
+    def stage(self, slot):
+        """Slots are written into the staging folder and renamed into place on commit."""
+        staging_path = os.path.join(self.root, STAGING_FOLDER)
+        os.makedirs(staging_path, exist_ok=True)
+        return f"{STAGING_FOLDER}/{slot}"
+
+    def commit(self, slot):
+        """Renames the staged slot into place, a slot already there under the same name is moved to the trash first.
+        (Left by a rotation that didn't prune it, renaming onto it would fail)"""
+        if os.path.lexists(self.get_path(slot)):
+            self.delete(slot)
+        os.rename(self.get_path(f"{STAGING_FOLDER}/{slot}"), self.get_path(slot))
+
+    def discard(self, slot):
+        if os.path.lexists(self.get_path(f"{STAGING_FOLDER}/{slot}")):
+            self.delete(f"{STAGING_FOLDER}/{slot}")
+
+    def get_trash_size(self):
+        trash_path = os.path.join(self.root, TRASH_FOLDER)
+        if not os.path.isdir(trash_path):
+            return 0
+        return sum(i.stat.st_size for i in scan_files(trash_path))
+
+    def purge_trash(self):
+        if self.reaper is not None:
+            self.reaper.purge(self.root)
+        else:
+            shutil.rmtree(os.path.join(self.root, TRASH_FOLDER), ignore_errors=True)
+
+    def recover(self):
+        """Moves slots left half written in the staging folder by a crash or a stopped backup to the trash."""
+        staging_path = os.path.join(self.root, STAGING_FOLDER)
+        if not os.path.isdir(staging_path):
+            return
+        for name in os.listdir(staging_path):
+            self.delete(f"{STAGING_FOLDER}/{name}")
+
+    def list_slots(self):
+        slots = {}
+        for name in os.listdir(self.root):
+            if name in RESERVED_FOLDERS:
+                continue
+            path = os.path.join(self.root, name)
+            if os.path.splitext(name)[1] == ".zip":
+                # For reasons unknown to me, zip files have to be done with last modifications and not birth time.
+                slots[name] = get_last_modification(path)
+            else:
+                slots[name] = get_birth_time(path)
+        return slots
+
+    def get_size(self, slot):
+        path = self.get_path(slot)
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return super().get_size(slot)
+
+
+class _S3Writer:
+    """
+    Writable file object that uploads to S3. Small files are sent with one put, anything over 'part_size' is sent as a
+    multipart upload with the parts uploaded in parallel on the backend's pool. Nothing is buffered beyond the parts
+    waiting for a free connection.
+    """
+
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.key = key
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.storage.part_size:
+            part = bytes(self.buffer[:self.storage.part_size])
+            del self.buffer[:self.storage.part_size]
+            self.upload_part(part)
+        return len(data)
+
+    def upload_part(self, data):
+        if self.upload_id is None:
+            response = self.storage.client.create_multipart_upload(Bucket=self.storage.bucket, Key=self.key)
+            self.upload_id = response["UploadId"]
+        part_number = len(self.parts) + 1
+        self.parts.append(self.storage.submit(self.storage.client.upload_part, Bucket=self.storage.bucket,
+                                              Key=self.key, UploadId=self.upload_id, PartNumber=part_number,
+                                              Body=data))
+
+    def flush(self):
+        # Parts are only sent once they're full, there's nothing to flush early.
+        pass
+
+    def abort(self):
+        """Drops the upload, used when writing failed part way so a broken object is never stored."""
+        if self.closed:
+            return
+        self.closed = True
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            for part in self.parts:
+                part.exception()
+            self.storage.client.abort_multipart_upload(Bucket=self.storage.bucket, Key=self.key,
+                                                       UploadId=self.upload_id)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.upload_id is None:
+            self.storage.submit(self.storage.client.put_object, Bucket=self.storage.bucket, Key=self.key,
+                                Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self.upload_part(bytes(self.buffer))
+        self.buffer = bytearray()
+        try:
+            etags = [{"ETag": part.result()["ETag"], "PartNumber": number}
+                     for number, part in enumerate(self.parts, start=1)]
+            self.storage.client.complete_multipart_upload(Bucket=self.storage.bucket, Key=self.key,
+                                                          UploadId=self.upload_id, MultipartUpload={"Parts": etags})
+        except Exception:
+            self.storage.client.abort_multipart_upload(Bucket=self.storage.bucket, Key=self.key,
+                                                       UploadId=self.upload_id)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class S3Storage(StorageBackend):
+    """
+    An S3 compatible object store, the 'Destination' is written as 's3://bucket/prefix'.
+    Credentials come from the usual boto3 places (environment, '~/.aws/credentials'), 's3_endpoint_url' in the
+    'config.ini' points it at any other S3 compatible server (MinIO, a local test server, ...).
+    All requests share one pool of 's3_max_connections' connections, failed requests are retried by botocore.
+    """
+    seekable = False
+
+    def __init__(self, destination, settings):
+        if boto3 is None:
+            raise RuntimeError("boto3 has to be installed to backup to an 's3://' destination.")
+        self.name = destination
+        bucket_path = destination[len("s3://"):]
+        self.bucket, _, self.prefix = bucket_path.partition("/")
+        self.prefix = self.prefix.strip("/")
+
+        max_connections = int(settings.get("max_connections", 10))
+        # S3 needs every part but the last to be at least 5 MB.
+        self.part_size = max(int(settings.get("part_size", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+        self.max_retries = int(settings.get("max_retries", 5))
+        config = BotoConfig(max_pool_connections=max_connections,
+                            retries={"max_attempts": self.max_retries, "mode": "standard"})
+        self.client = boto3.client("s3", endpoint_url=settings.get("endpoint_url") or None, config=config)
+
+        self.pool = ThreadPoolExecutor(max_workers=max_connections)
+        # Bounds the requests (and the part buffers they hold) waiting on the pool.
+        self.in_flight = threading.BoundedSemaphore(max_connections * 2)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def get_key(self, key):
+        if not self.prefix:
+            return key
+        if not key:
+            return self.prefix
+        return f"{self.prefix}/{key}"
+
+    def submit(self, method, **kwargs):
+        """Runs a request on the connection pool, waits if too many are in flight already."""
+        self.in_flight.acquire()
+        try:
+            future = self.pool.submit(method, **kwargs)
+        except Exception:
+            self.in_flight.release()
+            raise
+        future.add_done_callback(lambda i: self.in_flight.release())
+        with self.lock:
+            self.pending.append(future)
+        return future
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        error = None
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def get_url(self, key):
+        return f"s3://{self.bucket}/{self.get_key(key)}"
+
+    def is_available(self):
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+            return True
+        except Exception:
+            return False
+
+    def free_space(self):
+        return None
+
+    def open_write(self, key):
+        return _S3Writer(self, self.get_key(key))
+
+    def get(self, key, dst_path):
+        self.client.download_file(self.bucket, self.get_key(key), dst_path)
+
+    def list(self, prefix=""):
+        if os.path.splitext(prefix)[1] == ".zip":
+            try:
+                response = self.client.head_object(Bucket=self.bucket, Key=self.get_key(prefix))
+                return [(prefix, response["ContentLength"])]
+            except self.client.exceptions.ClientError:
+                return []
+        # Only whole path parts, 'folder_1' mustn't match 'folder_10/...'
+        full_prefix = f"{self.get_key(prefix)}/" if self.get_key(prefix) else ""
+        root = f"{self.prefix}/" if self.prefix else ""
+        files = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full_prefix):
+            for item in page.get("Contents", []):
+                files.append((item["Key"][len(root):], item["Size"]))
+        return files
+
+    def delete(self, slot):
+        # The marker goes first so the slot stops counting as a copy even if deleting the rest is interrupted.
+        # The rest has to be gone before returning, the next backup reuses the same keys for the new slot.
+        keys = [key for key, size in self.list(slot)]
+        marker = f"{slot}/{COMMIT_MARKER}"
+        if marker in keys:
+            keys.remove(marker)
+            self.client.delete_object(Bucket=self.bucket, Key=self.get_key(marker))
+        batches = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+        for future in [self.pool.submit(self.delete_keys, i) for i in batches]:
+            future.result()
+
+    def delete_keys(self, keys):
+        objects = [{"Key": self.get_key(key)} for key in keys]
+        self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+    def discard(self, slot):
+        # Without its marker a folder slot never counts as a copy, the objects written are only taking up space.
+        try:
+            self.flush()
+        except Exception:
+            # The error that failed the slot, it's been reported already.
+            pass
+        self.delete(slot)
+
+    def commit(self, slot):
+        """Objects are atomic by themselves, a folder slot is committed by writing its marker object last."""
+        self.flush()
+        if os.path.splitext(slot)[1] != ".zip":
+            self.client.put_object(Bucket=self.bucket, Key=self.get_key(f"{slot}/{COMMIT_MARKER}"), Body=b"")
+
+    def list_slots(self):
+        slots = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        prefix = f"{self.prefix}/" if self.prefix else ""
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+            for item in page.get("Contents", []):
+                name = item["Key"][len(prefix):]
+                if os.path.splitext(name)[1] == ".zip":
+                    slots[name] = item["LastModified"].timestamp()
+            for common_prefix in page.get("CommonPrefixes", []):
+                name = common_prefix["Prefix"][len(prefix):].rstrip("/")
+                try:
+                    marker = self.client.head_object(Bucket=self.bucket, Key=f"{prefix}{name}/{COMMIT_MARKER}")
+                except self.client.exceptions.ClientError:
+                    continue
+                slots[name] = marker["LastModified"].timestamp()
+        return slots
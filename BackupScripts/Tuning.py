@@ -0,0 +1,234 @@
+import os
+import time
+import zlib
+
+from .Progress import format_bytes
+from .Scanner import scan_files
+from .Utils import *
+
+# Sizes files of copied backups are read and written in, the tuner moves between neighbouring ones.
+CHUNK_SIZES = [64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+# Chunk sizes and compression levels tried by the calibration of a new destination.
+CALIBRATION_CHUNK_SIZES = [256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+CALIBRATION_LEVELS = [1, 3, 6, 9]
+# Settings used while tuning is turned off, and for a destination until it's calibrated.
+DEFAULT_SETTINGS = {"workers": 4, "chunk_size": 1024 * 1024, "level": 9}
+# Bytes of the source files compressed to calibrate the compression levels.
+_SAMPLE_SIZE = 8 * 1024 * 1024
+
+
+def measure_write(storage, chunk_size, size):
+    """Bytes per second 'storage' takes 'size' bytes written in 'chunk_size' writes, down to the disk on a local
+    destination. The file is deleted afterwards."""
+    # Named like a zip so every backend can delete it as one file, it never matches a profile's slots.
+    key = storage.stage(".calibration.zip")
+    data = os.urandom(chunk_size)
+    start = time.perf_counter()
+    try:
+        with storage.open_write(key) as file:
+            for _ in range(max(size // chunk_size, 1)):
+                file.write(data)
+            if hasattr(file, "fileno"):
+                file.flush()
+                os.fsync(file.fileno())
+        storage.flush()
+        return max(size // chunk_size, 1) * chunk_size / (time.perf_counter() - start)
+    finally:
+        storage.delete(key)
+
+
+def read_sample(folders, size=_SAMPLE_SIZE, per_file=256 * 1024):
+    """Up to 'size' bytes of the files in 'folders', the start of many files instead of all of one."""
+    chunks = []
+    left = size
+    for folder in folders:
+        for entry in scan_files(folder):
+            try:
+                with open(entry.path, 'rb') as file:
+                    data = file.read(min(per_file, left))
+            except OSError:
+                continue
+            chunks.append(data)
+            left -= len(data)
+            if left <= 0:
+                return b"".join(chunks)
+    return b"".join(chunks)
+
+
+def measure_compression(sample, levels=CALIBRATION_LEVELS):
+    """Deflates 'sample' at every level on one thread.
+    :returns: dict: {level: (bytes compressed per second, compressed size / size)}"""
+    results = {}
+    for level in levels:
+        start = time.perf_counter()
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        size = len(compressor.compress(sample)) + len(compressor.flush())
+        results[level] = (len(sample) / max(time.perf_counter() - start, 1e-6), size / len(sample))
+    return results
+
+
+def choose_level(compression, write_speed):
+    """The compression level a zip is written fastest with, when the source is compressed at a level's speed and
+    written at 'write_speed' after it shrunk by its ratio. A higher level wins a tie, the backup is smaller."""
+    def estimate(level):
+        speed, ratio = compression[level]
+        return min(speed, write_speed / max(ratio, 0.01))
+
+    best = max(estimate(i) for i in compression)
+    return max(i for i in compression if estimate(i) >= best * 0.95)
+
+
+def format_tuning(settings):
+    return (f"{settings['workers']} workers, {settings['chunk_size'] // 1024} KB chunks, "
+            f"compression level {settings['level']}")
+
+
+class ThroughputTuner:
+    """
+    Learns the fastest settings of every 'Destination' and keeps them in the 'tuning.json' file:
+    'workers' (threads encrypting, compressing volumes and scanning the folders), 'chunk_size' (reads and writes of
+    copied backups) and the compression 'level' of zips.
+    The first backup to a destination calibrates it: writes in a few chunk sizes are timed on it and a sample of the
+    source is compressed at a few levels, the fastest chunk size and the level that keeps up with the destination are
+    its first settings. After that every other backup is a trial of one setting moved one step (a worker more or
+    less, the next chunk size, the next level), a trial that beats the best settings by 5% replaces them. Once every
+    step around the best settings has been tried they're only tried again every 'recheck_every' backups, in case the
+    destination changed. Throughput counts source bytes per second, scaled down for backups that used more than
+    'cpu_budget' percent of the CPUs, and workers never go past the budget.
+    """
+    # A trial has to beat the best settings by this much to replace them, backups vary that much on their own.
+    _min_gain = 1.05
+    recheck_every = 10
+
+    def __init__(self, enabled=True, cpu_budget=50, calibration_mb=16, max_workers=4):
+        self.enabled = enabled
+        self.cpu_budget = max(min(cpu_budget, 100), 1) / 100
+        self.calibration_bytes = calibration_mb * 1024 * 1024
+        cpus = os.cpu_count() or 1
+        self.worker_limit = max(int(cpus * self.cpu_budget), 1)
+        self.start_workers = max(min(max_workers, self.worker_limit), 1)
+        self.tunings = self.load()
+
+    @staticmethod
+    def load():
+        try:
+            return read_config(TUNING_FILE)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        try:
+            dump_json(TUNING_FILE, self.tunings)
+        except OSError as e:
+            log(f"ERROR: Tuning could not be saved: {e}")
+
+    def calibrate(self, destination, storage, folders):
+        """Times the destination and the source and makes the first settings of the destination from them."""
+        write_speeds = {}
+        for chunk_size in CALIBRATION_CHUNK_SIZES:
+            write_speeds[chunk_size] = measure_write(storage, chunk_size, self.calibration_bytes)
+        chunk_size = max(write_speeds, key=write_speeds.get)
+        level = DEFAULT_SETTINGS["level"]
+        compression = {}
+        sample = read_sample(folders)
+        if sample:
+            compression = measure_compression(sample)
+            level = choose_level(compression, write_speeds[chunk_size])
+        self.tunings[destination] = {
+            "calibration": {"write_speed": {str(k): v for k, v in write_speeds.items()},
+                            "compression": {str(k): list(v) for k, v in compression.items()}},
+            "best": {"workers": self.start_workers, "chunk_size": chunk_size, "level": level},
+            "best_score": None, "trial": None, "untried": None, "runs": 0
+        }
+        log(f"INFO: Calibrated {destination}: {format_bytes(write_speeds[chunk_size])}/s, "
+            f"{format_tuning(self.tunings[destination]['best'])}")
+        self.save()
+
+    def get_settings(self, storages, folders, compressed):
+        """
+        The settings of the next backup to 'storages' ({destination: backend}), calibrating the destinations that are
+        new first. A backup is written to all of them at once at the speed of the slowest, so that one's settings are
+        used (a trial of them every other backup).
+        :returns: dict: {"workers": int, "chunk_size": int, "level": int, "destination": str or None, "trial": bool}
+        """
+        if not self.enabled or not storages:
+            return dict(DEFAULT_SETTINGS, workers=self.start_workers, destination=None, trial=False)
+        for destination, storage in storages.items():
+            if destination not in self.tunings:
+                try:
+                    self.calibrate(destination, storage, folders)
+                except Exception as e:
+                    log(f"ERROR: {destination} could not be calibrated: {e}")
+                    return dict(DEFAULT_SETTINGS, workers=self.start_workers, destination=None, trial=False)
+        destination = min(storages, key=self.get_speed)
+        tuning = self.tunings[destination]
+        if tuning["trial"] is None and tuning["best_score"] is not None:
+            tuning["trial"] = self.next_trial(tuning, compressed)
+        if tuning["trial"] is not None:
+            return dict(tuning["trial"], destination=destination, trial=True)
+        return dict(tuning["best"], destination=destination, trial=False)
+
+    def get_speed(self, destination):
+        """How fast the destination was, its best score or what the calibration measured."""
+        tuning = self.tunings[destination]
+        if tuning["best_score"] is not None:
+            return tuning["best_score"]
+        return max(tuning["calibration"]["write_speed"].values(), default=0)
+
+    def next_trial(self, tuning, compressed):
+        """The next untried step from the best settings, None when the best settings aren't due a trial."""
+        # None until the steps around the best settings are listed, empty once they've all been tried.
+        if tuning["untried"] is None or (not tuning["untried"] and tuning["runs"] % self.recheck_every == 0):
+            tuning["untried"] = self.get_steps(tuning["best"], compressed)
+        # Every other backup, the ones in between measure the best settings again.
+        if tuning["runs"] % 2 or not tuning["untried"]:
+            return None
+        return tuning["untried"].pop(0)
+
+    def get_steps(self, settings, compressed):
+        steps = []
+        for workers in [settings["workers"] + 1, settings["workers"] - 1]:
+            if 1 <= workers <= self.worker_limit:
+                steps.append(dict(settings, workers=workers))
+        if compressed:
+            for level in [settings["level"] - 1, settings["level"] + 1]:
+                if 1 <= level <= 9:
+                    steps.append(dict(settings, level=level))
+        # Zips are written as zipfile hands them over, the chunk size only matters to copied backups.
+        elif settings["chunk_size"] in CHUNK_SIZES:
+            index = CHUNK_SIZES.index(settings["chunk_size"])
+            for i in [index + 1, index - 1]:
+                if 0 <= i < len(CHUNK_SIZES):
+                    steps.append(dict(settings, chunk_size=CHUNK_SIZES[i]))
+        return steps
+
+    def record(self, settings, bytes_read, seconds, cpu_seconds):
+        """Scores a finished backup run with 'settings' (from 'get_settings') and keeps the better settings.
+        :returns: float: the score, bytes per second"""
+        destination = settings.get("destination")
+        if not self.enabled or destination not in self.tunings or seconds <= 0 or not bytes_read:
+            return None
+        tuning = self.tunings[destination]
+        score = bytes_read / seconds
+        cpu_used = cpu_seconds / seconds / (os.cpu_count() or 1)
+        if cpu_used > self.cpu_budget:
+            score *= self.cpu_budget / cpu_used
+        used = {key: settings[key] for key in DEFAULT_SETTINGS}
+        if settings.get("trial"):
+            if tuning["best_score"] is None or score > tuning["best_score"] * self._min_gain:
+                log(f"INFO: Tuning of {destination} changed to {format_tuning(used)} "
+                    f"({format_bytes(score)}/s)")
+                tuning["best"] = used
+                tuning["best_score"] = score
+                # Steps are taken from the new best settings.
+                tuning["untried"] = None
+            tuning["trial"] = None
+        elif tuning["best_score"] is None:
+            tuning["best_score"] = score
+        else:
+            # Follows the destination as it gets faster or slower, without one odd backup throwing it off.
+            tuning["best_score"] = tuning["best_score"] * 0.7 + score * 0.3
+        tuning["runs"] += 1
+        self.save()
+        return score
+
@@ -1,136 +1,250 @@
-import datetime
-import json
-import os
-import platform
-import sys
-import zipfile
-
-
-def resource_path(relative_path):
-    """This method is mainly used for pyinstaller to get the paths to the images when building an exe file."""
-    try:
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.getcwd()
-    return os.path.join(base_path, relative_path)
-
-
-ICON_IMG = resource_path("backup.ico")
-PROFILE_PATH = os.getcwd() + "\\profiles.json"
-LOG_FILE = os.getcwd() + "\\log.csv"
-CONFIG_FILE = os.getcwd() + "\\config.ini"
-
-
-def zipdir(path, ziph):
-    # ziph is zipfile handle
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            ziph.write(os.path.join(root, file),
-                       os.path.relpath(os.path.join(root, file), os.path.join(path, '..')))
-
-
-def compress_folder(destination_path, folders):
-    with zipfile.ZipFile(f'{destination_path}.zip', 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
-        for i in folders:
-            zipdir(i, zipf)
-
-
-def check_folders(sources, dest):
-    """Check if dest is in the source path."""
-    dest = dest.split("/")[-1]
-    for source in sources:
-        for dir_path, dirs, files in os.walk(source):
-            for i in dirs:
-                if dest == i:
-                    return True
-    return False
-
-
-def get_birth_time(filename):
-    """Return the birth time of a file, reported by os.stat()."""
-    return os.stat(filename).st_birthtime
-
-
-def get_last_modification(filename):
-    return os.stat(filename).st_mtime
-
-
-def find_copies(backup_path, source_path):
-    """Returns the number of copies of the 'source_path' folder in the 'backup_path' folder."""
-    count = 0
-    source_name = get_folder_name(source_path)
-    source_name = os.path.splitext(source_name)[0]
-    for path in os.listdir(backup_path):
-        cur_folder = os.path.join(backup_path, path)
-        if os.path.exists(cur_folder):
-            name = get_folder_name(cur_folder)
-            name = os.path.splitext(name)[0]
-            name = name[:len(name) - 2]
-            if source_name == name:
-                count += 1
-    return count
-
-
-def get_folder_name(path):
-    return os.path.basename(os.path.normpath(path))
-
-
-def find_oldest_folder(backup_path, source_path):
-    """Finds the oldest folder within the given 'backup_path', finding the name of the 'source_path'."""
-    ages = {}
-    source_name = get_folder_name(source_path)
-    source_name = os.path.splitext(source_name)[0]
-    for path in os.listdir(backup_path):
-        cur_folder = os.path.join(backup_path, path)
-        if os.path.exists(cur_folder):
-            name = get_folder_name(cur_folder)
-            tmp_name = os.path.splitext(name)
-            name = tmp_name[0]
-            # Strip last 2 characters off end of name, so it'll match with source_name 'folder_0' to 'folder'
-            name = name[:len(name) - 2]
-            if source_name == name:
-                if tmp_name[1] == ".zip":
-                    # For reasons unknown to me, zip files have to be done with last modifications and not birth time.
-                    ages.update({get_last_modification(cur_folder): cur_folder})
-                else:
-                    ages.update({get_birth_time(cur_folder): cur_folder})
-    oldest = min(ages)
-    return ages[oldest]
-
-
-def log(string):
-    """Logs event into the 'log.csv' file."""
-    date = str(datetime.datetime.now())[:-7]
-    result = f"{date} - {string}\n"
-    with open(LOG_FILE, 'a') as file:
-        file.write(result)
-
-
-def read_config(filepath: str):
-    with open(filepath, 'r') as file:
-        return json.load(file)
-
-
-def dump_json(filepath: str, data: dict | str) -> None:
-    with open(filepath, 'w') as file:
-        json.dump(data, file, indent=4)
-        file.truncate()
-
-
-def open_config():
-    if platform.system() == "Windows":
-        try:
-            os.startfile(PROFILE_PATH)
-        except FileNotFoundError:
-            dump_json(PROFILE_PATH, {})
-            open_config()
-
-
-def update_json(new_config, saved_config):
-    cur_config_key = [i for i in new_config.keys()][0]
-    saved_config_keys = [i for i in saved_config.keys()]
-    if cur_config_key in saved_config_keys:
-        saved_config[cur_config_key] = new_config[cur_config_key]
-    else:
-        saved_config.update({cur_config_key: new_config[cur_config_key]})
-    return saved_config
+import datetime
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import zipfile
+
+from .FanOut import FanOut
+from .PageCache import get_cache_mode, open_source
+from .Scanner import scan, scan_files
+from .Sparse import is_sparse, iter_regions, iter_zeros, update_sparse_hash
+
+
+def resource_path(relative_path):
+    """This method is mainly used for pyinstaller to get the paths to the images when building an exe file."""
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.getcwd()
+    return os.path.join(base_path, relative_path)
+
+
+ICON_IMG = resource_path("backup.ico")
+PROFILE_PATH = os.getcwd() + "\\profiles.json"
+LOG_FILE = os.getcwd() + "\\log.csv"
+CONFIG_FILE = os.getcwd() + "\\config.ini"
+STATS_FILE = os.getcwd() + "\\stats.json"
+# Settings learned for every destination, see 'Tuning.py'.
+TUNING_FILE = os.getcwd() + "\\tuning.json"
+# Folder the encryption keys of profiles are saved in, see 'Encryption.py'.
+KEY_FOLDER = os.getcwd() + "\\keys"
+# SQLite catalog of every file in the retained backups, see 'Catalog.py'.
+CATALOG_DB = os.getcwd() + "\\catalog.db"
+# Folder the change journals of the folders backed up are kept in, see 'Journal.py'.
+JOURNAL_FOLDER = os.getcwd() + "\\journals"
+# Folder the reports of profiled backup cycles are written into, see 'Profiler.py'.
+PROFILING_FOLDER = os.getcwd() + "\\profiling"
+# Folder created within a 'Destination' that pruned rotation slots are moved into before being deleted.
+TRASH_FOLDER = ".trash"
+# Folder within a 'Destination' that slots are written into before being committed.
+STAGING_FOLDER = ".staging"
+# Folders within a 'Destination' that are used by the program and are never treated as backups.
+RESERVED_FOLDERS = {TRASH_FOLDER, STAGING_FOLDER}
+
+
+def iter_zip_files(path, workers=4, totals=None):
+    """Yields every file under the folder 'path' as (file path, name in the zip, stat) from one scan of it, counted
+    into the ScanTotals 'totals' if given."""
+    folder_name = os.path.basename(os.path.normpath(path))
+    for entry in scan_files(path, workers):
+        if totals is not None:
+            totals.add(entry.stat)
+        yield entry.path, f"{folder_name}/{entry.relative_path}" if folder_name else entry.relative_path, entry.stat
+
+
+def list_zip_files(path, workers=4):
+    """Returns every file under the folder 'path' as a list of (file path, name in the zip, stat)."""
+    return list(iter_zip_files(path, workers))
+
+
+def get_zip_info(arc_name, stat):
+    """Same as 'zipfile.ZipInfo.from_file' for a file the scanner already stat'ed."""
+    arc_name = os.path.normpath(os.path.splitdrive(arc_name)[1]).lstrip(os.sep + (os.altsep or ""))
+    zinfo = zipfile.ZipInfo(arc_name, time.localtime(stat.st_mtime)[0:6])
+    zinfo.external_attr = (stat.st_mode & 0xFFFF) << 16
+    zinfo.file_size = stat.st_size
+    return zinfo
+
+
+def zipdir(path, ziph, progress=None):
+    # ziph is zipfile handle
+    zip_files(list_zip_files(path), ziph, progress)
+
+
+def zip_files(files, ziph, progress=None, record=None):
+    """Writes 'files', (file path, name in the zip, stat) as given by 'iter_zip_files', into the zipfile handle 'ziph'.
+    Every file is added to the catalog's SlotRecord 'record' if given."""
+    for file_path, arc_name, stat in files:
+        if progress is None and record is None and not is_sparse(stat) and get_cache_mode() == "keep":
+            ziph.write(file_path, arc_name)
+            continue
+        # Same as 'ZipFile.write' but streamed in chunks, so progress is reported while big files are compressed.
+        if progress is not None:
+            progress.start_file(file_path)
+        zinfo = get_zip_info(arc_name, stat)
+        zinfo.compress_type = ziph.compression
+        zinfo._compresslevel = ziph.compresslevel
+        digest = record.new_hash() if record is not None else None
+        with open_source(file_path) as src, ziph.open(zinfo, 'w') as dest:
+            if is_sparse(stat):
+                # A zip has no holes, but they're made from a zero buffer instead of being read from the disk.
+                for offset, length, data in iter_regions(src, stat.st_size):
+                    if data is None:
+                        for zeros in iter_zeros(length):
+                            dest.write(zeros)
+                    else:
+                        dest.write(data)
+                        if digest is not None:
+                            update_sparse_hash(digest, offset, data)
+                    if progress is not None:
+                        progress.add_bytes(length, paced=data is not None)
+            else:
+                while True:
+                    data = src.read(1024 * 1024)
+                    if not data:
+                        break
+                    dest.write(data)
+                    if digest is not None:
+                        digest.update(data)
+                    if progress is not None:
+                        progress.add_bytes(len(data))
+        if record is not None:
+            # The name zipfile gave it, with '/' on every platform.
+            record.add(zinfo.filename, stat.st_size, stat.st_mtime, digest.hexdigest())
+        if progress is not None:
+            progress.finish_file()
+
+
+def compress_folder(targets, folders, progress=None, encryptor=None, record=None, level=9, workers=4, totals=None):
+    """Compresses 'folders' into one zip written to every target, a list of (name, storage backend, zip key).
+    The zip is only built once and written to all of them at the same time, encrypted first if given an 'encryptor'.
+    Files are compressed (at 'level') as they're found, the folders are scanned on 'workers' threads and never listed
+    in full, every file is counted into the ScanTotals 'totals' if given.
+    :returns: dict: {name: exception} of the destinations that failed"""
+    files = (i for folder in folders for i in iter_zip_files(folder, workers, totals))
+    return compress_files(targets, files, progress, encryptor, record, level)
+
+
+def compress_files(targets, files, progress=None, encryptor=None, record=None, level=9):
+    """Same as 'compress_folder' for (file path, name in the zip, stat) instead of whole folders."""
+    fan_out = FanOut(targets)
+    fan_out.open("")
+    # The encrypted stream can't be seeked, zipfile writes data descriptors after each file instead.
+    output = encryptor.wrap(fan_out) if encryptor is not None else fan_out
+    try:
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zipf:
+            zip_files(files, zipf, progress, record)
+        if encryptor is not None:
+            output.finish()
+        fan_out.close_file()
+    except BaseException:
+        # Lets the destinations finish with what they were given, the caller discards the half written zip.
+        fan_out.close()
+        raise
+    return fan_out.close()
+
+
+def get_destinations(config):
+    """Returns the 'Destination' of a profile as a list, it can be saved as one path or a list of paths."""
+    destinations = config["Destination"]
+    if isinstance(destinations, str):
+        return [destinations] if destinations else []
+    return list(destinations)
+
+
+def expand_folder_patterns(patterns):
+    """Returns the existing folders matching a list of paths and/or glob patterns, in order without duplicates.
+    Blank lines and lines starting with '#' are skipped."""
+    folders = []
+    for pattern in patterns:
+        pattern = pattern.strip().strip('"')
+        if not pattern or pattern.startswith("#"):
+            continue
+        for path in sorted(glob.glob(pattern)):
+            if os.path.isdir(path):
+                folders.append(os.path.normpath(path).replace(os.sep, "/"))
+    return list(dict.fromkeys(folders))
+
+
+def check_folders(sources, dest):
+    """Check if dest is in the source path."""
+    dest = dest.split("/")[-1]
+    for source in sources:
+        for entry in scan(source):
+            if entry.is_dir and os.path.basename(entry.path) == dest:
+                return True
+    return False
+
+
+def get_birth_time(filename):
+    """Return the birth time of a file, reported by os.stat(). Falls back on the change time where the system doesn't
+    report a birth time (Linux), for a committed slot that's when it was renamed into place."""
+    stat = os.stat(filename)
+    return getattr(stat, "st_birthtime", stat.st_ctime)
+
+
+def get_last_modification(filename):
+    return os.stat(filename).st_mtime
+
+
+def get_folder_name(path):
+    return os.path.basename(os.path.normpath(path))
+
+
+def get_slot_digit(slot):
+    """The rotation digit a slot's name ends in ('folder_3', 'profile_3.zip'), None if it doesn't end in one."""
+    digit = os.path.splitext(slot)[0][-1:]
+    return int(digit) if digit.isdigit() else None
+
+
+def move_to_trash(backup_path, path):
+    """Moves 'path' into the trash folder of 'backup_path'. A rename on the same drive is instant no matter how many
+    files the folder holds, the actual deleting is left to the TrashReaper.
+    :returns: str: the new path within the trash folder"""
+    trash_path = os.path.join(backup_path, TRASH_FOLDER)
+    os.makedirs(trash_path, exist_ok=True)
+    # Timestamp is added so the same slot can be pruned again before the previous one has been deleted.
+    new_path = os.path.join(trash_path, f"{get_folder_name(path)}.{time.time_ns()}")
+    os.rename(path, new_path)
+    return new_path
+
+
+def log(string):
+    """Logs event into the 'log.csv' file."""
+    date = str(datetime.datetime.now())[:-7]
+    result = f"{date} - {string}\n"
+    with open(LOG_FILE, 'a') as file:
+        file.write(result)
+
+
+def read_config(filepath: str):
+    with open(filepath, 'r') as file:
+        return json.load(file)
+
+
+def dump_json(filepath: str, data: dict | str) -> None:
+    with open(filepath, 'w') as file:
+        json.dump(data, file, indent=4)
+        file.truncate()
+
+
+def open_config():
+    if platform.system() == "Windows":
+        try:
+            os.startfile(PROFILE_PATH)
+        except FileNotFoundError:
+            dump_json(PROFILE_PATH, {})
+            open_config()
+
+
+def update_json(new_config, saved_config):
+    cur_config_key = [i for i in new_config.keys()][0]
+    saved_config_keys = [i for i in saved_config.keys()]
+    if cur_config_key in saved_config_keys:
+        saved_config[cur_config_key] = new_config[cur_config_key]
+    else:
+        saved_config.update({cur_config_key: new_config[cur_config_key]})
+    return saved_config
@@ -0,0 +1,206 @@
+import contextlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .Encryption import MAGIC
+from .FanOut import FanOut
+from .Storage import LocalStorage
+from .Utils import *
+
+# File within a volume slot that lists every volume and the files in it.
+CATALOG_FILE = "catalog.json"
+
+
+class Volume:
+    """One zip of a split backup and the files that go into it."""
+
+    def __init__(self, name, folder):
+        self.name = name
+        self.folder = folder
+        self.files = []
+        self.bytes = 0
+
+    def to_dict(self):
+        # Named the way zipfile lists them, with '/' on every platform.
+        files = [arc_name.replace(os.sep, "/") for path, arc_name, stat in self.files]
+        return {"folder": self.folder, "bytes": self.bytes, "files": files}
+
+
+def split_volumes(folders, volume_size=0, split_folders=False, totals=None):
+    """
+    Splits the files of 'folders' into volumes of at most 'volume_size' bytes before compression (0 for no limit),
+    each folder starting its own volumes if 'split_folders'. A file bigger than 'volume_size' gets a volume of its own.
+    Files are never split between volumes, so every volume can be opened and restored by itself. The files are counted
+    into the ScanTotals 'totals' if given.
+    :returns: list: Volume
+    """
+    volumes = []
+    current = None
+    for folder in folders:
+        if split_folders:
+            current = None
+        for file_path, arc_name, stat in iter_zip_files(folder, totals=totals):
+            size = stat.st_size
+            if current is None or (volume_size and current.files and current.bytes + size > volume_size):
+                name = f"vol_{len(volumes) + 1:04d}"
+                if split_folders:
+                    name += f"_{get_folder_name(folder)}"
+                current = Volume(f"{name}.zip", folder if split_folders else "")
+                volumes.append(current)
+            current.files.append((file_path, arc_name, stat))
+            current.bytes += size
+    return volumes
+
+
+def compress_volumes(targets, volumes, progress=None, encryptor=None, workers=4, record=None, level=9):
+    """
+    Compresses 'volumes' into the folder slot of every target, a list of (name, storage backend, slot key), with up
+    to 'workers' volumes built at the same time, at the compression 'level'. The catalog is written last, a slot
+    without one wasn't finished. A destination that fails a volume isn't given the volumes after it.
+    :returns: dict: {name: exception} of the destinations that failed
+    """
+    failed = {}
+    lock = threading.Lock()
+    fan_out = FanOut(targets)
+    fan_out.makedirs()
+    failed.update(fan_out.close())
+
+    def compress(volume):
+        with lock:
+            alive = [(name, storage, f"{root}/{volume.name}") for name, storage, root in targets if name not in failed]
+        if not alive:
+            return
+        volume_record = record.for_volume(volume.name) if record is not None else None
+        volume_failed = compress_files(alive, volume.files, progress, encryptor, volume_record, level)
+        with lock:
+            for name, error in volume_failed.items():
+                failed.setdefault(name, error)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        # 'list' so an exception raised while compressing a volume isn't lost.
+        list(pool.map(compress, volumes))
+
+    catalog = {"created": time.time(),
+               "volumes": {volume.name: volume.to_dict() for volume in volumes}}
+    alive = [(name, storage, f"{root}/{CATALOG_FILE}") for name, storage, root in targets if name not in failed]
+    if alive:
+        fan_out = FanOut(alive)
+        fan_out.open("")
+        output = encryptor.wrap(fan_out) if encryptor is not None else fan_out
+        output.write(json.dumps(catalog, indent=4).encode())
+        if encryptor is not None:
+            output.finish()
+        fan_out.close_file()
+        failed.update(fan_out.close())
+    return failed
+
+
+def is_encrypted(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def decrypt(key, src_path, dst_path, encryptor):
+    if encryptor is None:
+        raise ValueError(f"{key} is encrypted, the profile's key is needed to read it.")
+    encryptor.decrypt_file(src_path, dst_path)
+
+
+def fetch(storage, key, dst_path, encryptor=None):
+    """Downloads/copies 'key' from 'storage' into the local 'dst_path', decrypting it if it's encrypted."""
+    storage.get(key, dst_path)
+    if not is_encrypted(dst_path):
+        return
+    decrypted_path = dst_path + ".dec"
+    decrypt(key, dst_path, decrypted_path, encryptor)
+    os.replace(decrypted_path, dst_path)
+
+
+@contextlib.contextmanager
+def open_zip(storage, key, encryptor=None):
+    """Opens the zip 'key' of 'storage' to read from it. A zip on a local drive is read in place, or decrypted straight
+    into a temporary folder if it's encrypted. One on a remote backend is downloaded there first."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, os.path.basename(key))
+        if isinstance(storage, LocalStorage):
+            if is_encrypted(storage.get_path(key)):
+                decrypt(key, storage.get_path(key), path, encryptor)
+            else:
+                path = storage.get_path(key)
+        else:
+            fetch(storage, key, path, encryptor)
+        with zipfile.ZipFile(path) as zipf:
+            yield zipf
+
+
+def read_catalog(storage, slot, encryptor=None):
+    """Returns the catalog of a volume slot as a dict:
+    {"created": float, "volumes": {volume name: {"folder": str, "bytes": int, "files": [name in the zip, ...]}}}"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, CATALOG_FILE)
+        fetch(storage, f"{slot}/{CATALOG_FILE}", path, encryptor)
+        return read_config(path)
+
+
+def find_volume(catalog, arc_name):
+    """Returns the name of the volume in 'catalog' that holds the file 'arc_name', None if no volume has it."""
+    for name, volume in catalog["volumes"].items():
+        if arc_name in volume["files"]:
+            return name
+    return None
+
+
+def verify_volume(storage, slot, volume_name, catalog, encryptor=None):
+    """
+    Checks one volume of a slot without touching the others: every file in it has to pass its CRC check and the
+    volume has to hold exactly the files the catalog lists for it.
+    :returns: list: str of the problems found, empty if the volume is fine
+    """
+    problems = []
+    try:
+        with open_zip(storage, f"{slot}/{volume_name}", encryptor) as zipf:
+            bad_file = zipf.testzip()
+            if bad_file is not None:
+                problems.append(f"{volume_name}: {bad_file} is corrupt")
+            names = set(zipf.namelist())
+    except Exception as e:
+        return [f"{volume_name}: can not be read. {str(e) or type(e).__name__}"]
+    expected = set(catalog["volumes"][volume_name]["files"])
+    for name in sorted(expected - names):
+        problems.append(f"{volume_name}: {name} is missing")
+    for name in sorted(names - expected):
+        problems.append(f"{volume_name}: {name} is not in the catalog")
+    return problems
+
+
+def restore_volume(storage, slot, volume_name, dst_folder, members=None, encryptor=None):
+    """Extracts one volume of a slot into 'dst_folder', only the files in 'members' if given.
+    :returns: list: the names of the files restored"""
+    with open_zip(storage, f"{slot}/{volume_name}", encryptor) as zipf:
+        names = members if members is not None else zipf.namelist()
+        zipf.extractall(dst_folder, names)
+    return list(names)
+
+
+def verify_slot(storage, slot, encryptor=None):
+    """Verifies a compressed slot, a split slot one volume at a time so only one is ever downloaded at once.
+    :returns: list: str of the problems found, empty if the slot is fine"""
+    if os.path.splitext(slot)[1] == ".zip":
+        try:
+            with open_zip(storage, slot, encryptor) as zipf:
+                bad_file = zipf.testzip()
+        except Exception as e:
+            return [f"{slot}: can not be read. {str(e) or type(e).__name__}"]
+        return [] if bad_file is None else [f"{slot}: {bad_file} is corrupt"]
+    try:
+        catalog = read_catalog(storage, slot, encryptor)
+    except Exception as e:
+        return [f"{slot}: the catalog can not be read. {str(e) or type(e).__name__}"]
+    problems = []
+    for volume_name in catalog["volumes"]:
+        problems.extend(verify_volume(storage, slot, volume_name, catalog, encryptor))
+    return problems
@@ -0,0 +1,317 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from .BackupThread import BackupThread, get_backup_methods, get_storages
+from .Catalog import BackupCatalog
+from .Profiler import CycleProfiler
+from .Progress import BackupProgress
+from .Storage import open_storage
+from .Utils import *
+
+
+class BackupWorker:
+    """
+    Runs the backups in a separate worker process, so compressing doesn't fight the GUI and tray icon for the GIL and
+    a crash while backing up doesn't take them down with it. The worker runs a BackupThread of its own, this class has
+    the methods of a BackupThread the Controller uses and passes them on to it.
+    Commands ('start', 'stop', 'recover', 'profiling', 'exit') go to the worker over one queue, notifications, progress
+    snapshots and state changes come back over another, read by a supervisor thread here. If the worker dies it's
+    started again, along with the backup it was running, at most '_max_restarts' times in '_restart_window' seconds.
+    'settings' are what the worker's BackupThread needs from the Controller, see 'run_worker'.
+    """
+    # Restarts allowed within '_restart_window' seconds, after that the worker is left stopped until the next start.
+    _max_restarts = 3
+    _restart_window = 300
+    # Seconds the worker gets to stop its backup and exit before it's killed.
+    _exit_timeout = 10
+
+    def __init__(self, controller, icon, settings):
+        self.controller = controller
+        self.windows_icon = icon
+        self.settings = settings
+        # Spawned on every platform, a forked worker would inherit Tk and pystray from this process.
+        self.context = multiprocessing.get_context("spawn")
+        # Only here so code waiting on a BackupThread's event keeps working, the worker has the real one.
+        self.backup_event = threading.Event()
+        self.progress = BackupProgress()
+
+        self.config_data = {}
+        self.last_update_time = 0
+        # (config, profile_name) of the backup the worker is running, to start it again if the worker dies.
+        self.running = None
+        self.restarts = []
+        self.closing = False
+        # Storage backends for planning, verifying and restoring from this process, the worker prunes and recovers.
+        self.storages = {}
+
+        self.process = None
+        self.commands = None
+        self.events = None
+        self.supervisor = None
+        self.start_worker()
+
+    def start_worker(self):
+        self.commands = self.context.Queue()
+        self.events = self.context.Queue()
+        self.process = self.context.Process(target=run_worker, args=(self.commands, self.events, self.settings),
+                                            name="BackupWorker", daemon=True)
+        self.process.start()
+        if self.supervisor is None or not self.supervisor.is_alive():
+            self.supervisor = threading.Thread(target=self.supervise, daemon=True)
+            self.supervisor.start()
+
+    def send(self, *command):
+        if not self.supervisor.is_alive():
+            # Left stopped after dying too often, a new command gives it another chance.
+            self.restarts = []
+            self.start_worker()
+        self.commands.put(command)
+
+    def supervise(self):
+        """Hands the worker's events on to the GUI and tray icon, and restarts the worker if it dies."""
+        while not self.closing:
+            try:
+                event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                if not self.process.is_alive() and not self.closing:
+                    if not self.restart_worker():
+                        return
+                continue
+            try:
+                self.handle_event(event)
+            except Exception as e:
+                log(f"ERROR: Backup worker event {event[0]} could not be handled: {e}")
+
+    def handle_event(self, event):
+        kind, args = event[0], event[1:]
+        if kind == "notify":
+            header, message, override, notify_kind = args
+            self.windows_icon.notify_user(header, message, override=override, kind=notify_kind)
+        elif kind == "remove_notification":
+            self.windows_icon.remove_notification()
+        elif kind == "progress":
+            self.progress.push(args[0])
+        elif kind == "state":
+            for key, value in args[0].items():
+                if key in ("thread_running", "recent_backup"):
+                    setattr(self.controller, key, value)
+                else:
+                    setattr(self, key, value)
+            if args[0].get("thread_running") is False:
+                self.running = None
+        elif kind == "terminate":
+            self.controller.terminate()
+
+    def restart_worker(self):
+        """Starts a new worker after the old one died, and the backup it was running.
+        :returns: bool: False if it died too often and was left stopped"""
+        exit_code = self.process.exitcode
+        self.controller.thread_running = False
+        now = time.monotonic()
+        self.restarts = [i for i in self.restarts if now - i < self._restart_window]
+        if len(self.restarts) >= self._max_restarts:
+            self.running = None
+            self.windows_icon.notify_user("ERROR:", "Backup engine keeps stopping and was not restarted. "
+                                                    "Start a backup to try again.", override=True)
+            log(f"ERROR: Backup worker stopped with exit code {exit_code}, {len(self.restarts)} times in "
+                f"{self._restart_window} seconds. Not restarted.")
+            return False
+        self.restarts.append(now)
+        log(f"ERROR: Backup worker stopped with exit code {exit_code}, restarting it.")
+        self.start_worker()
+        if self.running is not None:
+            self.windows_icon.notify_user("ERROR:", f"Backup engine stopped unexpectedly, restarting backup for "
+                                                    f"profile: {self.running[1]}", override=True)
+            self.commands.put(("start",) + self.running)
+        else:
+            self.windows_icon.notify_user("ERROR:", "Backup engine stopped unexpectedly and was restarted.")
+        return True
+
+    def start(self, config, profile_name):
+        """Starts a backup in the worker, the profile is verified here so errors show up right away."""
+        if self.controller.thread_running:
+            self.windows_icon.notify_user("ERROR:", "Cannot start backup. There is an active process.")
+            return
+        if not self.controller.verify_profiles(config):
+            return
+        self.config_data = config
+        self.running = (config, profile_name)
+        self.send("start", config, profile_name)
+
+    def stop_backup(self, no_message=False):
+        """Cancels the running backup, the worker stops it at the next chunk it reads and discards the slot it was
+        writing."""
+        self.running = None
+        self.send("stop", no_message)
+
+    def recover(self, destinations):
+        """Has the worker clean up half written slots and old backups still waiting to be deleted in 'destinations'."""
+        self.send("recover", destinations)
+
+    def set_profiling(self, enabled):
+        self.send("profiling", enabled)
+
+    def shutdown(self):
+        """Stops the running backup and the worker and waits for it to exit. Terminated if it doesn't exit within
+        '_exit_timeout' seconds, killed if it doesn't stop after that either."""
+        self.closing = True
+        self.running = None
+        if not self.process.is_alive():
+            return
+        self.commands.put(("stop", True))
+        self.commands.put(("exit",))
+        deadline = time.monotonic() + self._exit_timeout
+        while self.process.is_alive() and time.monotonic() < deadline:
+            # Whatever it still sends is read and dropped, a worker blocked on a full queue would never exit.
+            try:
+                self.events.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if self.process.is_alive():
+            log("ERROR: Backup worker did not exit in time and was terminated.")
+            self.process.terminate()
+            self.process.join(2)
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+    @staticmethod
+    def get_backup_methods():
+        return get_backup_methods()
+
+    def get_time_left(self):
+        """Returns the amount of time left before the next backup of the running rotate backup."""
+        time_passed = int(time.time() - self.last_update_time)
+        return self.config_data["Interval"] - time_passed
+
+    def get_storage(self, destination):
+        """Returns the storage backend of a 'Destination' for reading, nothing is ever pruned through it here."""
+        if destination not in self.storages:
+            self.storages[destination] = open_storage(destination, self.controller.s3_settings)
+        return self.storages[destination]
+
+    def get_storages(self, config):
+        return get_storages(config, self.get_storage, self.windows_icon)
+
+
+class _WorkerIcon:
+    """Stands in for the WindowsIcon in the worker process, notifications are sent to the GUI process to be shown."""
+
+    def __init__(self, events):
+        self.events = events
+        self.icon = self
+        self.config_data = {}
+
+    def notify_user(self, header, message, override=False, kind=None):
+        self.events.put(("notify", header, message, override, kind))
+
+    def remove_notification(self):
+        self.events.put(("remove_notification",))
+
+
+class _WorkerController:
+    """Stands in for the Controller in the worker process. What BackupThread reads from it comes from 'settings',
+    what it sets on it is sent to the GUI process."""
+
+    def __init__(self, settings, events):
+        self.events = events
+        self.max_threads = settings["max_threads"]
+        self.min_warning_time = settings["min_warning_time"]
+        self.reaper_files_per_second = settings["reaper_files_per_second"]
+        self.reaper_bytes_per_second = settings["reaper_bytes_per_second"]
+        self.s3_settings = settings["s3_settings"]
+        self.profiler = CycleProfiler(**settings["profiling"])
+        self.load_settings = settings["load"]
+        self.cache_mode = settings["cache_mode"]
+        self.tuning_settings = settings["tuning"]
+        self.journal_settings = settings["journal"]
+        # SQLite in WAL mode, the GUI process searches the same catalog while the worker writes to it.
+        self.catalog = BackupCatalog(CATALOG_DB)
+        self._thread_running = False
+        self._recent_backup = ""
+
+    @property
+    def thread_running(self):
+        return self._thread_running
+
+    @thread_running.setter
+    def thread_running(self, value):
+        self._thread_running = value
+        self.events.put(("state", {"thread_running": value}))
+
+    @property
+    def recent_backup(self):
+        return self._recent_backup
+
+    @recent_backup.setter
+    def recent_backup(self, value):
+        self._recent_backup = value
+        self.events.put(("state", {"recent_backup": value}))
+
+    @staticmethod
+    def verify_profiles(profile_data):
+        # Profiles are verified by the GUI process before they're sent, where its errors can be shown.
+        return bool(profile_data)
+
+    def terminate(self):
+        self.events.put(("terminate",))
+
+
+def forward_progress(thread, events, interval=0.25):
+    """Sends the worker's progress snapshots, and when the next rotate cycle is due, to the GUI process."""
+    state = {}
+    while True:
+        snapshot = thread.progress.drain()
+        if snapshot is not None:
+            events.put(("progress", snapshot))
+        if thread.last_update_time != state.get("last_update_time"):
+            state = {"last_update_time": thread.last_update_time}
+            events.put(("state", state))
+        time.sleep(interval)
+
+
+def run_worker(commands, events, settings):
+    """
+    Main function of the worker process, runs the commands sent by BackupWorker until told to exit or the GUI process
+    is gone.
+    'settings': {"max_threads": int, "min_warning_time": int, "reaper_files_per_second": int,
+    "reaper_bytes_per_second": int, "s3_settings": dict, "profiling": CycleProfiler keyword arguments,
+    "load": LoadGovernor keyword arguments, "cache_mode": one of 'PageCache.CACHE_MODES',
+    "tuning": ThroughputTuner keyword arguments, "journal": {"enabled": bool, "full_scan_hours": int}}
+    """
+    controller = _WorkerController(settings, events)
+    icon = _WorkerIcon(events)
+    thread = BackupThread(controller, icon)
+    threading.Thread(target=forward_progress, args=(thread, events), daemon=True).start()
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            command = commands.get(timeout=1)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+        name, args = command[0], command[1:]
+        if name == "exit":
+            break
+        try:
+            if name == "start":
+                thread.start(*args)
+            elif name == "stop":
+                thread.stop_backup(*args)
+            elif name == "recover":
+                for destination in args[0]:
+                    thread.get_storage(destination)
+            elif name == "profiling":
+                controller.profiler.set_enabled(args[0])
+        except Exception as e:
+            icon.notify_user("ERROR:", f"Unexpected error: {e}")
+            log(f"ERROR: Backup worker command {name} failed: {e}")
+    thread.stop_backup(no_message=True)
+    # The backup stops at its next chunk, it's waited for so the slot it was writing is discarded before exiting.
+    if thread.backup_process is not None:
+        thread.backup_process.join()
+    thread.reaper.stop()
+    controller.catalog.close()
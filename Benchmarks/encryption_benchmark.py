@@ -0,0 +1,59 @@
+"""
+Measures the cost of encrypting backups. Copies a folder of random files with 'copy_tree' to a temporary destination
+without encryption and with 1, 2, 4... worker threads, printing the throughput of each run.
+Run from the root of the repository: python -m Benchmarks.encryption_benchmark [size_mb] [files]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from BackupScripts.Encryption import Encryptor
+from BackupScripts.FanOut import copy_tree
+from BackupScripts.Storage import LocalStorage
+
+
+def make_source(path, size_mb, files):
+    os.makedirs(path)
+    file_size = size_mb * 1024 * 1024 // files
+    for i in range(files):
+        with open(os.path.join(path, f"file_{i}.bin"), 'wb') as file:
+            file.write(os.urandom(file_size))
+
+
+def run(source, destination, encryptor):
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+    storage = LocalStorage(destination, None)
+    start = time.perf_counter()
+    failed = copy_tree(source, [(destination, storage, "bench_0")], encryptor=encryptor)
+    seconds = time.perf_counter() - start
+    if failed:
+        raise RuntimeError(failed)
+    return seconds
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        destination = os.path.join(tmp, "destination")
+        make_source(source, size_mb, files)
+        # Warm up the page cache so every run reads the source from memory.
+        run(source, destination, None)
+
+        seconds = run(source, destination, None)
+        print(f"{'plain':>12}: {size_mb / seconds:8.1f} MB/s")
+        workers = 1
+        while workers <= max(os.cpu_count() or 1, 1):
+            encryptor = Encryptor(os.urandom(32), workers)
+            seconds = run(source, destination, encryptor)
+            encryptor.shutdown()
+            print(f"{f'{workers} workers':>12}: {size_mb / seconds:8.1f} MB/s")
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
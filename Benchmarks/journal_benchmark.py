@@ -0,0 +1,72 @@
+"""
+Measures how long a backup's scans take with a change journal. Makes a tree of empty files, then times 'scan_tree' (what
+the backup plan scans) and a full 'scan' (what a copy reads) without a journal, the journal's first full scan, and
+both again after 'changes' files were added to it: once with the changes found from the times of the folders, once
+from the watcher's events (if the 'watchdog' package is installed).
+Run from the root of the repository: python -m Benchmarks.journal_benchmark [files] [files_per_folder] [changes]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from BackupScripts.Journal import ChangeJournal
+from BackupScripts.Planner import scan_tree
+from BackupScripts.Scanner import scan, set_journal
+
+
+def make_tree(path, files, files_per_folder):
+    for i in range(files):
+        folder = os.path.join(path, f"folder_{i // files_per_folder // 100}", f"folder_{i // files_per_folder}")
+        if i % files_per_folder == 0:
+            os.makedirs(folder)
+        open(os.path.join(folder, f"file_{i}.txt"), 'wb').close()
+
+
+def change_tree(path, changes, step):
+    """Adds 'changes' files spread over the tree, one in every 'step'th folder."""
+    folders = sorted(os.path.join(root, name) for root, names, _ in os.walk(path) for name in names)
+    for i in range(changes):
+        open(os.path.join(folders[i * step % len(folders)], f"new_{time.time_ns()}.txt"), 'wb').close()
+
+
+def time_scans(source, workers=4):
+    start = time.perf_counter()
+    scan_tree(source, workers)
+    planned = time.perf_counter()
+    for _ in scan(source, workers):
+        pass
+    return planned - start, time.perf_counter() - planned
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    files_per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    changes = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        make_tree(source, files, files_per_folder)
+        results = [("No journal", time_scans(source))]
+
+        journal = ChangeJournal(source, path=os.path.join(tmp, "journal.db"))
+        set_journal(source, journal)
+        results.append(("Journal, full scan", time_scans(source)))
+        change_tree(source, changes, 37)
+        results.append((f"{changes} changes, folder times", time_scans(source)))
+        if journal.start_watching():
+            # A scan with the watcher running, its events alone are enough for the scans after it.
+            time_scans(source)
+            change_tree(source, changes, 41)
+            time.sleep(1)
+            results.append((f"{changes} changes, watcher", time_scans(source)))
+        journal.close()
+        set_journal(source, None)
+
+    print(f"{files} files in {files // files_per_folder} folders")
+    print(f"{'':>28} {'plan s':>8} {'scan s':>8}")
+    for name, (plan_seconds, scan_seconds) in results:
+        print(f"{name:>28} {plan_seconds:8.2f} {scan_seconds:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
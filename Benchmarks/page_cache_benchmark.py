@@ -0,0 +1,114 @@
+"""
+Measures how much of the page cache a backup takes over in each cache mode of 'PageCache.py'. Copies a folder of
+random files with 'copy_tree' from a cold page cache, then counts with mincore how much of the source, of the backup
+written and of a 'hot' file read just before (standing in for a database's working set) is cached afterwards.
+Linux/macOS only. The folder has to be on a real disk, tmpfs files are always in the page cache.
+Run from the root of the repository: python -m Benchmarks.page_cache_benchmark [size_mb] [files] [folder]
+"""
+import ctypes
+import ctypes.util
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from Benchmarks.encryption_benchmark import make_source
+from BackupScripts.FanOut import copy_tree
+from BackupScripts.PageCache import CACHE_MODES, advise, set_cache_mode
+from BackupScripts.Storage import LocalStorage
+
+PAGE_SIZE = mmap.PAGESIZE
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+
+
+def get_resident(path):
+    """Bytes of the file 'path' that are in the page cache, from mincore."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    with open(path, 'rb') as file:
+        # A private map can be written to, which ctypes needs to take its address, nothing is ever written.
+        mapped = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_COPY)
+    try:
+        pages = (size + PAGE_SIZE - 1) // PAGE_SIZE
+        vector = (ctypes.c_ubyte * pages)()
+        address = ctypes.c_void_p.from_buffer(mapped)
+        try:
+            if _libc.mincore(ctypes.addressof(address), size, vector) != 0:
+                raise OSError(ctypes.get_errno(), "mincore failed")
+        finally:
+            del address
+        return sum(i & 1 for i in vector) * PAGE_SIZE
+    finally:
+        mapped.close()
+
+
+def get_folder_resident(path):
+    """(bytes cached, bytes) of every file under 'path'."""
+    resident = total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(root, name)
+            resident += get_resident(file_path)
+            total += os.path.getsize(file_path)
+    return resident, total
+
+
+def evict(path):
+    """Writes out and drops every file under 'path' from the page cache, so the next read comes from the disk."""
+    os.sync()
+    for root, _, names in os.walk(path):
+        for name in names:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            advise(fd, 0, 0, "DONTNEED")
+            os.close(fd)
+
+
+def warm(path):
+    with open(path, 'rb') as file:
+        while file.read(1024 * 1024):
+            pass
+
+
+def run(mode, source, destination, hot):
+    shutil.rmtree(destination, ignore_errors=True)
+    os.makedirs(destination)
+    evict(source)
+    warm(hot)
+    set_cache_mode(mode)
+    start = time.perf_counter()
+    failed = copy_tree(source, [(destination, LocalStorage(destination, None), "bench_0")])
+    seconds = time.perf_counter() - start
+    if failed:
+        raise RuntimeError(failed)
+    source_cached, size = get_folder_resident(source)
+    written_cached, _ = get_folder_resident(destination)
+    hot_cached = get_resident(hot)
+    return seconds, size, source_cached, written_cached, hot_cached
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    folder = sys.argv[3] if len(sys.argv) > 3 else None
+    mb = 1024 * 1024
+    with tempfile.TemporaryDirectory(dir=folder) as tmp:
+        source = os.path.join(tmp, "source")
+        destination = os.path.join(tmp, "destination")
+        hot = os.path.join(tmp, "hot.bin")
+        make_source(source, size_mb, files)
+        with open(hot, 'wb') as file:
+            file.write(os.urandom(64 * mb))
+
+        print(f"{'mode':>8} {'MB/s':>8} {'source cached':>14} {'backup cached':>14} {'hot cached':>11}")
+        for mode in CACHE_MODES:
+            seconds, size, source_cached, written_cached, hot_cached = run(mode, source, destination, hot)
+            print(f"{mode:>8} {size / mb / seconds:8.1f} {source_cached / mb:11.1f} MB {written_cached / mb:11.1f} MB "
+                  f"{hot_cached / mb:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
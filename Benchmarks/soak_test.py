@@ -0,0 +1,231 @@
+"""
+Soak test of the rotate schedule. Runs 'BackupThread.rotate_backup' headless for thousands of cycles over a synthetic
+folder that changes between cycles, with a fake clock that skips the waits between cycles and a notification sink in
+place of the tray icon. Every cycle's RSS, open file descriptors, thread count, latency, schedule drift and length of
+'recent_backup' is written to a csv, and the run fails if file descriptors or threads leak or the schedule drifts.
+Run from the root of the repository: python -m Benchmarks.soak_test [cycles] [interval] [files]
+"""
+import csv
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from BackupScripts.BackupThread import BackupThread
+from BackupScripts.Catalog import BackupCatalog
+from BackupScripts.Profiler import CycleProfiler
+
+# Cycles run before the first measurement counts, caches and thread pools fill up in them.
+WARMUP_CYCLES = 20
+
+
+class FakeClock:
+    """Time that moves with the real time but jumps ahead instead of waiting, so the time backups take still counts
+    towards the schedule."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.skipped = 0
+        self.epoch = time.time()
+
+    def monotonic(self):
+        return time.monotonic() - self.start + self.skipped
+
+    def time(self):
+        return self.epoch + self.monotonic()
+
+    def wait(self, event, timeout):
+        if not event.is_set() and timeout > 0:
+            self.skipped += timeout
+        return event.is_set()
+
+
+class NotificationSink:
+    """Stands in for the WindowsIcon, counts notifications instead of showing them."""
+
+    def __init__(self):
+        self.config_data = {}
+        self.icon = self
+        self.counts = {}
+        self.errors = []
+
+    def notify_user(self, header, message, override=False, kind=None):
+        self.counts[header] = self.counts.get(header, 0) + 1
+        if header == "ERROR:" and len(self.errors) < 10:
+            self.errors.append(message)
+
+    def remove_notification(self):
+        pass
+
+
+class SoakController:
+    """The parts of the Controller BackupThread uses, with the defaults of the 'config.ini'."""
+    min_warning_time = 10
+    max_threads = 4
+    reaper_files_per_second = 0
+    reaper_bytes_per_second = 0
+    s3_settings = {}
+    load_settings = {}
+    cache_mode = "drop"
+    # Calibrating would write to the real 'tuning.json'.
+    tuning_settings = {"enabled": False}
+    # Journals would be kept in the real 'journals' folder.
+    journal_settings = {"enabled": False}
+
+    def __init__(self, catalog_path):
+        self.catalog = BackupCatalog(catalog_path)
+        self.profiler = CycleProfiler()
+        self.thread_running = False
+        self.recent_backup = ""
+
+    @staticmethod
+    def verify_profiles(profile_data):
+        return True
+
+    def terminate(self):
+        pass
+
+
+class SyntheticTree:
+    """A folder of small files, a few of them added, changed or deleted before every cycle."""
+
+    def __init__(self, path, files, seed=0):
+        self.path = path
+        self.random = random.Random(seed)
+        self.count = 0
+        for i in range(files):
+            self.add()
+
+    def add(self):
+        folder = os.path.join(self.path, f"dir_{self.count % 16}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file_{self.count}.bin"), 'wb') as file:
+            file.write(os.urandom(self.random.randint(0, 16 * 1024)))
+        self.count += 1
+
+    def mutate(self, changes=5):
+        files = [os.path.join(root, i) for root, _, names in os.walk(self.path) for i in names]
+        for _ in range(changes):
+            action = self.random.choice(["add", "change", "delete"])
+            if action == "add" or not files:
+                self.add()
+            elif action == "change":
+                with open(self.random.choice(files), 'ab') as file:
+                    file.write(os.urandom(self.random.randint(1, 4096)))
+            else:
+                path = files.pop(self.random.randrange(len(files)))
+                os.remove(path)
+
+
+def get_rss():
+    """Resident memory of this process in bytes, None where '/proc' doesn't exist."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_open_files():
+    """Open file descriptors of this process, None where '/proc' doesn't exist."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def soak(cycles, interval, files, tmp, results_path):
+    source = os.path.join(tmp, "source")
+    destination = os.path.join(tmp, "destination")
+    os.makedirs(destination)
+    tree = SyntheticTree(source, files)
+    controller = SoakController(os.path.join(tmp, "catalog.db"))
+    sink = NotificationSink()
+    clock = FakeClock()
+    thread = BackupThread(controller, sink, clock)
+
+    rows = []
+    done = threading.Event()
+    backup_folders = thread.backup_folders
+
+    def measured_cycle():
+        cycle = len(rows)
+        start = clock.time()
+        real_start = time.perf_counter()
+        result = backup_folders()
+        latency = time.perf_counter() - real_start
+        first = rows[0]["start"] if rows else start
+        rows.append({"cycle": cycle, "start": start, "latency": latency,
+                     "drift": start - (first + cycle * interval), "rss": get_rss(), "open_files": get_open_files(),
+                     "threads": threading.active_count(), "recent_backup": len(controller.recent_backup)})
+        if len(rows) >= cycles:
+            thread.backup_event.set()
+            done.set()
+        else:
+            tree.mutate()
+        return result
+
+    thread.backup_folders = measured_cycle
+    config = {"Folders": [source], "Destination": destination, "Interval": interval, "Copies": 3,
+              "Method": "Rotate", "WarningTime": 10, "Compression": False}
+    thread.start(config, "soak")
+    while not done.wait(10):
+        print(f"{len(rows)}/{cycles} cycles")
+    thread.backup_process.join()
+    thread.reaper.stop()
+    controller.catalog.close()
+
+    with open(results_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows, sink
+
+
+def report(rows, sink, interval):
+    """Prints how the measurements changed after the warmup.
+    :returns: list: the problems found"""
+    warm = rows[min(WARMUP_CYCLES, len(rows) - 1)]
+    last = rows[-1]
+    latencies = sorted(i["latency"] for i in rows)
+    print(f"Cycles: {len(rows)}, simulated time: {(last['start'] - rows[0]['start']) / 3600:.1f} hours")
+    print(f"Latency: median {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    print(f"Drift: last cycle {last['drift']:.2f} s, worst {max(abs(i['drift']) for i in rows):.2f} s")
+    for key in ["rss", "open_files", "threads", "recent_backup"]:
+        if warm[key] is not None:
+            print(f"{key}: {warm[key]} after warmup, {last[key]} at the end")
+    print(f"Notifications: {sink.counts}")
+
+    problems = []
+    if last["open_files"] is not None and last["open_files"] > warm["open_files"]:
+        problems.append(f"Open file descriptors grew from {warm['open_files']} to {last['open_files']}.")
+    if last["threads"] > warm["threads"]:
+        problems.append(f"Threads grew from {warm['threads']} to {last['threads']}.")
+    if max(abs(i["drift"]) for i in rows) > interval:
+        problems.append("Cycles drifted by more than an interval from their schedule.")
+    if last["recent_backup"] > warm["recent_backup"] * 2:
+        problems.append(f"'recent_backup' grew from {warm['recent_backup']} to {last['recent_backup']} characters.")
+    if sink.errors:
+        problems.append(f"Backups failed: {sink.errors}")
+    return problems
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    interval = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    results_path = os.path.abspath("soak_results.csv")
+    with tempfile.TemporaryDirectory() as tmp:
+        rows, sink = soak(cycles, interval, files, tmp, results_path)
+    problems = report(rows, sink, interval)
+    print(f"Every cycle written to: {results_path}")
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
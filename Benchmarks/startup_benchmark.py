@@ -0,0 +1,135 @@
+"""
+Measures what building the GUI costs at startup. Times every window the Controller can build, the tray icon's image
+and the interval Spinbox (a list of every value against a range), with the memory each one takes (Python allocations
+with tracemalloc and the process's RSS). Startup used to build all of them, now it builds nothing with
+'silent_start = True' and only the main window otherwise, the rest are built the first time they're opened.
+The windows and widgets need a display, without one only the icon image and the Spinbox's list of values (built and
+passed to a Tcl interpreter the way a widget's option would be) are measured.
+Run from the root of the repository: python -m Benchmarks.startup_benchmark [repeats]
+"""
+import gc
+import sys
+import time
+import tkinter as tk
+import tracemalloc
+from tkinter import ttk
+
+from Benchmarks.soak_test import NotificationSink, get_rss
+from BackupScripts.Utils import resource_path
+from Gui.CatalogWindow import CatalogWindow
+from Gui.DiffWindow import DiffWindow
+from Gui.ProfileWindow import ProfileWindow
+from Gui.Tk_AutoBackupGUI import AutomaticBackupGui
+
+
+class StartupController:
+    """The parts of the Controller the windows read while they're built, with the defaults of the 'config.ini'."""
+    min_interval = 20
+    max_interval = 10000
+    min_copies = 1
+    max_copies = 8
+    min_warning_time = 10
+    max_threads = 4
+
+    def __init__(self):
+        self.windows_icon = NotificationSink()
+
+    @staticmethod
+    def load_saved_profiles():
+        return {}
+
+    @staticmethod
+    def drain_progress():
+        return None
+
+    def __getattr__(self, name):
+        # Commands the windows bind to buttons, never run here.
+        return lambda *args, **kwargs: None
+
+
+def measure(root, build):
+    """Builds something once, returns (seconds, bytes allocated by Python, RSS growth in bytes)."""
+    gc.collect()
+    rss = get_rss()
+    tracemalloc.start()
+    start = time.perf_counter()
+    built = build()
+    root.update_idletasks()
+    seconds = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    grown = get_rss() - rss if rss is not None else 0
+    if isinstance(built, tk.Misc):
+        built.destroy()
+    return seconds, allocated, grown
+
+
+def print_results(stages, root, repeats):
+    results = {}
+    print(f"{'':>24} {'ms':>8} {'python KB':>10} {'RSS KB':>8}")
+    for name, build in stages:
+        # The best of a few, the first build of anything also pays for loading Tk's themes and fonts.
+        runs = [measure(root, build) for _ in range(repeats)]
+        results[name] = min(runs)
+        seconds, allocated, grown = results[name]
+        print(f"{name:>24} {seconds * 1000:8.1f} {allocated / 1024:10.1f} {grown / 1024:8.0f}")
+    return results
+
+
+def main_headless(repeats):
+    from PIL import Image
+    root = tk.Tcl()
+    controller = StartupController()
+    stages = [
+        # pystray can't be imported without a display, opened the way 'WindowsIcon.get_image' does.
+        ("Tray icon image", lambda: Image.open(resource_path("backup.ico"))),
+        ("Spinbox values, list", lambda: root.call("list", *[str(i) for i in range(
+            controller.min_interval, controller.max_interval + 1)])),
+        ("Spinbox values, range", lambda: root.call("list", controller.min_interval, controller.max_interval)),
+    ]
+    results = print_results(stages, root, repeats)
+    saved = [i - j for i, j in zip(results["Spinbox values, list"], results["Spinbox values, range"])]
+    print(f"No display, windows not measured. The interval values no longer built at startup: "
+          f"{saved[0] * 1000:.1f} ms, {saved[1] / 1024:.1f} KB of Python allocations")
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        main_headless(repeats)
+        return
+    from BackupScripts.WindowIcon import WindowsIcon
+    root.withdraw()
+    controller = StartupController()
+    frame = ttk.Frame(root)
+
+    def load_image():
+        WindowsIcon._pil_image = None
+        return WindowsIcon.get_image()
+
+    stages = [
+        ("Tray icon image", load_image),
+        ("Main window", lambda: AutomaticBackupGui(tk.Toplevel(root), controller, controller.windows_icon, True).root),
+        ("Profile window", lambda: ProfileWindow(root, controller)),
+        ("Catalog window", lambda: CatalogWindow(root, controller)),
+        ("Diff window", lambda: DiffWindow(root, controller)),
+        ("Spinbox, list of values", lambda: ttk.Spinbox(frame, values=[str(i) for i in range(
+            controller.min_interval, controller.max_interval + 1)])),
+        ("Spinbox, range", lambda: ttk.Spinbox(frame, from_=controller.min_interval, to=controller.max_interval,
+                                               increment=1, format="%.0f")),
+    ]
+    results = print_results(stages, root, repeats)
+
+    windows = ["Main window", "Profile window", "Catalog window", "Diff window"]
+    before = sum(results[i][0] for i in windows + ["Tray icon image"])
+    # The profile window above is built with the range, it used to list every interval.
+    before += results["Spinbox, list of values"][0] - results["Spinbox, range"][0]
+    print(f"Startup before: {before * 1000:.1f} ms of windows built up front")
+    print(f"Startup now: {results['Main window'][0] * 1000:.1f} ms, nothing with 'silent_start'")
+    root.destroy()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import threading
+import tkinter as tk
+from tkinter import filedialog
+from tkinter import ttk
+
+from BackupScripts.Progress import format_bytes
+from BackupScripts.Utils import *
+
+
+class CatalogWindow(tk.Toplevel):
+    """Pop up window for searching the catalog of every retained backup and restoring files from the results."""
+    def __init__(self, root, controller, **kwargs):
+        tk.Toplevel.__init__(self, root, **kwargs)
+        self.root = root
+        self.controller = controller
+        self.tree_view = None
+        self.search_var = tk.StringVar()
+        self.mode_var = tk.StringVar(value="name")
+        self.status_var = tk.StringVar(value="Search by file name (* and ? as wildcards) or a file's path.")
+        # Search results by row id.
+        self.results = {}
+
+        self.protocol("WM_DELETE_WINDOW", self.hide)
+
+        self.setup_window()
+        self.create_ui()
+
+    def setup_window(self):
+        self.title("Search Backups")
+        self.after(100, lambda: self.wm_iconbitmap(default=ICON_IMG))
+        self.set_window_position()
+
+    def set_window_position(self):
+        ws = self.root.winfo_screenwidth()
+        hs = self.root.winfo_screenheight()
+        w, h = (640, 420)
+        x = (ws / 2) - (w / 2)
+        y = (hs / 2) - (h / 2)
+        self.geometry('%dx%d+%d+%d' % (w, h, x, y))
+        self.resizable(True, True)
+        self.wm_minsize(w, h)
+
+    def create_ui(self):
+        frame0 = ttk.Frame(self)
+        entry = ttk.Entry(frame0, textvariable=self.search_var)
+        entry.pack(side='left', fill='x', expand=True, padx=4)
+        entry.bind("<Return>", lambda event: self.search())
+        ttk.Radiobutton(frame0, text="Name", takefocus=False, variable=self.mode_var,
+                        value="name").pack(side='left')
+        ttk.Radiobutton(frame0, text="All Versions", takefocus=False, variable=self.mode_var,
+                        value="versions").pack(side='left')
+        ttk.Button(frame0, text="Search", takefocus=False, command=self.search).pack(side='left', padx=4)
+
+        frame1 = ttk.Frame(self)
+        columns = [("slot", "Backup", 120), ("size", "Size", 70), ("modified", "Modified", 120)]
+        self.tree_view = ttk.Treeview(frame1, columns=[i[0] for i in columns])
+        self.tree_view.heading("#0", text="File:")
+        self.tree_view.column("#0", width=300)
+        for column, heading, width in columns:
+            self.tree_view.heading(column, text=heading)
+            self.tree_view.column(column, width=width, stretch=False)
+        scrollbar = ttk.Scrollbar(frame1, orient='vertical', command=self.tree_view.yview)
+        self.tree_view.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        self.tree_view.pack(side='left', fill='both', expand=True)
+        self.tree_view.bind("<Double-1>", lambda event=None: self.restore())
+
+        frame2 = ttk.Frame(self)
+        ttk.Label(frame2, textvariable=self.status_var).pack(side='left', padx=4)
+        ttk.Button(frame2, text="Restore To...", takefocus=False, command=self.restore).pack(side='right', padx=4)
+
+        frame0.pack(side='top', fill='x', pady=4)
+        frame1.pack(side='top', fill='both', expand=True, padx=4)
+        frame2.pack(side='top', fill='x', pady=4)
+
+    def search(self):
+        text = self.search_var.get().strip()
+        if not text:
+            return
+        if self.mode_var.get() == "versions":
+            results = self.controller.catalog.find_versions(text)
+        else:
+            results = self.controller.catalog.find_by_name(text if any(i in text for i in "*?") else f"*{text}*")
+        self.tree_view.delete(*self.tree_view.get_children())
+        self.results = {}
+        for entry in results:
+            modified = datetime.datetime.fromtimestamp(entry["mtime"]).strftime("%Y-%m-%d %H:%M")
+            node = self.tree_view.insert("", 'end', text=entry["path"],
+                                         values=[entry["slot"], format_bytes(entry["size"]), modified])
+            self.results[node] = entry
+        self.status_var.set(f"{len(results)} file(s) found.")
+
+    def restore(self):
+        entries = [self.results[i] for i in self.tree_view.selection() if i in self.results]
+        if not entries:
+            self.status_var.set("Select the file(s) to restore first.")
+            return
+        dst_folder = filedialog.askdirectory(parent=self, title="Restore To")
+        if not dst_folder:
+            return
+        self.status_var.set(f"Restoring {len(entries)} file(s)...")
+        # Downloads can take a while, the result comes back as a notification.
+        threading.Thread(target=self.controller.restore_files, args=(entries, dst_folder), daemon=True).start()
+
+    def hide(self):
+        self.withdraw()
+
+    def show(self):
+        self.set_window_position()
+        self.deiconify()
+        self.focus_force()
@@ -1,48 +1,131 @@
-try:
-    import Tkinter as tk
-    import ttk
-except ImportError:  # Python 3
-    import tkinter as tk
-    from tkinter import ttk, messagebox
-
-
-class CustomTreeView(ttk.Treeview):
-
-    def __init__(self, top_window, *args, **kwargs):
-        ttk.Treeview.__init__(self, top_window, *args, **kwargs)
-        self.item_selected = None
-        self.bind("<ButtonPress-3>", lambda event: self.pop_up_menu(event))
-        self.nodes = dict()
-
-    def insert_node(self, parent, text):
-        children = self.get_children()
-        existing_text = [self.item(i)['text'] for i in children]
-        if text not in existing_text:
-            node = self.insert(parent, 'end', text=text)
-            self.nodes.update({text: node})
-
-    def get_all_elements(self):
-        """Returns all the parents and children in the treeview as a dict with their given text."""
-        return [i for i in self.nodes.keys()]
-
-    def pop_up_menu(self, event: ttk.Treeview) -> None:
-        """Create a popup menu by right-clicking with options."""
-        instance = event.widget
-        # Listbox drop down menu
-        if isinstance(instance, ttk.Treeview):
-            menu = tk.Menu(self, tearoff=0)
-            menu.add_command(label="Delete", command=self.remove_elements)
-
-            try:
-                menu.tk_popup(event.x_root, event.y_root)
-            finally:
-                menu.grab_release()
-
-    def remove_elements(self):
-        """Removes parents and children from the tree view that are not in the exempt list."""
-        selected = list(self.selection())
-        for i in selected:
-            if self.exists(i):
-                text = self.item(i)['text']
-                del self.nodes[text]
-                self.delete(i)
+import queue
+import threading
+
+try:
+    import Tkinter as tk
+    import ttk
+except ImportError:  # Python 3
+    import tkinter as tk
+    from tkinter import ttk, messagebox
+
+
+class CustomTreeView(ttk.Treeview):
+    """
+    Treeview of unique rows keyed by their text, so duplicates are found with a set lookup instead of reading every
+    row back from Tk. 'lazy_columns' is a list of (column, heading, width) shown next to the text, their values come
+    from 'compute(text)' (a tuple, one value per column) which runs on a background thread so slow ones (folder sizes)
+    never freeze the window. Rows show '...' until their values are ready.
+    """
+    # Milliseconds between checks for values computed by the background thread.
+    _poll_interval = 100
+
+    def __init__(self, top_window, *args, lazy_columns=None, compute=None, **kwargs):
+        columns = [i[0] for i in lazy_columns] if lazy_columns else []
+        ttk.Treeview.__init__(self, top_window, *args, columns=columns, **kwargs)
+        self.item_selected = None
+        self.bind("<ButtonPress-3>", lambda event: self.pop_up_menu(event))
+        self.nodes = dict()
+
+        self.compute = compute
+        self.lazy_columns = lazy_columns or []
+        for column, heading, width in self.lazy_columns:
+            self.heading(column, text=heading)
+            self.column(column, width=width, stretch=False, anchor='e')
+        self.pending = queue.Queue()
+        self.results = queue.Queue()
+        if self.compute is not None:
+            threading.Thread(target=self.run_compute, daemon=True).start()
+            self.after(self._poll_interval, self.poll_results)
+
+    def insert_node(self, parent, text):
+        if text not in self.nodes:
+            node = self.insert(parent, 'end', text=text, values=["..."] * len(self.lazy_columns))
+            self.nodes.update({text: node})
+            self.request_values(text)
+            return node
+        return None
+
+    def insert_nodes(self, parent, texts):
+        """Inserts every text that isn't already in the tree view.
+        :returns: int: the number of rows added"""
+        added = 0
+        for text in texts:
+            if self.insert_node(parent, text) is not None:
+                added += 1
+        return added
+
+    def remove_node(self, text):
+        node = self.nodes.pop(text, None)
+        if node is not None and self.exists(node):
+            self.delete(node)
+
+    def clear(self):
+        self.delete(*self.get_children())
+        self.nodes.clear()
+
+    def sync_nodes(self, texts):
+        """Makes the rows match 'texts' in the same order, only adding and removing the rows that changed.
+        Rows that stay keep their selection and computed values."""
+        texts = list(dict.fromkeys(texts))
+        wanted = set(texts)
+        for text in [i for i in self.nodes if i not in wanted]:
+            self.remove_node(text)
+        self.insert_nodes("", texts)
+        if list(self.get_children()) != [self.nodes[i] for i in texts]:
+            for index, text in enumerate(texts):
+                self.move(self.nodes[text], "", index)
+
+    def refresh_values(self, texts=None):
+        """Computes the lazy column values again, for every row if 'texts' isn't given."""
+        for text in texts if texts is not None else list(self.nodes):
+            self.request_values(text)
+
+    def request_values(self, text):
+        if self.compute is not None:
+            self.pending.put(text)
+
+    def run_compute(self):
+        while True:
+            text = self.pending.get()
+            try:
+                values = self.compute(text)
+            except Exception:
+                values = ["?"] * len(self.lazy_columns)
+            self.results.put((text, values))
+
+    def poll_results(self):
+        """Applies the computed values from the Tk thread, rows removed in the meantime are skipped."""
+        while True:
+            try:
+                text, values = self.results.get_nowait()
+            except queue.Empty:
+                break
+            node = self.nodes.get(text)
+            if node is not None and self.exists(node):
+                self.item(node, values=values)
+        self.after(self._poll_interval, self.poll_results)
+
+    def get_all_elements(self):
+        """Returns all the parents and children in the treeview as a dict with their given text."""
+        return [i for i in self.nodes.keys()]
+
+    def pop_up_menu(self, event: ttk.Treeview) -> None:
+        """Create a popup menu by right-clicking with options."""
+        instance = event.widget
+        # Listbox drop down menu
+        if isinstance(instance, ttk.Treeview):
+            menu = tk.Menu(self, tearoff=0)
+            menu.add_command(label="Delete", command=self.remove_elements)
+
+            try:
+                menu.tk_popup(event.x_root, event.y_root)
+            finally:
+                menu.grab_release()
+
+    def remove_elements(self):
+        """Removes parents and children from the tree view that are not in the exempt list."""
+        selected = list(self.selection())
+        for i in selected:
+            if self.exists(i):
+                text = self.item(i)['text']
+                self.remove_node(text)
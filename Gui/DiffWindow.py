@@ -0,0 +1,162 @@
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk
+
+from BackupScripts.Diff import format_delta, get_size_delta
+from BackupScripts.Progress import format_bytes
+from BackupScripts.Utils import *
+
+
+class DiffWindow(tk.Toplevel):
+    """Pop up window comparing two rotation slots of a profile, listing the files added, removed and modified."""
+    def __init__(self, root, controller, **kwargs):
+        tk.Toplevel.__init__(self, root, **kwargs)
+        self.root = root
+        self.controller = controller
+        self.tree_view = None
+        self.destination_box = None
+        self.old_box = None
+        self.new_box = None
+        self.profile_name = ""
+        # {destination: [slot, ...]} of the profile being compared, newest slot first.
+        self.slots = {}
+        self.status_var = tk.StringVar()
+        # Slots and diffs are read on a separate thread, the results are picked up by 'poll_results'.
+        self.results = queue.Queue()
+
+        self.protocol("WM_DELETE_WINDOW", self.hide)
+
+        self.setup_window()
+        self.create_ui()
+        self.after(200, self.poll_results)
+
+    def setup_window(self):
+        self.title("Compare Backups")
+        self.after(100, lambda: self.wm_iconbitmap(default=ICON_IMG))
+        self.set_window_position()
+
+    def set_window_position(self):
+        ws = self.root.winfo_screenwidth()
+        hs = self.root.winfo_screenheight()
+        w, h = (640, 420)
+        x = (ws / 2) - (w / 2)
+        y = (hs / 2) - (h / 2)
+        self.geometry('%dx%d+%d+%d' % (w, h, x, y))
+        self.resizable(True, True)
+        self.wm_minsize(w, h)
+
+    def create_ui(self):
+        frame0 = ttk.Frame(self)
+        self.destination_box = ttk.Combobox(frame0, state='readonly', width=24)
+        self.destination_box.pack(side='left', padx=4)
+        self.destination_box.bind("<<ComboboxSelected>>", lambda event: self.select_destination())
+        ttk.Label(frame0, text="Old:").pack(side='left')
+        self.old_box = ttk.Combobox(frame0, state='readonly', width=14)
+        self.old_box.pack(side='left', padx=4)
+        ttk.Label(frame0, text="New:").pack(side='left')
+        self.new_box = ttk.Combobox(frame0, state='readonly', width=14)
+        self.new_box.pack(side='left', padx=4)
+        ttk.Button(frame0, text="Compare", takefocus=False, command=self.compare).pack(side='left', padx=4)
+
+        frame1 = ttk.Frame(self)
+        columns = [("change", "Change", 80), ("old", "Old Size", 80), ("new", "New Size", 80), ("delta", "Delta", 80)]
+        self.tree_view = ttk.Treeview(frame1, columns=[i[0] for i in columns])
+        self.tree_view.heading("#0", text="File:")
+        self.tree_view.column("#0", width=300)
+        for column, heading, width in columns:
+            self.tree_view.heading(column, text=heading)
+            self.tree_view.column(column, width=width, stretch=False)
+        scrollbar = ttk.Scrollbar(frame1, orient='vertical', command=self.tree_view.yview)
+        self.tree_view.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        self.tree_view.pack(side='left', fill='both', expand=True)
+
+        frame2 = ttk.Frame(self)
+        ttk.Label(frame2, textvariable=self.status_var).pack(side='left', padx=4)
+
+        frame0.pack(side='top', fill='x', pady=4)
+        frame1.pack(side='top', fill='both', expand=True, padx=4)
+        frame2.pack(side='top', fill='x', pady=4)
+
+    def load_profile(self, config, profile_name):
+        self.profile_name = profile_name
+        self.title(f"Compare Backups - {profile_name}")
+        self.slots = {}
+        for box in [self.destination_box, self.old_box, self.new_box]:
+            box.set("")
+            box["values"] = []
+        self.tree_view.delete(*self.tree_view.get_children())
+        self.status_var.set("Looking for backups...")
+        threading.Thread(target=self.run_list_slots, args=(config, profile_name), daemon=True).start()
+
+    def run_list_slots(self, config, profile_name):
+        try:
+            self.results.put(("slots", self.controller.list_backup_slots(config, profile_name)))
+        except Exception as e:
+            self.results.put(("error", f"Backups could not be listed: {e}"))
+
+    def select_destination(self):
+        slots = self.slots.get(self.destination_box.get(), [])
+        self.old_box["values"] = slots
+        self.new_box["values"] = slots
+        # The newest backup against the one before it.
+        self.new_box.set(slots[0] if slots else "")
+        self.old_box.set(slots[1] if len(slots) > 1 else "")
+        self.status_var.set(f"{len(slots)} backup(s) on this destination." if slots else "No backups to compare.")
+
+    def compare(self):
+        destination, old_slot, new_slot = self.destination_box.get(), self.old_box.get(), self.new_box.get()
+        if not old_slot or not new_slot or old_slot == new_slot:
+            self.status_var.set("Select two different backups to compare.")
+            return
+        self.status_var.set(f"Comparing {old_slot} with {new_slot}...")
+        threading.Thread(target=self.run_compare, args=(destination, old_slot, new_slot), daemon=True).start()
+
+    def run_compare(self, destination, old_slot, new_slot):
+        try:
+            self.results.put(("diff", self.controller.diff_backups(destination, old_slot, new_slot)))
+        except Exception as e:
+            self.results.put(("error", f"Backups could not be compared: {e}"))
+
+    def poll_results(self):
+        try:
+            kind, result = self.results.get_nowait()
+        except queue.Empty:
+            self.after(200, self.poll_results)
+            return
+        if kind == "slots":
+            self.slots = result
+            self.destination_box["values"] = list(result)
+            if result:
+                self.destination_box.set(next(iter(result)))
+                self.select_destination()
+            else:
+                self.status_var.set("No backups to compare.")
+        elif kind == "diff":
+            self.show_diff(result)
+        else:
+            self.status_var.set(result)
+        self.after(200, self.poll_results)
+
+    def show_diff(self, diff):
+        self.tree_view.delete(*self.tree_view.get_children())
+        for path, size in diff["added"]:
+            self.tree_view.insert("", 'end', text=path, values=["Added", "", format_bytes(size), format_delta(size)])
+        for path, size in diff["removed"]:
+            self.tree_view.insert("", 'end', text=path, values=["Removed", format_bytes(size), "", format_delta(-size)])
+        for path, old, new in diff["modified"]:
+            self.tree_view.insert("", 'end', text=path, values=["Modified", format_bytes(old), format_bytes(new),
+                                                                format_delta(new - old)])
+        self.status_var.set(f"{len(diff['added'])} added, {len(diff['removed'])} removed, "
+                            f"{len(diff['modified'])} modified, {diff['unchanged']} unchanged "
+                            f"({format_delta(get_size_delta(diff))}), from the {diff['source']}.")
+
+    def hide(self):
+        self.withdraw()
+
+    def show(self, config, profile_name):
+        self.load_profile(config, profile_name)
+        self.set_window_position()
+        self.deiconify()
+        self.focus_force()
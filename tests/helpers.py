@@ -0,0 +1,38 @@
+"""Headless BackupThread for the tests, with the stand-ins of the soak test and every file it writes in 'tmp'."""
+import os
+from unittest import mock
+
+from Benchmarks.soak_test import FakeClock, NotificationSink, SoakController
+from BackupScripts.BackupThread import BackupThread
+
+
+def make_tree(path, files=10):
+    for i in range(files):
+        folder = os.path.join(path, f"dir_{i % 3}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"file_{i}.txt"), 'w') as file:
+            file.write("data" * i)
+
+
+def make_thread(test, tmp):
+    """A BackupThread writing its stats and log into 'tmp', stopped when 'test' ends."""
+    for patch in [mock.patch("BackupScripts.Planner.STATS_FILE", os.path.join(tmp, "stats.json")),
+                  mock.patch("BackupScripts.Utils.LOG_FILE", os.path.join(tmp, "log.csv"))]:
+        patch.start()
+        test.addCleanup(patch.stop)
+    controller = SoakController(os.path.join(tmp, "catalog.db"))
+    icon = NotificationSink()
+    thread = BackupThread(controller, icon, FakeClock())
+    test.addCleanup(controller.catalog.close)
+    test.addCleanup(thread.reaper.stop)
+    return thread, icon
+
+
+def run_cycle(thread, folders, destination, copies, compression=False, **options):
+    """Runs one backup cycle of a profile, what 'rotate_backup' does every 'Interval'."""
+    thread.config_data = dict({"Folders": folders, "Destination": destination, "Copies": copies,
+                               "Compression": compression, "Method": "Rotate", "Interval": 0, "WarningTime": 10},
+                              **options)
+    thread.cur_profile = "profile"
+    thread.compression = compression
+    return thread.backup_folders()
@@ -0,0 +1,50 @@
+import io
+import os
+import unittest
+
+from BackupScripts.Encryption import HEADER, Encryptor, encryption_available, get_nonce
+
+
+@unittest.skipUnless(encryption_available(), "the 'cryptography' package isn't installed")
+class EncryptorTest(unittest.TestCase):
+    def setUp(self):
+        self.encryptor = Encryptor(os.urandom(32), workers=2, chunk_size=1024)
+        self.addCleanup(self.encryptor.shutdown)
+
+    def encrypt(self, data):
+        output = io.BytesIO()
+        writer = self.encryptor.wrap(output)
+        writer.write(data)
+        writer.finish()
+        return output.getvalue()
+
+    def decrypt(self, data):
+        output = io.BytesIO()
+        self.encryptor.decrypt(io.BytesIO(data), output)
+        return output.getvalue()
+
+    def test_round_trip(self):
+        for data in [b"", b"x", os.urandom(1024), os.urandom(5000)]:
+            self.assertEqual(self.decrypt(self.encrypt(data)), data)
+
+    def test_every_file_has_its_own_key(self):
+        # Chunks of every file are encrypted with the same nonces, the keys tell them apart.
+        nonce = get_nonce(0, True)
+        salts = [os.urandom(32), os.urandom(32)]
+        first, second = [self.encryptor.get_cipher(salt).encrypt(nonce, b"data", None) for salt in salts]
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.encryptor.get_cipher(salts[0]).encrypt(nonce, b"data", None), first)
+        headers = {self.encrypt(b"data")[:HEADER.size] for _ in range(2)}
+        self.assertEqual(len(headers), 2)
+
+    def test_changed_or_cut_off_file_fails(self):
+        encrypted = self.encrypt(os.urandom(3000))
+        changed = bytearray(encrypted)
+        changed[HEADER.size - 1] ^= 1
+        for data in [bytes(changed), encrypted[:-(1024 + 16)], b"ABKENC02"]:
+            with self.assertRaises(Exception):
+                self.decrypt(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from Benchmarks.soak_test import FakeClock
+from BackupScripts.HostLoad import LoadGovernor
+
+
+class GovernorClockTest(unittest.TestCase):
+    """The LoadGovernor waits on the clock it's given and stops waiting once the backup is stopped."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patch in [mock.patch("BackupScripts.Planner.STATS_FILE", os.path.join(tmp.name, "stats.json")),
+                      mock.patch("BackupScripts.Utils.LOG_FILE", os.path.join(tmp.name, "log.csv"))]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.clock = FakeClock()
+        self.stop_event = threading.Event()
+        self.governor = LoadGovernor(self.clock, self.stop_event, min_rate=1024)
+        self.busy = True
+        reasons = ["load 9.00 per CPU > 1.5"]
+        patch = mock.patch.object(self.governor, "get_reasons", lambda sample: reasons if self.busy else [])
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def slow_down(self):
+        self.governor.start_cycle("profile")
+        # Past the first sample, the host is busy so the backup is slowed to the minimum.
+        self.clock.skipped += self.governor._sample_interval
+        self.governor.throttle(1024)
+        self.assertEqual(self.governor.rate, 1024)
+
+    def test_throttle_waits_on_the_clock(self):
+        self.slow_down()
+        start = time.monotonic()
+        skipped = self.clock.skipped
+        self.governor.throttle(10 * 1024)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertGreater(self.clock.skipped - skipped, 9)
+        self.assertTrue(self.governor.throttled)
+
+    def test_stopped_backup_is_not_held(self):
+        self.slow_down()
+        self.stop_event.set()
+        skipped = self.clock.skipped
+        self.governor.throttle(10 * 1024)
+        self.assertEqual(self.clock.skipped, skipped)
+
+    def test_deferral_waits_on_the_clock(self):
+        start = time.monotonic()
+        deferred = self.governor.wait_for_idle("profile")
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertGreaterEqual(deferred, self.governor.max_deferral)
+        self.busy = False
+        self.assertEqual(self.governor.wait_for_idle("profile"), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
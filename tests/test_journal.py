@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from BackupScripts import Journal
+from BackupScripts.Journal import ChangeJournal
+from BackupScripts.Scanner import scan_files
+from BackupScripts.Sparse import SPARSE_SUPPORTED, is_sparse
+from tests.helpers import make_thread, make_tree, run_cycle
+
+
+class ChangedInPlaceTest(unittest.TestCase):
+    """Files that change without their folder changing, found by a journal without its watcher running."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source, 6)
+        os.makedirs(self.destination)
+        for patch in [mock.patch("BackupScripts.Planner.STATS_FILE", os.path.join(tmp.name, "stats.json")),
+                      mock.patch("BackupScripts.Utils.LOG_FILE", os.path.join(tmp.name, "log.csv"))]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def grow(self, name, size):
+        """Makes the file longer in place, the folder it's in keeps its modification time."""
+        path = os.path.join(self.source, "dir_0", name)
+        folder_mtime = os.stat(os.path.dirname(path)).st_mtime_ns
+        with open(path, 'r+b') as file:
+            file.seek(size - 4)
+            file.write(b"tail")
+        self.assertEqual(os.stat(os.path.dirname(path)).st_mtime_ns, folder_mtime)
+        return path
+
+    def test_scan_reads_files_as_they_are_now(self):
+        journal = ChangeJournal(self.source, path=os.path.join(self.tmp, "journal.db"))
+        self.addCleanup(journal.close)
+        list(journal.scan())
+        path = self.grow("file_3.txt", 4096)
+        stats = {entry.path: entry.stat for entry in journal.scan()}
+        self.assertEqual(stats[path].st_size, 4096)
+        self.assertEqual(journal.get_totals()[1], sum(i.st_size for i in stats.values() if i is not None))
+
+    def test_scan_leaves_out_files_gone(self):
+        journal = ChangeJournal(self.source, path=os.path.join(self.tmp, "journal.db"))
+        self.addCleanup(journal.close)
+        list(journal.scan())
+        # As if the folder kept its time (a file system with a coarse clock), only the file's stat can tell.
+        path = os.path.join(self.source, "dir_0", "file_3.txt")
+        os.remove(path)
+        with mock.patch.object(ChangeJournal, "get_changed_folders", return_value=set()):
+            self.assertNotIn(path, [entry.path for entry in journal.scan()])
+
+    def test_watcher_spares_the_stats(self):
+        journal = ChangeJournal(self.source, path=os.path.join(self.tmp, "journal.db"))
+        self.addCleanup(journal.close)
+        with mock.patch.object(ChangeJournal, "is_watching", return_value=True):
+            # The first scan stats every file, the watcher only covers the folder from then on.
+            list(journal.scan())
+            path = self.grow("file_3.txt", 4096)
+            journal.mark_dirty(path, False)
+            with mock.patch.object(Journal, "stat_files", side_effect=AssertionError), \
+                    mock.patch.object(ChangeJournal, "get_changed_folders", side_effect=AssertionError):
+                stats = {entry.path: entry.stat for entry in journal.scan()}
+        # Its folder is listed again, the file is read as it is now.
+        self.assertEqual(stats[path].st_size, 4096)
+        self.assertEqual(len(stats), len(list(scan_files(self.source))) + 3)
+
+    @unittest.skipUnless(SPARSE_SUPPORTED, "no sparse files on this file system")
+    def test_sparse_file_grown_is_copied_whole(self):
+        path = os.path.join(self.source, "dir_0", "sparse.bin")
+        with open(path, 'wb') as file:
+            file.write(b"head")
+            file.truncate(1 << 20)
+        if not is_sparse(os.stat(path)):
+            self.skipTest("the file system didn't leave a hole")
+        thread, icon = make_thread(self, self.tmp)
+        thread.journal_settings = {"enabled": True, "full_scan_hours": 0}
+        with mock.patch("BackupScripts.Journal.JOURNAL_FOLDER", os.path.join(self.tmp, "journals")), \
+                mock.patch.object(ChangeJournal, "start_watching", return_value=False):
+            self.assertTrue(run_cycle(thread, [self.source], self.destination, 3))
+            self.grow("sparse.bin", 2 << 20)
+            self.assertTrue(run_cycle(thread, [self.source], self.destination, 3))
+            thread.close_journals()
+        self.assertEqual(icon.errors, [])
+        newest = os.path.join(self.destination, thread.written_slots[self.destination])
+        with open(path, 'rb') as source, open(os.path.join(newest, "dir_0", "sparse.bin"), 'rb') as copy:
+            self.assertEqual(source.read(), copy.read())
+        self.assertEqual(len(list(scan_files(newest))), len(list(scan_files(self.source))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from BackupScripts.Notifier import NotificationDispatcher
+
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.sent_event = threading.Event()
+
+        def send(message, header):
+            self.sent.append((time.monotonic(), header, message))
+            self.sent_event.set()
+
+        self.dispatcher = NotificationDispatcher(send, coalesce_window=2)
+
+    def wait_sent(self, count, timeout=1):
+        deadline = time.monotonic() + timeout
+        while len(self.sent) < count and time.monotonic() < deadline:
+            self.sent_event.wait(0.01)
+            self.sent_event.clear()
+        return [i[1:] for i in self.sent]
+
+    def test_override_is_sent_right_away(self):
+        start = time.monotonic()
+        self.dispatcher.notify("INFO:", "Auto Backup is running in background.", override=True)
+        self.assertEqual(self.wait_sent(1), [("INFO:", "Auto Backup is running in background.")])
+        self.assertLess(self.sent[0][0] - start, 1)
+
+    def test_override_during_a_burst_is_not_held(self):
+        start = time.monotonic()
+        self.dispatcher.notify("ALERT:", "Backup: a", kind="backup")
+        self.dispatcher.notify("INFO:", "Time left: 10 seconds", override=True)
+        self.assertEqual(self.wait_sent(1), [("INFO:", "Time left: 10 seconds")])
+        self.assertLess(self.sent[0][0] - start, 1)
+        # The rest is still merged once the window is over.
+        self.dispatcher.notify("ALERT:", "Backup: b", kind="backup")
+        self.assertEqual(self.wait_sent(2, 5)[1], ("ALERT:", "2 backups completed\nLatest: Backup: b"))
+
+    def test_flush_sends_everything_now(self):
+        self.dispatcher.notify("ALERT:", "Backup: a", kind="backup")
+        self.assertEqual(self.wait_sent(1, 5), [("ALERT:", "Backup: a")])
+        # Held back by the window, then by the gap of the alerts.
+        start = time.monotonic()
+        self.dispatcher.notify("ERROR:", "Process terminated before all folders could be backed up.")
+        self.dispatcher.notify("ALERT:", "Process terminated.")
+        self.dispatcher.flush()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.wait_sent(2, 0), [("ALERT:", "Backup: a"),
+                                                ("ERROR:", "1 error, 1 alert\nLatest: Process terminated.")])
+
+
+if __name__ == '__main__':
+    unittest.main()
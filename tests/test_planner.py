@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from BackupScripts import Scanner
+from BackupScripts.Planner import get_stats, plan_backup, scan_folders
+from BackupScripts.Storage import LocalStorage
+from BackupScripts.Utils import TRASH_FOLDER
+from tests.helpers import make_thread, make_tree, run_cycle
+
+
+class SinglePassTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source, 30)
+        os.makedirs(self.destination)
+        self.thread, self.icon = make_thread(self, tmp.name)
+        self.walks = []
+        scan_file_system = Scanner.scan_file_system
+
+        def counted(root, *args, **kwargs):
+            # Only the sources, the size of a zip slot written is read from its destination afterwards.
+            if not root.startswith(self.destination):
+                self.walks.append(root)
+            return scan_file_system(root, *args, **kwargs)
+
+        patch = mock.patch.object(Scanner, "scan_file_system", counted)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def backup(self, compression=False, **options):
+        self.walks.clear()
+        self.assertTrue(run_cycle(self.thread, [self.source], self.destination, 2, compression, **options))
+        self.assertEqual(self.icon.errors, [])
+        return len(self.walks)
+
+    def check_totals(self):
+        stats = get_stats("profile")
+        self.assertEqual((stats["files"], stats["bytes"]), scan_folders([self.source])[:2])
+
+    def test_copy_walks_once(self):
+        # The first backup of a profile has nothing to size its plan from.
+        self.assertEqual(self.backup(), 2)
+        self.check_totals()
+        with open(os.path.join(self.source, "added.txt"), 'w') as file:
+            file.write("new file")
+        self.assertEqual(self.backup(), 1)
+        self.check_totals()
+
+    def test_compress_walks_once(self):
+        self.backup(compression=True)
+        self.assertEqual(self.backup(compression=True), 1)
+        self.check_totals()
+
+    def test_volumes_walk_once(self):
+        self.backup(compression=True, VolumeSize=1)
+        self.assertEqual(self.backup(compression=True, VolumeSize=1), 1)
+        self.check_totals()
+
+    def test_changed_folders_are_scanned(self):
+        self.backup()
+        other = os.path.join(os.path.dirname(self.source), "other")
+        make_tree(other, 3)
+        self.walks.clear()
+        config = {"Folders": [self.source, other], "Copies": 2, "Compression": False}
+        plan = plan_backup(config, "profile", 4, {self.destination: LocalStorage(self.destination)}, scan=False)
+        self.assertEqual(plan.files, 33)
+        self.assertEqual(len(self.walks), 2)
+
+
+class FreeSpaceTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source, 30)
+        os.makedirs(self.destination)
+        self.thread, self.icon = make_thread(self, tmp.name)
+        self.storage = LocalStorage(self.destination)
+        self.config = {"Folders": [self.source], "Copies": 2, "Compression": False}
+
+    def set_free_space(self, free_bytes):
+        patch = mock.patch.object(LocalStorage, "free_space", return_value=free_bytes)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def plan(self):
+        return plan_backup(self.config, "profile", 4, {self.destination: self.storage})
+
+    def test_pruned_slot_is_not_free_space(self):
+        for _ in range(2):
+            run_cycle(self.thread, [self.source], self.destination, 2)
+        size = self.plan().bytes_to_write
+        self.set_free_space(size // 2)
+        plan = self.plan()
+        self.assertEqual(plan.get_free_after(self.destination), size // 2 - size)
+        # The oldest slot is as big as the new one, the backup fits once it's deleted.
+        self.assertTrue(plan.needs_reclaim(self.destination))
+        self.assertEqual(plan.fitting_destinations, [self.destination])
+
+    def test_trash_is_counted_when_tight(self):
+        run_cycle(self.thread, [self.source], self.destination, 2)
+        self.thread.reaper.stop()
+        # A slot pruned earlier and not deleted yet.
+        os.makedirs(os.path.join(self.destination, TRASH_FOLDER))
+        os.rename(os.path.join(self.destination, "source_0"), os.path.join(self.destination, TRASH_FOLDER, "old"))
+        size = self.plan().bytes_to_write
+        self.set_free_space(0)
+        self.assertEqual(self.plan().destinations[self.destination]["trash_bytes"], size)
+        self.assertTrue(self.plan().needs_reclaim(self.destination))
+
+    def test_tight_backup_deletes_trash_first(self):
+        for _ in range(2):
+            run_cycle(self.thread, [self.source], self.destination, 2)
+        # Stopped, so only the backup itself can delete the pruned slot.
+        self.thread.reaper.stop()
+        self.set_free_space(self.plan().bytes_to_write - 1)
+        self.assertTrue(run_cycle(self.thread, [self.source], self.destination, 2))
+        self.assertEqual(self.icon.errors, [])
+        self.assertFalse(os.path.exists(os.path.join(self.destination, TRASH_FOLDER)))
+
+    def test_no_room_even_after_pruning(self):
+        run_cycle(self.thread, [self.source], self.destination, 2)
+        self.set_free_space(0)
+        self.assertEqual(self.plan().fitting_destinations, [])
+        self.assertIsNone(run_cycle(self.thread, [self.source], self.destination, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
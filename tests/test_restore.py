@@ -0,0 +1,63 @@
+import io
+import os
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from BackupScripts.Catalog import restore_file
+from BackupScripts.Encryption import Encryptor, encryption_available
+from BackupScripts.Storage import LocalStorage
+
+
+class RestoreFileTest(unittest.TestCase):
+    """Restoring one file out of a zip slot."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.destination = os.path.join(tmp.name, "destination")
+        self.restored = os.path.join(tmp.name, "restored")
+        os.makedirs(self.destination)
+        self.storage = LocalStorage(self.destination)
+        self.entry = {"slot": "source_0.zip", "kind": "zip", "volume": None, "path": "dir_0/file.txt",
+                      "mtime": 1700000000}
+
+    def write_zip(self, encryptor=None):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as zipf:
+            zipf.writestr("dir_0/file.txt", "data")
+            zipf.writestr("dir_1/other.txt", "other" * 1000)
+        with open(self.storage.get_path(self.entry["slot"]), 'wb') as file:
+            output = encryptor.wrap(file) if encryptor is not None else file
+            output.write(data.getvalue())
+            if encryptor is not None:
+                output.finish()
+
+    def check_restored(self, restored):
+        self.assertEqual(restored, os.path.join(self.restored, "dir_0", "file.txt"))
+        with open(restored) as file:
+            self.assertEqual(file.read(), "data")
+        self.assertEqual(os.path.getmtime(restored), self.entry["mtime"])
+        self.assertFalse(os.path.exists(os.path.join(self.restored, "dir_1")))
+
+    def test_local_zip_is_read_in_place(self):
+        self.write_zip()
+        with mock.patch.object(LocalStorage, "get") as get:
+            self.check_restored(restore_file(self.entry, self.storage, self.restored))
+        get.assert_not_called()
+
+    @unittest.skipUnless(encryption_available(), "the 'cryptography' package isn't installed")
+    def test_local_encrypted_zip_is_decrypted(self):
+        encryptor = Encryptor(os.urandom(32), chunk_size=1024)
+        self.addCleanup(encryptor.shutdown)
+        self.write_zip(encryptor)
+        with mock.patch.object(LocalStorage, "get") as get:
+            self.check_restored(restore_file(self.entry, self.storage, self.restored, encryptor))
+        get.assert_not_called()
+        with self.assertRaises(ValueError):
+            restore_file(self.entry, self.storage, self.restored)
+
+
+if __name__ == '__main__':
+    unittest.main()
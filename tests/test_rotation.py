@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+from BackupScripts.Utils import RESERVED_FOLDERS, STAGING_FOLDER
+from tests.helpers import make_thread, make_tree, run_cycle
+
+
+class RotationTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source)
+        os.makedirs(self.destination)
+        self.thread, self.icon = make_thread(self, tmp.name)
+
+    def get_slots(self):
+        return sorted(i for i in os.listdir(self.destination) if i not in RESERVED_FOLDERS)
+
+    def get_staged(self):
+        staging = os.path.join(self.destination, STAGING_FOLDER)
+        return os.listdir(staging) if os.path.isdir(staging) else []
+
+    def backup(self, copies, compression=False):
+        result = run_cycle(self.thread, [self.source], self.destination, copies, compression)
+        self.assertEqual(self.icon.errors, [])
+        return result
+
+    def test_rotates_through_copies(self):
+        for _ in range(5):
+            self.backup(3)
+        self.assertEqual(self.get_slots(), ["source_0", "source_1", "source_2"])
+        self.assertEqual(len(os.listdir(os.path.join(self.destination, "source_1", "dir_0"))), 4)
+
+    def test_lowering_copies(self):
+        for _ in range(3):
+            self.backup(3)
+        for _ in range(4):
+            self.assertTrue(self.backup(2))
+            self.assertEqual(len(self.get_slots()), 2)
+        self.assertEqual(self.get_staged(), [])
+
+    def test_lowering_copies_compressed(self):
+        for _ in range(3):
+            self.backup(3, compression=True)
+        self.assertEqual(self.get_slots(), ["profile_0.zip", "profile_1.zip", "profile_2.zip"])
+        for _ in range(4):
+            self.assertTrue(self.backup(1, compression=True))
+            self.assertEqual(len(self.get_slots()), 1)
+        self.assertEqual(self.get_staged(), [])
+
+    def test_gap_in_digits(self):
+        for _ in range(2):
+            self.backup(3)
+        os.rename(os.path.join(self.destination, "source_1"), os.path.join(self.destination, "source_2"))
+        for _ in range(3):
+            self.backup(3)
+        self.assertEqual(self.get_slots(), ["source_0", "source_1", "source_2"])
+
+    def test_slot_in_the_way_is_replaced(self):
+        # A slot of the digit being written that rotation didn't prune, from a version that counted copies wrongly.
+        self.backup(3)
+        os.makedirs(os.path.join(self.destination, "source_1", "stale"))
+        self.thread.get_last_folder_digit = lambda folder_path, storage: 1
+        self.backup(3)
+        self.assertFalse(os.path.exists(os.path.join(self.destination, "source_1", "stale")))
+        self.assertEqual(self.get_staged(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from BackupScripts.Storage import COMMIT_MARKER, S3Storage, boto3
+from tests.helpers import make_thread, make_tree, run_cycle
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:  # The tests run against a local S3 server of moto
+    ThreadedMotoServer = None
+
+_BUCKET = "backups"
+
+
+@unittest.skipIf(boto3 is None or ThreadedMotoServer is None, "boto3 and moto[server] are needed")
+class S3StorageTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test",
+                                                   "AWS_DEFAULT_REGION": "us-east-1"})
+        cls.environ.start()
+        cls.server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.settings = {"endpoint_url": f"http://{host}:{port}", "part_size": 5 * 1024 * 1024,
+                        "max_connections": 4, "max_retries": 1}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.environ.stop()
+
+    def setUp(self):
+        self.storage = S3Storage(f"s3://{_BUCKET}/machine", self.settings)
+        self.storage.client.create_bucket(Bucket=_BUCKET)
+        self.addCleanup(self.empty_bucket)
+
+    def empty_bucket(self):
+        client = self.storage.client
+        for upload in client.list_multipart_uploads(Bucket=_BUCKET).get("Uploads", []):
+            client.abort_multipart_upload(Bucket=_BUCKET, Key=upload["Key"], UploadId=upload["UploadId"])
+        for item in client.list_objects_v2(Bucket=_BUCKET).get("Contents", []):
+            client.delete_object(Bucket=_BUCKET, Key=item["Key"])
+        client.delete_bucket(Bucket=_BUCKET)
+
+    def write(self, key, data):
+        with self.storage.open_write(key) as file:
+            # Written in pieces like a zip is, not a whole part at a time.
+            for i in range(0, len(data), 1000003):
+                file.write(data[i:i + 1000003])
+        self.storage.flush()
+
+    def test_multipart_upload(self):
+        data = os.urandom(1024 * 1024) * 12
+        self.write("profile_0.zip", data)
+        head = self.storage.client.head_object(Bucket=_BUCKET, Key="machine/profile_0.zip")
+        # Three parts, two full ones and what's left.
+        self.assertTrue(head["ETag"].strip('"').endswith("-3"))
+        self.assertEqual(self.storage.list("profile_0.zip"), [("profile_0.zip", len(data))])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "profile_0.zip")
+            self.storage.get("profile_0.zip", path)
+            with open(path, 'rb') as file:
+                self.assertEqual(file.read(), data)
+
+    def test_small_file_is_one_put(self):
+        self.write("folder_0/a.txt", b"data")
+        self.assertTrue(self.storage.client.head_object(
+            Bucket=_BUCKET, Key="machine/folder_0/a.txt")["ETag"].strip('"').isalnum())
+        self.assertEqual(self.storage.list("folder_0"), [("folder_0/a.txt", 4)])
+
+    def test_failed_upload_is_aborted(self):
+        file = self.storage.open_write("profile_1.zip")
+        file.write(os.urandom(6 * 1024 * 1024))
+        file.abort()
+        self.storage.flush()
+        self.assertEqual(self.storage.client.list_multipart_uploads(Bucket=_BUCKET).get("Uploads", []), [])
+        self.assertEqual(self.storage.list("profile_1.zip"), [])
+
+    def test_folder_slot_counts_once_committed(self):
+        key = self.storage.stage("folder_0")
+        self.write(f"{key}/a.txt", b"a")
+        self.write(f"{key}/sub/b.txt", b"bb")
+        self.assertEqual(self.storage.list_slots(), {})
+        self.storage.commit("folder_0")
+        self.assertEqual(list(self.storage.list_slots()), ["folder_0"])
+        self.assertIn((f"folder_0/{COMMIT_MARKER}", 0), self.storage.list("folder_0"))
+        self.assertEqual(self.storage.get_size("folder_0"), 3)
+
+    def test_discarded_slot_is_gone(self):
+        self.write("folder_1/a.txt", b"a")
+        self.storage.discard("folder_1")
+        self.assertEqual(self.storage.list("folder_1"), [])
+        self.assertEqual(self.storage.list_slots(), {})
+
+    def test_list_slots(self):
+        for slot in ["folder_1", "folder_10"]:
+            self.write(f"{slot}/a.txt", b"a")
+            self.storage.commit(slot)
+        self.write("profile_0.zip", b"zip")
+        self.storage.commit("profile_0.zip")
+        # Half written, never committed.
+        self.write("folder_2/a.txt", b"a")
+        # Outside of the destination's prefix.
+        self.storage.client.put_object(Bucket=_BUCKET, Key="other/folder_3/.committed", Body=b"")
+
+        slots = self.storage.list_slots()
+        self.assertEqual(sorted(slots), ["folder_1", "folder_10", "profile_0.zip"])
+        self.assertLessEqual(slots["folder_1"], slots["folder_10"])
+        self.assertEqual(sorted(self.storage.list("folder_1")),
+                         [(f"folder_1/{COMMIT_MARKER}", 0), ("folder_1/a.txt", 1)])
+        self.assertEqual(self.storage.get_copies("/data/folder"), {"folder_1": slots["folder_1"]})
+
+        self.storage.delete("folder_1")
+        self.assertEqual(sorted(self.storage.list_slots()), ["folder_10", "profile_0.zip"])
+        self.assertEqual(self.storage.list("folder_1"), [])
+
+    def test_backups_rotate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "source")
+            make_tree(source, 12)
+            thread, icon = make_thread(self, tmp)
+            thread.controller.s3_settings = self.settings
+            destination = f"s3://{_BUCKET}/machine"
+            for compression in [False, False, False, True, True, True]:
+                self.assertTrue(run_cycle(thread, [source], destination, 2, compression))
+            self.assertEqual(icon.errors, [])
+        self.assertEqual(sorted(self.storage.get_copies("source")), ["source_0", "source_1"])
+        self.assertEqual(len(self.storage.get_copies("profile")), 2)
+        self.assertEqual(len([key for key, size in self.storage.list("source_0") if key.endswith(".txt")]), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
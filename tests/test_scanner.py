@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from BackupScripts.Journal import ChangeJournal
+from BackupScripts.Scanner import scan_file_system
+from BackupScripts.Utils import STAGING_FOLDER
+from tests.helpers import make_thread, make_tree, run_cycle
+
+
+class MissingSourceTest(unittest.TestCase):
+    """A source folder that's gone is an error, not an empty backup."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source, 6)
+        os.makedirs(self.destination)
+        for patch in [mock.patch("BackupScripts.Planner.STATS_FILE", os.path.join(tmp.name, "stats.json")),
+                      mock.patch("BackupScripts.Utils.LOG_FILE", os.path.join(tmp.name, "log.csv"))]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_scan_raises(self):
+        shutil.rmtree(self.source)
+        with self.assertRaises(FileNotFoundError):
+            list(scan_file_system(self.source))
+
+    def test_unreadable_sub_folder_is_skipped(self):
+        real_scandir = os.scandir
+
+        def scandir(path):
+            if os.path.basename(path) == "dir_1":
+                raise PermissionError(path)
+            return real_scandir(path)
+
+        with mock.patch("os.scandir", scandir):
+            paths = [entry.relative_path for entry in scan_file_system(self.source)]
+        self.assertIn("dir_1", paths)
+        self.assertIn("dir_0/file_0.txt", paths)
+        self.assertFalse([i for i in paths if i.startswith("dir_1/")])
+
+    def test_journal_raises(self):
+        journal = ChangeJournal(self.source, path=os.path.join(self.tmp, "journal.db"))
+        self.addCleanup(journal.close)
+        list(journal.scan())
+        shutil.rmtree(self.source)
+        with self.assertRaises(FileNotFoundError):
+            list(journal.scan())
+
+    def test_cycle_writes_no_slot(self):
+        thread, icon = make_thread(self, self.tmp)
+        shutil.rmtree(self.source)
+        for compression in [False, True]:
+            with self.assertRaises(FileNotFoundError):
+                run_cycle(thread, [self.source], self.destination, 3, compression)
+        self.assertEqual([i for i in os.listdir(self.destination) if not i.startswith(".")], [])
+        staging = os.path.join(self.destination, STAGING_FOLDER)
+        self.assertEqual(os.listdir(staging) if os.path.isdir(staging) else [], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
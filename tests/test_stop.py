@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+from BackupScripts.BackupThread import BackupThread, get_backup_methods, get_storages
+from BackupScripts.Utils import STAGING_FOLDER
+from BackupScripts.Worker import BackupWorker
+from tests.helpers import make_thread, make_tree, run_cycle
+
+
+class StopTest(unittest.TestCase):
+    """Stopping a backup in the middle of a cycle."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source, 30)
+        os.makedirs(self.destination)
+        self.thread, self.icon = make_thread(self, tmp.name)
+        self.chunks = 0
+
+    def stop_after(self, chunks):
+        def throttle(size):
+            self.chunks += 1
+            if self.chunks == chunks:
+                self.thread.backup_event.set()
+        self.thread.progress.throttle = throttle
+
+    def get_slots(self):
+        return sorted(i for i in os.listdir(self.destination) if not i.startswith("."))
+
+    def test_copy_stops_mid_cycle(self):
+        self.assertTrue(run_cycle(self.thread, [self.source], self.destination, 3))
+        self.stop_after(5)
+        self.assertIsNone(run_cycle(self.thread, [self.source], self.destination, 3))
+        # Stopped at the chunk it was told to, the rest of the folder isn't read.
+        self.assertEqual(self.chunks, 5)
+        self.assertEqual(self.get_slots(), ["source_0"])
+        staging = os.path.join(self.destination, STAGING_FOLDER)
+        self.assertEqual(os.listdir(staging) if os.path.isdir(staging) else [], [])
+        self.assertEqual(self.icon.errors, [])
+
+    def test_compress_stops_mid_cycle(self):
+        self.stop_after(3)
+        self.assertIsNone(run_cycle(self.thread, [self.source], self.destination, 3, True))
+        self.assertEqual(self.chunks, 3)
+        self.assertEqual(self.get_slots(), [])
+        self.assertEqual(self.icon.errors, [])
+
+    def test_volumes_stop_mid_cycle(self):
+        self.stop_after(3)
+        self.assertIsNone(run_cycle(self.thread, [self.source], self.destination, 3, True, SplitFolders=True))
+        self.assertEqual(self.get_slots(), [])
+        self.assertEqual(self.icon.errors, [])
+
+
+class SharedMethodsTest(unittest.TestCase):
+    def test_worker_and_thread_share_them(self):
+        self.assertEqual(BackupWorker.get_backup_methods(), get_backup_methods())
+        self.assertEqual(BackupThread.get_backup_methods(), ["Rotate", "Daily"])
+
+    def test_get_storages_leaves_out_failed(self):
+        icon_messages = []
+
+        class Icon:
+            @staticmethod
+            def notify_user(header, message, **kwargs):
+                icon_messages.append(header)
+
+        def get_storage(destination):
+            if destination == "bad":
+                raise OSError("unreachable")
+            return destination.upper()
+
+        storages = get_storages({"Destination": ["a", "bad", "b"]}, get_storage, Icon())
+        self.assertEqual(storages, {"a": "A", "b": "B"})
+        self.assertEqual(icon_messages, ["ERROR:"])
+
+
+if __name__ == '__main__':
+    unittest.main()
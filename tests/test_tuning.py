@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from tests.helpers import make_thread, make_tree, run_cycle
+
+
+class TuningSampleTest(unittest.TestCase):
+    """What a backup cycle hands the ThroughputTuner to score its settings by."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "source")
+        self.destination = os.path.join(tmp.name, "destination")
+        make_tree(self.source, 20)
+        os.makedirs(self.destination)
+        self.thread, self.icon = make_thread(self, tmp.name)
+        clock = self.thread.clock
+        get_settings = self.thread.tuner.get_settings
+
+        def slow_calibration(*args):
+            # A calibration taking a minute, on the fake clock.
+            clock.skipped += 60
+            return get_settings(*args)
+
+        for patch in [mock.patch.object(self.thread.tuner, "get_settings", slow_calibration),
+                      mock.patch.object(self.thread.tuner, "record")]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_only_the_writing_is_timed(self):
+        for compression in [False, True]:
+            self.thread.tuner.record.reset_mock()
+            self.assertTrue(run_cycle(self.thread, [self.source], self.destination, 2, compression))
+            settings, bytes_read, seconds, cpu_seconds = self.thread.tuner.record.call_args.args
+            self.assertEqual(bytes_read, sum(4 * i for i in range(20)))
+            self.assertLess(seconds, 60)
+            self.assertGreater(seconds, 0)
+        self.assertEqual(self.icon.errors, [])
+
+    def test_throttled_cycle_is_left_out(self):
+        governor = self.thread.governor
+        self.thread.progress.throttle = lambda size: setattr(governor, "throttled", True)
+        self.assertTrue(run_cycle(self.thread, [self.source], self.destination, 2))
+        self.thread.tuner.record.assert_not_called()
+        # The next cycle starts at full speed again.
+        self.thread.progress.throttle = governor.throttle
+        self.assertTrue(run_cycle(self.thread, [self.source], self.destination, 2))
+        self.thread.tuner.record.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()